@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# vim: set expandtab sw=4 ts=4:
+#
+# Compare the size of the Keen.io events of a build job per data detail level
+#
+# Creates a build job with many substages (with the build properties of
+# the sample Travis CI job), and prints the number of events and the size
+# of the JSON encoded events (with project info), that
+# keenio.send_build_data_service() stores with each data detail level.
+#
+# Usage (from the project root) :
+#   PYTHONPATH=. python benchmarks/keen_data_detail.py [<substages>]
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division
+from __future__ import print_function
+import sys
+import json
+import keen
+from buildtimetrend import set_loglevel
+from buildtimetrend import keenio
+from buildtimetrend.settings import Settings
+from keen_project_info import create_build_job
+
+DEFAULT_SUBSTAGES = 500
+DATA_DETAIL_LEVELS = ("minimal", "basic", "compact", "full", "extended")
+
+
+class EventSizeWriter(object):
+
+    """Count the events and the size of the JSON encoded events."""
+
+    def __init__(self):
+        """Constructor."""
+        self.events = 0
+        self.size = 0
+        self.stage_size = 0
+
+    def add_event(self, event_collection, payload):
+        """Count a build job event."""
+        self.events += 1
+        self.size += len(json.dumps(keenio.add_project_info_dict(payload)))
+
+    def add_events(self, event_collection, payload):
+        """Count stage events."""
+        for event in keenio.add_project_info_list(payload):
+            size = len(json.dumps(event))
+            self.events += 1
+            self.size += size
+            self.stage_size += size
+
+
+def main(substages=DEFAULT_SUBSTAGES):
+    """Run benchmark."""
+    set_loglevel("ERROR")
+    Settings().set_project_name("buildtimetrend/python-lib")
+    keen.project_id = "1234abcd"
+    keen.write_key = "1234abcd"
+    build_job = create_build_job(substages)
+
+    print("{0:d} substages".format(substages))
+    for data_detail in DATA_DETAIL_LEVELS:
+        writer = EventSizeWriter()
+        keenio.send_build_data_service(build_job, data_detail, writer)
+
+        stage_events = writer.events - 1
+        print(
+            "{0:<8s}: {1:5d} events, {2:9.1f} kB, {3:6.0f} bytes"
+            " per stage event".format(
+                data_detail, writer.events, writer.size / 1024,
+                writer.stage_size / stage_events if stage_events else 0
+            )
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
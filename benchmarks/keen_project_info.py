@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# vim: set expandtab sw=4 ts=4:
+#
+# Benchmark adding project info to the Keen.io events of a build job
+#
+# Creates a build job with many substages (with the build properties of
+# the sample Travis CI job), and measures the duration, the number of
+# allocated memory blocks and the allocated size of adding project info
+# to the build job event and the substage events,
+# like keenio.send_build_data_service() does.
+#
+# Usage (from the project root) :
+#   PYTHONPATH=. python benchmarks/keen_project_info.py [<substages>]
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division
+from __future__ import print_function
+import sys
+import json
+import time
+import tracemalloc
+from buildtimetrend import keenio
+from buildtimetrend.buildjob import BuildJob
+from buildtimetrend.settings import Settings
+from buildtimetrend.stages import Stages
+from buildtimetrend.travis.parser import TravisData
+from buildtimetrend.travis.test.travis_test import JOB_DATA_PYTHON
+from buildtimetrend.travis.test.travis_test import LocalTravisConnector
+
+DEFAULT_SUBSTAGES = 500
+REPEAT = 10
+
+
+def create_build_job(substages):
+    """Return build job with the sample job properties and many substages."""
+    travis_data = TravisData(
+        'buildtimetrend/python-lib', 536, LocalTravisConnector()
+    )
+    travis_data.builds_data = {"builds": [{"event_type": "push"}]}
+    build_job = travis_data.current_job = BuildJob()
+    travis_data.process_job_data(json.loads(JOB_DATA_PYTHON))
+
+    stages = Stages()
+    for index in range(substages):
+        start = 1440000000 + index
+        # create_stage() adds the stage
+        stages.create_stage("script.{0:d}".format(index), start, start + 1)
+        stages.stages[-1]["command"] = "nosetests test_{0:d}.py".format(index)
+    build_job.add_stages(stages)
+
+    return build_job
+
+
+def add_project_info(job_event, stage_events):
+    """Add project info to the build job event and the substage events."""
+    return (
+        keenio.add_project_info_dict(job_event),
+        keenio.add_project_info_list(stage_events)
+    )
+
+
+def main(substages=DEFAULT_SUBSTAGES):
+    """Run benchmark."""
+    Settings().set_project_name("buildtimetrend/python-lib")
+    build_job = create_build_job(substages)
+    job_event = {"job": build_job.to_dict()}
+    stage_events = build_job.stages_to_list()
+
+    start = time.time()
+    for _ in range(REPEAT):
+        add_project_info(job_event, stage_events)
+    duration = (time.time() - start) / REPEAT
+
+    # memory allocated by the events with project info
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    events = add_project_info(job_event, stage_events)
+    snapshot_after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    allocations = snapshot_after.compare_to(snapshot_before, 'filename')
+    print(
+        "{0:d} substages : {1:.2f}ms, {2:d} allocated blocks,"
+        " {3:.1f} kB allocated, peak {4:.1f} kB ({5:d} events)".format(
+            substages, duration * 1000,
+            sum(stat.count_diff for stat in allocations
+                if stat.count_diff > 0),
+            sum(stat.size_diff for stat in allocations
+                if stat.size_diff > 0) / 1024,
+            peak / 1024, len(events[1]) + 1
+        )
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
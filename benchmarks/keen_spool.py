@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# vim: set expandtab sw=4 ts=4:
+#
+# Benchmark the latency of storing build job events in Keen.io
+#
+# Starts a local stand-in for the Keen.io API, that responds after
+# a configurable latency, and measures the time needed to store the events
+# of a build job (parsed from the sample Travis CI log) :
+# - direct : events are sent to Keen.io immediately
+# - spool : events are appended to an on-disk spool, a drainer sends them
+#           to Keen.io in batches, in a background thread
+#
+# Usage (from the project root) :
+#   PYTHONPATH=. python benchmarks/keen_spool.py [<requests>]
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division
+from __future__ import print_function
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import keen
+from buildtimetrend import set_loglevel
+from buildtimetrend import keenio
+from buildtimetrend.settings import Settings
+from buildtimetrend.spool import EventSpool
+from buildtimetrend.spool import SpoolDrainer
+from buildtimetrend.travis.parser import parse_job_log_data
+from buildtimetrend.travis.reparse import create_build_job
+from buildtimetrend.travis.test.travis_test import TRAVIS_LOG_FILE
+try:
+    # For Python 3.0 and later
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Fall back to Python 2's BaseHTTPServer
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+DEFAULT_REQUESTS = 50
+# latency (in seconds) of the stand-in Keen.io API
+KEEN_LATENCIES = (0.01, 0.05, 0.2)
+
+
+class KeenServer(ThreadingMixIn, HTTPServer):
+
+    """Local stand-in for the Keen.io API, responding after a latency."""
+
+    daemon_threads = True
+    latency = 0
+    posts = 0
+
+
+class KeenHandler(BaseHTTPRequestHandler):
+
+    """Handle a Keen.io API request."""
+
+    def do_POST(self):
+        """Read the events, wait and respond."""
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+        self.server.posts += 1
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(b'{"created": true}')
+
+    def log_message(self, *args):
+        """Don't log requests."""
+        pass
+
+
+def percentile(values, fraction):
+    """Return a percentile of a list of values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def store_build_jobs(build_job, requests, writer=None):
+    """Store the events of a build job, return latency of each request."""
+    latencies = []
+    for _ in range(requests):
+        start = time.time()
+        keenio.send_build_data_service(build_job, "full", writer)
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def run(build_job, requests, latency, server):
+    """Store build jobs directly and using the spool, print latencies."""
+    server.latency = latency
+
+    server.posts = 0
+    direct = store_build_jobs(build_job, requests)
+    direct_posts = server.posts
+
+    spool_dir = tempfile.mkdtemp()
+    try:
+        server.posts = 0
+        drainer = SpoolDrainer(spool_dir, interval=0.1)
+        drainer.start()
+        with EventSpool(spool_dir) as event_spool:
+            spooled = store_build_jobs(build_job, requests, event_spool)
+        start = time.time()
+        drainer.stop()
+        drain_duration = time.time() - start
+    finally:
+        shutil.rmtree(spool_dir)
+
+    for mode, latencies, posts in (("direct", direct, direct_posts),
+                                   ("spool", spooled, server.posts)):
+        print(
+            "Keen {0:4.0f}ms, {1:<6s}: request p50 {2:8.3f}ms,"
+            " p99 {3:8.3f}ms, {4:4d} Keen requests".format(
+                latency * 1000, mode,
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.99) * 1000, posts
+            )
+        )
+    print("Keen {0:4.0f}ms, drained {1:d} events, last batch after {2:.3f}s"
+          .format(latency * 1000, drainer.sent, drain_duration))
+
+
+def main(requests=DEFAULT_REQUESTS):
+    """Run benchmark with several Keen.io latencies."""
+    set_loglevel("ERROR")
+    Settings().set_project_name("buildtimetrend/python-lib")
+
+    with open(TRAVIS_LOG_FILE, 'rb') as log_file:
+        build_job = create_build_job(
+            parse_job_log_data(log_file.read()), {"job": "536.1"}
+        )
+
+    server = KeenServer(('127.0.0.1', 0), KeenHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    keen.project_id = "1234abcd"
+    keen.write_key = "1234abcd"
+    keen.base_url = "http://127.0.0.1:{0:d}".format(server.server_address[1])
+
+    try:
+        for latency in KEEN_LATENCIES:
+            run(build_job, requests, latency, server)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# vim: set expandtab sw=4 ts=4:
+#
+# Benchmark sending the stage events of build jobs with many substages
+#
+# Creates build jobs with many substages (with the build properties of
+# the sample Travis CI job), and sends the stage events to a stand-in for
+# keen.add_events(), that serialises the request and waits (latency) :
+# - list : all stage events are created and sent in one request
+#          (stages_to_list() and add_events())
+# - chunked : stage events are created lazily and sent in chunks,
+#             concurrently (iter_stages() and add_events_chunked())
+# Prints the duration, number of requests, size of the largest request
+# and the peak memory allocated while sending (tracemalloc).
+#
+# Usage (from the project root) :
+#   PYTHONPATH=. python benchmarks/keen_stage_upload.py [<substages> ...]
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division
+from __future__ import print_function
+import sys
+import json
+import time
+import threading
+import tracemalloc
+from buildtimetrend import set_loglevel
+from buildtimetrend import keenio
+from buildtimetrend.settings import Settings
+from keen_project_info import create_build_job
+
+DEFAULT_SUBSTAGES = (1000, 5000, 20000)
+# latency (in seconds) of a request
+LATENCY = 0.05
+
+
+class KeenStandIn(object):
+
+    """Stand-in for keen.add_events(), counting requests."""
+
+    def __init__(self):
+        """Constructor."""
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.max_request_size = 0
+
+    def add_events(self, event_collection, payload):
+        """Add project info, serialise request and wait."""
+        request = json.dumps(
+            {event_collection: keenio.add_project_info_list(payload)}
+        )
+        with self.lock:
+            self.requests += 1
+            self.max_request_size = max(self.max_request_size, len(request))
+        time.sleep(LATENCY)
+
+
+def send_list(build_job, keen_stand_in):
+    """Create all stage events, send them in one request."""
+    keen_stand_in.add_events("build_substages", build_job.stages_to_list())
+
+
+def send_chunked(build_job, keen_stand_in):
+    """Create stage events lazily, send them in chunks."""
+    keenio.add_events_chunked(
+        "build_substages", build_job.iter_stages(),
+        send_events=keen_stand_in.add_events
+    )
+
+
+def run(substages):
+    """Send stage events of a build job with both methods."""
+    build_job = create_build_job(substages)
+
+    for mode, send in (("list", send_list), ("chunked", send_chunked)):
+        keen_stand_in = KeenStandIn()
+        start = time.time()
+        send(build_job, keen_stand_in)
+        duration = time.time() - start
+
+        # tracing memory allocations slows down, measure separately
+        tracemalloc.start()
+        send(build_job, KeenStandIn())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        print(
+            "{0:6d} substages, {1:<7s}: {2:6.2f}s, {3:3d} requests,"
+            " largest {4:8.1f} kB, peak memory {5:8.1f} kB".format(
+                substages, mode, duration, keen_stand_in.requests,
+                keen_stand_in.max_request_size / 1024, peak / 1024
+            )
+        )
+
+
+def main(substages=DEFAULT_SUBSTAGES):
+    """Run benchmark."""
+    set_loglevel("ERROR")
+    Settings().set_project_name("buildtimetrend/python-lib")
+
+    for count in substages:
+        run(count)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main([int(count) for count in sys.argv[1:]])
+    else:
+        main()
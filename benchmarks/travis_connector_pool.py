@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# vim: set expandtab sw=4 ts=4:
+#
+# Benchmark Travis CI connector with and without connection pooling
+#
+# Retrieves job data and job logs from a local stand-in for the Travis CI API,
+# and reports the number of connections opened and the latency per request.
+#
+# Usage (from the project root) :
+#   PYTHONPATH=. python benchmarks/travis_connector_pool.py [<requests>]
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+from buildtimetrend.travis.connector import TravisConnector
+from buildtimetrend.travis.test.connector_test import LocalTravisServer
+
+THREADS = 4
+
+
+def request_job(connector, job_id):
+    """Retrieve job data and job log."""
+    connector.json_request("jobs/{}".format(job_id))
+    connector.download_job_log(job_id).read()
+
+
+def run(server, pool_size, requests, threads):
+    """Retrieve requests jobs, return duration and number of connections."""
+    connector = TravisConnector(pool_size)
+    connector.api_url = server.get_url()
+    server.connections = 0
+
+    start = time.time()
+    if threads > 1:
+        pool = ThreadPool(threads)
+        pool.map(lambda job_id: request_job(connector, job_id),
+                 range(requests))
+        pool.terminate()
+    else:
+        for job_id in range(requests):
+            request_job(connector, job_id)
+    duration = time.time() - start
+
+    connector.close()
+    return duration, server.connections
+
+
+def main(requests=200):
+    """Run benchmark."""
+    server = LocalTravisServer()
+    try:
+        for threads in (1, THREADS):
+            print("{0:d} jobs, {1:d} thread(s) :".format(requests, threads))
+            for name, pool_size in (("no pool", None), ("pooled", THREADS)):
+                duration, connections = run(
+                    server, pool_size, requests, threads
+                )
+                print(
+                    "{0:<8s}: {1:5d} connections, "
+                    "{2:.3f} ms per request".format(
+                        name, connections, duration * 1000 / requests / 2
+                    )
+                )
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
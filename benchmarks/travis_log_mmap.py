@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# vim: set expandtab sw=4 ts=4:
+#
+# Benchmark parsing a large Travis CI log file
+#
+# Generates a synthetic Travis CI log file, and compares the throughput and
+# the peak memory usage of reading the log file line by line with
+# parsing a memory mapped log file.
+#
+# Usage (from the project root) :
+#   PYTHONPATH=. python benchmarks/travis_log_mmap.py [<size_in_MB>]
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import time
+import resource
+import tempfile
+import subprocess
+from buildtimetrend.travis.parser import TravisData
+
+LOGFILE = 'buildtimetrend/test/test_sample_travis_log'
+DEFAULT_SIZE_MB = 2048
+MEGABYTE = 1024 * 1024
+FILLER_LINE = b"Downloading/unpacking some-package==1.2.3 (from -r req.txt" \
+    b" (line 4))\r\x1b[K  Downloading some-package-1.2.3.tar.gz (1.2MB)\n"
+
+
+def generate_log(filename, size_mb):
+    """
+    Generate a synthetic log file.
+
+    The sample Travis CI log is followed by build output without tags,
+    until the requested size is reached.
+    """
+    with open(LOGFILE, 'rb') as sample_log:
+        sample = sample_log.read()
+
+    filler_block = FILLER_LINE * (MEGABYTE // len(FILLER_LINE))
+
+    with open(filename, 'wb') as log_file:
+        log_file.write(sample)
+        written = len(sample)
+        while written < size_mb * MEGABYTE:
+            log_file.write(filler_block)
+            written += len(filler_block)
+
+
+def parse_log(filename, use_mmap):
+    """Parse log file and print duration, number of stages and peak RSS."""
+    travis_data = TravisData('buildtimetrend/python-lib', 1)
+    travis_data.current_job.set_started_at("2014-08-17T13:40:14Z")
+
+    start = time.time()
+    travis_data.parse_job_log_file(filename, use_mmap)
+    duration = time.time() - start
+
+    # ru_maxrss is expressed in kilobytes on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(duration, len(travis_data.current_job.stages.stages), max_rss)
+
+
+def main(size_mb=DEFAULT_SIZE_MB):
+    """Run benchmark, each mode is run in a separate process."""
+    log_file = tempfile.NamedTemporaryFile(suffix='.log', delete=False)
+    log_file.close()
+
+    try:
+        generate_log(log_file.name, size_mb)
+        file_size = os.path.getsize(log_file.name) / MEGABYTE
+        print("Log file size : {0:.0f} MB".format(file_size))
+
+        for mode, use_mmap in (("stream", ""), ("mmap", "mmap")):
+            output = subprocess.check_output([
+                sys.executable, __file__, "--parse", log_file.name, use_mmap
+            ])
+            duration, stages, max_rss = output.split()
+            print(
+                "{0:<7s}: {1:7.2f}s, {2:7.1f} MB/s,"
+                " {3:s} stages, peak RSS {4:.1f} MB".format(
+                    mode, float(duration), file_size / float(duration),
+                    stages.decode('utf-8'), int(max_rss) / 1024
+                )
+            )
+    finally:
+        os.remove(log_file.name)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--parse":
+        parse_log(sys.argv[2], len(sys.argv) > 3 and sys.argv[3] == "mmap")
+    elif len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
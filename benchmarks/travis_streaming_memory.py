@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# vim: set expandtab sw=4 ts=4:
+#
+# Benchmark the memory usage of processing a build with many jobs
+#
+# Processes a build with 500 jobs (each with the sample Travis CI log),
+# and compares the peak memory usage of keeping all processed build jobs
+# in TravisData.build_jobs with streaming mode, that doesn't keep them.
+#
+# Usage (from the project root) :
+#   PYTHONPATH=. python benchmarks/travis_streaming_memory.py [<jobs>]
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import sys
+import time
+import resource
+import subprocess
+from buildtimetrend import set_loglevel
+from buildtimetrend.travis.parser import TravisData
+from buildtimetrend.travis.test.travis_test import LocalTravisConnector
+
+DEFAULT_JOBS = 500
+
+
+def process_build(jobs, streaming):
+    """Process build jobs and print duration, number of jobs and peak RSS."""
+    set_loglevel("ERROR")
+    travis_data = TravisData(
+        'buildtimetrend/python-lib', 536, LocalTravisConnector(),
+        streaming=streaming
+    )
+    travis_data.builds_data = {
+        "builds": [{"job_ids": list(range(1, jobs + 1)), "event_type": "push"}]
+    }
+
+    start = time.time()
+    processed = 0
+    for build_job in travis_data.process_build_jobs():
+        # use the build job, like sending it to Keen.io would
+        build_job.to_dict()
+        processed += 1
+    duration = time.time() - start
+
+    # ru_maxrss is expressed in kilobytes on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(duration, processed, max_rss)
+
+
+def main(jobs=DEFAULT_JOBS):
+    """Run benchmark, each mode is run in a separate process."""
+    for mode, streaming in (("keep", ""), ("stream", "stream")):
+        output = subprocess.check_output([
+            sys.executable, __file__, "--process", str(jobs), streaming
+        ])
+        duration, processed, max_rss = output.split()
+        print(
+            "{0:<7s}: {1:7.2f}s, {2:s} jobs, peak RSS {3:.1f} MB".format(
+                mode, float(duration), processed.decode('utf-8'),
+                int(max_rss) / 1024
+            )
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--process":
+        process_build(
+            int(sys.argv[2]), len(sys.argv) > 3 and sys.argv[3] == "stream"
+        )
+    elif len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# vim: set expandtab sw=4 ts=4:
+#
+# Benchmark parsing Travis CI timing tags
+#
+# Compares the single-pass timing tag scanner with the previous approach
+# of searching each line with every timing tag pattern.
+#
+# Usage (from the project root) :
+#   PYTHONPATH=. python benchmarks/travis_time_tags.py [<repeat>]
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import re
+import sys
+import timeit
+from buildtimetrend.travis.parser import scan_timing_tags
+
+LOGFILE = 'buildtimetrend/test/test_sample_travis_log'
+# timing tag patterns, as used before the single pass scanner was introduced
+LEGACY_PARSE_TIMING_STRINGS = [
+    r'travis_time:end:(?P<end_hash>.*):start=(?P<start_timestamp>\d+),'
+    r'finish=(?P<finish_timestamp>\d+),duration=(?P<duration>\d+)\x0d\x1b',
+    r'travis_fold:end:(?P<end_stage>\w+)\.(?P<end_substage>\d+)\x0d\x1b',
+    r'travis_fold:start:(?P<start_stage>\w+)\.(?P<start_substage>\d+)\x0d\x1b',
+    r'travis_time:start:(?P<start_hash>.*)\x0d\x1b\[0K',
+    r'\$\ (?P<command>.*)\r',
+]
+# log line with incomplete tags, not terminated by a carriage return
+LONG_LINE = "$ " * 4000 + "travis_time:start:" * 4000 + "\n"
+
+
+def scan_legacy(lines):
+    """Search each line with every timing tag pattern."""
+    tags = []
+    for line in lines:
+        escaped_line = line.replace('\x0d', '*').replace('\x1b', 'ESC')
+        for parse_string in LEGACY_PARSE_TIMING_STRINGS:
+            result = re.search(parse_string, line)
+            if result:
+                tags.append(result.groupdict())
+    return tags
+
+
+def scan_single_pass(lines):
+    """Scan each line once with the compiled timing tag scanner."""
+    tags = []
+    for line in lines:
+        tags.extend(scan_timing_tags(line))
+    return tags
+
+
+def main(repeat=5):
+    """Run benchmark."""
+    with open(LOGFILE, 'rb') as file_stream:
+        lines = [
+            line.decode('utf-8') for line in file_stream if b'travis_' in line
+        ]
+
+    print("Lines with timing tags : {0:d}".format(len(lines)))
+    for name, function in (
+            ("legacy", scan_legacy), ("single pass", scan_single_pass)):
+        timer = timeit.Timer(lambda: function(lines))
+        best = min(timer.repeat(repeat=repeat, number=100))
+        print("{0:<12s}: {1:.2f} ms per log".format(name, best * 10))
+
+    # matching time of the legacy patterns grows quadratically on long lines
+    print("Long line ({0:d} kB) :".format(len(LONG_LINE) // 1024))
+    for name, function in (
+            ("legacy", scan_legacy), ("single pass", scan_single_pass)):
+        timer = timeit.Timer(lambda: function([LONG_LINE]))
+        best = min(timer.repeat(repeat=repeat, number=1))
+        print("{0:<12s}: {1:.2f} ms".format(name, best * 1000))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
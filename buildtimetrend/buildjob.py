@@ -29,6 +29,11 @@ from buildtimetrend.stages import Stages
 from buildtimetrend.collection import Collection
 from buildtimetrend.tools import split_isotimestamp
 
+# build properties in compact stage events :
+# repo and job refer to the build job event,
+# the others are used to filter stages in queries
+COMPACT_PROPERTIES = ("repo", "job", "build", "branch", "result")
+
 
 class BuildJob(object):
 
@@ -171,27 +176,74 @@ class BuildJob(object):
 
         return data
 
-    def stages_to_list(self):
-        """Return list of stages, all containing the build properties."""
-        if isinstance(self.stages, Stages):
-            # create list to be returned
-            data = []
+    def stages_to_list(self, compact=False):
+        """
+        Return list of stages, all containing the build properties.
+
+        Parameters:
+        - compact : only add the build properties in COMPACT_PROPERTIES
+                    to each stage (a reference to the build job event)
+                    and set the event timestamp to finished_at of the job
+        """
+        return list(self.iter_stages(compact))
+
+    def iter_stages(self, compact=False):
+        """
+        Generator yielding the stages, all containing the build properties.
 
+        Each stage is copied when it is yielded, so the stages can be
+        processed (fe. sent) one by one, without creating all of them first.
+
+        Parameters:
+        - compact : only add the build properties in COMPACT_PROPERTIES
+                    to each stage (a reference to the build job event)
+                    and set the event timestamp to finished_at of the job
+        """
+        if not isinstance(self.stages, Stages):
+            return
+
+        keen_properties = None
+        if compact:
+            build_properties, keen_properties = self.get_compact_properties()
+        else:
             # get build properties
             build_properties = self.get_properties()
 
-            # iterate all stages
-            for stage in self.stages.stages:
-                temp = {}
-                # copy stage data
-                temp["stage"] = copy.deepcopy(stage)
-                # copy values of properties
-                # check if collection is empty
-                if build_properties:
-                    temp["job"] = build_properties
-                data.append(temp)
+        # iterate all stages
+        for stage in self.stages.stages:
+            temp = {}
+            # copy stage data
+            temp["stage"] = copy.deepcopy(stage)
+            # copy values of properties
+            # check if collection is empty
+            if build_properties:
+                temp["job"] = build_properties
+            if keen_properties is not None:
+                temp["keen"] = keen_properties
+            yield temp
+
+    def get_compact_properties(self):
+        """
+        Return the build properties and Keen.io properties of compact stages.
 
-        return data
+        Returns a tuple with a dictionary with the build properties in
+        COMPACT_PROPERTIES (a reference to the build job), and a dictionary
+        with the event timestamp (None if finished_at is not set).
+        """
+        job_reference = {}
+        for name in COMPACT_PROPERTIES:
+            value = self.properties.get_item(name)
+            if value is not None:
+                job_reference[name] = value
+
+        # stage events have the same timestamp as the build job event
+        finished_at = self.properties.get_item("finished_at") or \
+            self.stages.finished_at
+        keen_properties = None
+        if isinstance(finished_at, dict) and "isotimestamp" in finished_at:
+            keen_properties = {"timestamp": finished_at["isotimestamp"]}
+
+        return job_reference, keen_properties
 
     def to_xml(self):
         """Generate XML object of a BuildJob instance."""
@@ -39,13 +39,19 @@ class Collection(object):
         """
         Add an item to the collection.
 
+        A dictionary value is merged with an existing dictionary item,
+        the merged dictionary replaces the existing one, which isn't
+        modified because it can be shared with other collections.
+
         Parameters :
         - name : Item name
         - value : Item value
         """
         if check_dict(value) and name in self.items and \
                 check_dict(self.items[name]):
-            self.items[name].update(value)
+            merged_value = dict(self.items[name])
+            merged_value.update(value)
+            self.items[name] = merged_value
         else:
             self.items[name] = value
 
@@ -23,8 +23,14 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import division
 from builtins import str
+from builtins import object
 import os
-import copy
+import json
+import time
+import itertools
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
 import keen
 import math
 from datetime import datetime
@@ -44,6 +50,16 @@ TIME_INTERVALS = {
     'year': {'name': 'year', 'timeframe': 'this_52_weeks', 'max_age': 1800}
 }
 KEEN_PROJECT_INFO_NAME = "buildtime_trend"
+# EventWriter : number of events, size of the events (in bytes)
+# and age (in seconds) of the oldest event that trigger sending a batch
+DEFAULT_BATCH_EVENTS = 500
+DEFAULT_BATCH_BYTES = 1024 * 1024
+DEFAULT_BATCH_DELAY = 5
+# EventWriter : maximum number of batches waiting to be sent,
+# adding events blocks when the buffer is full
+DEFAULT_MAX_BATCHES = 4
+# add_events_chunked() : number of chunks of events sent concurrently
+DEFAULT_UPLOAD_WORKERS = 4
 
 
 def has_project_id():
@@ -141,14 +157,17 @@ def generate_write_key():
     return scoped_keys.encrypt(master_key, privileges)
 
 
-def send_build_data(buildjob, detail=None):
+def send_build_data(buildjob, detail=None, writer=None):
     """
     Send build data generated by client to keen.io.
 
     Parameters:
     - buildjob : BuildJob instance
     - detail : Data storage detail level :
-               'minimal', 'basic', 'full', 'extended'
+               'minimal', 'basic', 'compact', 'full', 'extended'
+    - writer : EventWriter instance, events are sent in batches,
+               or spool.EventSpool instance, events are stored in a spool
+               (default : events are sent immediately)
     """
     if not isinstance(buildjob, BuildJob):
         raise TypeError("param buildjob should be a BuildJob instance")
@@ -160,22 +179,28 @@ def send_build_data(buildjob, detail=None):
             "Sending client build job data to Keen.io (data detail: %s)",
             data_detail
         )
+        send_event, send_events = get_send_functions(writer)
+
         # store build job data
-        add_event("build_jobs", {"job": buildjob.to_dict()})
+        send_event("build_jobs", {"job": buildjob.to_dict()})
 
         # store build stages
-        if data_detail in ("full", "extended"):
-            add_events("build_stages", buildjob.stages_to_list())
+        stage_events = get_stage_events(buildjob, data_detail)
+        if stage_events is not None:
+            send_events("build_stages", stage_events)
 
 
-def send_build_data_service(buildjob, detail=None):
+def send_build_data_service(buildjob, detail=None, writer=None):
     """
     Send build data generated by service to keen.io.
 
     Parameters:
     - buildjob : BuildJob instance
     - detail : Data storage detail level :
-               'minimal', 'basic', 'full', 'extended'
+               'minimal', 'basic', 'compact', 'full', 'extended'
+    - writer : EventWriter instance, events are sent in batches,
+               or spool.EventSpool instance, events are stored in a spool
+               (default : events are sent immediately)
     """
     if not isinstance(buildjob, BuildJob):
         raise TypeError("param buildjob should be a BuildJob instance")
@@ -187,9 +212,59 @@ def send_build_data_service(buildjob, detail=None):
             "Sending service build job data to Keen.io (data detail: %s)",
             data_detail
         )
-        add_event("build_jobs", {"job": buildjob.to_dict()})
-        if data_detail in ("full", "extended"):
-            add_events("build_substages", buildjob.stages_to_list())
+        send_event, send_events = get_send_functions(writer)
+
+        send_event("build_jobs", {"job": buildjob.to_dict()})
+        stage_events = get_stage_events(buildjob, data_detail)
+        if stage_events is not None:
+            send_events("build_substages", stage_events)
+
+
+def get_stage_events(buildjob, data_detail):
+    """
+    Return the stage events of a build job, for a data storage detail level.
+
+    Stage events contain all build properties with detail level 'full' or
+    'extended', only a reference to the build job with level 'compact'.
+    Returns a generator, creating the stage events when they are sent,
+    or None if stages are not stored at the detail level.
+
+    Parameters:
+    - buildjob : BuildJob instance
+    - data_detail : Data storage detail level :
+                    'minimal', 'basic', 'compact', 'full', 'extended'
+    """
+    if data_detail in ("full", "extended"):
+        return buildjob.iter_stages()
+    elif data_detail == "compact":
+        return buildjob.iter_stages(compact=True)
+
+    return None
+
+
+def get_send_functions(writer=None):
+    """
+    Return the functions sending a single event and a list of events.
+
+    The function sending a list of events accepts any iterable (fe. a
+    generator) and sends the events in chunks.
+
+    Parameters:
+    - writer : EventWriter instance, events are sent in batches
+               (default : add_event() and add_events_chunked(),
+               sending immediately)
+    """
+    if writer is None:
+        return add_event, add_events_chunked
+
+    def write_events(event_collection, payload):
+        """Pass events to the writer in chunks, the writer batches them."""
+        return add_events_chunked(
+            event_collection, payload, chunk_bytes=None, max_workers=1,
+            send_events=writer.add_events
+        )
+
+    return writer.add_event, write_events
 
 
 def add_event(event_collection, payload):
@@ -228,24 +303,191 @@ def add_events(event_collection, payload):
     )
 
 
-def add_project_info_dict(payload):
+def add_events_chunked(event_collection, payload,
+                       chunk_events=DEFAULT_BATCH_EVENTS,
+                       chunk_bytes=DEFAULT_BATCH_BYTES,
+                       max_workers=DEFAULT_UPLOAD_WORKERS, send_events=None):
+    """
+    Send events in chunks, several chunks are sent concurrently.
+
+    Events are taken from payload when a chunk is created, so the number of
+    events in memory is limited to the chunks being sent, if payload is
+    a generator. At most max_workers chunks are sent concurrently,
+    creating the next chunk waits until a chunk is sent.
+    Raises the first error of sending a chunk, after the chunks that were
+    being sent are done (the next chunks are not sent).
+
+    Returns the number of sent events.
+
+    Parameters:
+    - event_collection : collection event data is submitted to
+    - payload : iterable with events (dictionaries)
+    - chunk_events : maximum number of events in a chunk
+    - chunk_bytes : maximum size of the JSON encoded events in a chunk,
+                    including project info (None : not limited)
+    - max_workers : maximum number of chunks sent concurrently
+    - send_events : function sending a list of events,
+                    called with collection and list
+                    (default : add_events(), adds project info)
+    """
+    if send_events is None:
+        send_events = add_events
+
+    event_overhead = 0
+    if chunk_bytes is not None:
+        # project info is added to each event
+        event_overhead = len(json.dumps({
+            KEEN_PROJECT_INFO_NAME: Settings().get_project_info()
+        }))
+
+    chunks = get_event_chunks(
+        payload, chunk_events, chunk_bytes, event_overhead
+    )
+
+    # send sequentially if there is only one chunk
+    first_chunks = list(itertools.islice(chunks, 2))
+    chunks = itertools.chain(first_chunks, chunks)
+    if max_workers <= 1 or len(first_chunks) < 2:
+        sent = 0
+        for chunk in chunks:
+            send_events(event_collection, chunk)
+            sent += len(chunk)
+        return sent
+
+    slots = threading.BoundedSemaphore(max_workers)
+    errors = []
+    sent = 0
+
+    def send_chunk(chunk):
+        """Send a chunk, store error, free slot for next chunk."""
+        try:
+            # don't send the remaining chunks after an error
+            if not errors:
+                send_events(event_collection, chunk)
+        except Exception as msg:
+            errors.append(msg)
+        finally:
+            slots.release()
+
+    pool = ThreadPool(max_workers)
+    try:
+        for chunk in chunks:
+            slots.acquire()
+            if errors:
+                slots.release()
+                break
+            pool.apply_async(send_chunk, (chunk,))
+            sent += len(chunk)
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+
+    if errors:
+        raise errors[0]
+
+    # all chunks were sent
+    return sent
+
+
+def get_event_chunks(payload, chunk_events=DEFAULT_BATCH_EVENTS,
+                     chunk_bytes=None, event_overhead=0):
+    """
+    Generator splitting events in chunks, yielding a list per chunk.
+
+    A chunk with a single event can be larger than chunk_bytes.
+
+    Parameters:
+    - payload : iterable with events (dictionaries)
+    - chunk_events : maximum number of events in a chunk
+    - chunk_bytes : maximum size of the JSON encoded events in a chunk
+                    (None : not limited)
+    - event_overhead : size (in bytes) added to each event when it is sent
+    """
+    chunk = []
+    chunk_size = 0
+    # sizes of the values of the previous event
+    value_sizes = {}
+
+    for event in payload:
+        event_size = 0
+        if chunk_bytes is not None:
+            event_size = get_event_size(event, value_sizes) + event_overhead
+
+        if chunk and (len(chunk) >= chunk_events or (
+                chunk_bytes is not None and
+                chunk_size + event_size > chunk_bytes)):
+            yield chunk
+            chunk = []
+            chunk_size = 0
+
+        chunk.append(event)
+        chunk_size += event_size
+
+    if chunk:
+        yield chunk
+
+
+def get_event_size(event, value_sizes=None):
+    """
+    Return the size of a JSON encoded event (in bytes).
+
+    The size of values that are the same object as in the previous event
+    (fe. the build properties shared by stage events) is not encoded again.
+
+    Parameters:
+    - event : event dictionary
+    - value_sizes : dictionary with the value and its size per key,
+                    of the previous event, updated with the values of event
+    """
+    if value_sizes is None or not isinstance(event, dict):
+        return len(json.dumps(event))
+
+    # braces, and ", " between items
+    size = 2 + 2 * max(0, len(event) - 1)
+    for key, value in event.items():
+        previous = value_sizes.get(key)
+        if previous is not None and previous[0] is value:
+            value_size = previous[1]
+        else:
+            value_size = len(json.dumps(value))
+            value_sizes[key] = (value, value_size)
+        # key and ": "
+        size += len(json.dumps(key)) + 2 + value_size
+
+    return size
+
+
+def add_project_info_dict(payload, project_info=None,
+                          repo_project_info=None):
     """
     Add project info to a dictonary.
 
-    Param payload: dictonary payload
+    The payload is not copied deeply, the returned dictionary shares
+    its values with the payload (and the project info with other events),
+    so they shouldn't be modified afterwards.
+
+    Parameters:
+    - payload : dictonary payload
+    - project_info : project info dictionary
+                     (default : Settings().get_project_info())
+    - repo_project_info : dictionary with project info per repo,
+                          shared by the events of a batch
     """
     # check if payload is a dictionary, throws an exception if it isn't
     check_dict(payload, "payload")
 
-    payload_as_dict = copy.deepcopy(payload)
+    if project_info is None:
+        project_info = Settings().get_project_info()
 
-    payload_as_dict[KEEN_PROJECT_INFO_NAME] = Settings().get_project_info()
+    payload_as_dict = dict(payload)
 
     if "job" in payload:
         # override project_name, set to build_job repo
         if "repo" in payload["job"]:
-            payload_as_dict[KEEN_PROJECT_INFO_NAME]["project_name"] = \
-                payload["job"]["repo"]
+            project_info = get_repo_project_info(
+                project_info, payload["job"]["repo"], repo_project_info
+            )
 
         # override timestamp, set to finished_at timestamp
         if "finished_at" in payload["job"]:
@@ -253,6 +495,8 @@ def add_project_info_dict(payload):
                 "timestamp": payload["job"]["finished_at"]["isotimestamp"]
             }
 
+    payload_as_dict[KEEN_PROJECT_INFO_NAME] = project_info
+
     return payload_as_dict
 
 
@@ -260,18 +504,360 @@ def add_project_info_list(payload):
     """
     Add project info to a list of dictionaries.
 
+    The project info is created once, and shared by the events.
+
     Param payload: list of dictionaries
     """
     # check if payload is a list, throws an exception if it isn't
     is_list(payload, "payload")
 
-    payload_as_list = []
+    project_info = Settings().get_project_info()
+    repo_project_info = {}
 
     # loop over dicts in payload and add project info to each one
-    for event_dict in payload:
-        payload_as_list.append(add_project_info_dict(event_dict))
+    return [
+        add_project_info_dict(event_dict, project_info, repo_project_info)
+        for event_dict in payload
+    ]
+
+
+def get_repo_project_info(project_info, repo, repo_project_info=None):
+    """
+    Return project info with the project name set to a repo.
+
+    Parameters:
+    - project_info : project info dictionary
+    - repo : repo name (fe. buildtimetrend/python-lib)
+    - repo_project_info : dictionary with project info per repo,
+                          reused if it contains the repo
+    """
+    if project_info.get("project_name") == repo:
+        return project_info
+
+    if repo_project_info is None:
+        repo_project_info = {}
+
+    if repo not in repo_project_info:
+        repo_project_info[repo] = dict(project_info, project_name=repo)
+
+    return repo_project_info[repo]
+
+
+class EventTracker(object):
+
+    """
+    Track the delivery of the events added by a thread, within a with block.
 
-    return payload_as_list
+    Use EventWriter.track() to create a tracker.
+    """
+
+    def __init__(self, local=None):
+        """
+        Constructor.
+
+        Parameters:
+        - local : thread local data of the writer the tracker is set in
+                  (None : the writer doesn't track events, they are
+                  delivered when they are added)
+        """
+        self.local = local
+        self.previous = None
+        # number of events that are buffered or being sent
+        self.pending = 0
+        # number of events that failed to be sent
+        self.failed = 0
+
+    def __enter__(self):
+        """Enter context, track the events added by the current thread."""
+        if self.local is not None:
+            self.previous = getattr(self.local, "tracker", None)
+            self.local.tracker = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit context, stop tracking."""
+        if self.local is not None:
+            self.local.tracker = self.previous
+            self.previous = None
+
+    def is_done(self):
+        """Check if all tracked events are sent, or failed to be sent."""
+        return self.pending == 0
+
+    def is_sent(self):
+        """Check if all tracked events are sent."""
+        return self.pending == 0 and self.failed == 0
+
+
+class EventWriter(object):
+
+    """
+    Send events to Keen.io in batches, from a background thread.
+
+    Events of all collections are buffered, and sent in batches
+    with keen.add_events(), when the number of buffered events or their
+    size reaches a threshold, or when the oldest event waited too long.
+    Each call sends one batch, of at most batch_events events
+    and batch_bytes bytes (unless a single event is larger).
+    When the buffer holds max_batches batches (fe. when Keen.io is slow),
+    adding events blocks until a batch is sent, so memory use is bounded.
+    Call flush() to send all buffered events,
+    and close() to stop the background thread, both return the number of
+    events that failed to be sent.
+    Use track() to check if the events added in a with block were sent.
+    """
+
+    def __init__(self, batch_events=DEFAULT_BATCH_EVENTS,
+                 batch_bytes=DEFAULT_BATCH_BYTES,
+                 batch_delay=DEFAULT_BATCH_DELAY,
+                 max_batches=DEFAULT_MAX_BATCHES, send_events=None):
+        """
+        Constructor.
+
+        Parameters:
+        - batch_events : number of events that triggers sending a batch,
+                         and the maximum number of events in a batch
+        - batch_bytes : size of the events (in bytes, JSON encoded)
+                        that triggers sending a batch,
+                        and the maximum size of a batch
+        - batch_delay : maximum time (in seconds) an event is buffered
+        - max_batches : maximum number of batches in the buffer
+        - send_events : function sending a dictionary with a list of events
+                        per collection (default : keen.add_events())
+        """
+        self.batch_events = batch_events
+        self.batch_bytes = batch_bytes
+        self.batch_delay = batch_delay
+        self.max_events = batch_events * max_batches
+        self.max_bytes = batch_bytes * max_batches
+        self.send_events = send_events or keen.add_events
+
+        self.condition = threading.Condition()
+        # buffered events, tuples with collection, event, size and tracker
+        self.events = deque()
+        # tracker of the current thread, set by EventTracker
+        self.local = threading.local()
+        self.event_count = 0
+        self.event_bytes = 0
+        self.first_event_at = None
+        # number of events that are being sent
+        self.sending = 0
+        self.flush_requested = False
+        self.closed = False
+        self.thread = None
+
+        # number of sent and failed events
+        self.sent = 0
+        self.failed = 0
+        # number of failed events, reported by the next flush()
+        self.unreported_failed = 0
+
+    def track(self):
+        """
+        Create an EventTracker for the events added by the current thread.
+
+        Use the tracker as context manager, the events added
+        within the with block are tracked.
+        """
+        return EventTracker(self.local)
+
+    def add_event(self, event_collection, payload):
+        """
+        Add project info to an event and add it to the buffer.
+
+        Parameters:
+        - event_collection : collection event data is submitted to
+        - payload : data that is submitted
+        """
+        self.add_events(event_collection, [payload])
+
+    def add_events(self, event_collection, payload):
+        """
+        Add project info to each event and add them to the buffer.
+
+        Blocks while the buffer is full.
+
+        Parameters:
+        - event_collection : collection event data is submitted to
+        - payload : list of events that is submitted
+        """
+        events = add_project_info_list(payload)
+        if not events:
+            return
+        # size of the events, as sent to Keen.io
+        sizes = [len(json.dumps(event)) for event in events]
+        size = sum(sizes)
+
+        with self.condition:
+            if self.closed:
+                raise ValueError("EventWriter is closed")
+            self._start()
+
+            # wait until there is room in the buffer,
+            # an event larger than the buffer is added to an empty buffer
+            while self.event_count > 0 and \
+                    (self.event_count + len(events) > self.max_events or
+                     self.event_bytes + size > self.max_bytes):
+                self.condition.wait()
+
+            if self.event_count == 0:
+                self.first_event_at = time.time()
+            tracker = getattr(self.local, "tracker", None)
+            if tracker is not None:
+                tracker.pending += len(events)
+            self.events.extend(
+                (event_collection, event, event_size, tracker)
+                for event, event_size in zip(events, sizes)
+            )
+            self.event_count += len(events)
+            self.event_bytes += size
+            self.condition.notify_all()
+
+    def flush(self):
+        """
+        Send all buffered events, wait until they are sent.
+
+        Returns the number of events that failed to be sent
+        since the previous flush.
+        """
+        with self.condition:
+            if self.thread is not None:
+                self.flush_requested = True
+                self.condition.notify_all()
+                while self.event_count > 0 or self.sending > 0:
+                    self.condition.wait()
+                self.flush_requested = False
+
+            failed = self.unreported_failed
+            self.unreported_failed = 0
+            return failed
+
+    def close(self):
+        """
+        Send all buffered events, and stop the background thread.
+
+        Returns the number of events that failed to be sent
+        since the previous flush.
+        """
+        failed = self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return failed
+
+    def __enter__(self):
+        """Enter context, returns the writer."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit context, send buffered events and stop."""
+        self.close()
+
+    def _start(self):
+        """Start the background thread, if it isn't running."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _is_batch_ready(self):
+        """Check if the buffered events should be sent."""
+        if self.event_count == 0:
+            return False
+
+        return self.flush_requested or self.closed or \
+            self.event_count >= self.batch_events or \
+            self.event_bytes >= self.batch_bytes or \
+            time.time() - self.first_event_at >= self.batch_delay
+
+    def _run(self):
+        """Send batches of events, until the writer is closed."""
+        while True:
+            with self.condition:
+                while not self._is_batch_ready():
+                    if self.closed:
+                        return
+                    if self.event_count == 0:
+                        self.condition.wait()
+                    else:
+                        self.condition.wait(max(
+                            0, self.first_event_at + self.batch_delay -
+                            time.time()
+                        ))
+
+                batch, trackers = self._take_batch()
+                count = len(trackers)
+                self.sending = count
+                # there is room in the buffer again
+                self.condition.notify_all()
+
+            sent = self._send_batch(batch, count)
+
+            with self.condition:
+                if not sent:
+                    self.unreported_failed += count
+                for tracker in trackers:
+                    if tracker is not None:
+                        tracker.pending -= 1
+                        if not sent:
+                            tracker.failed += 1
+                self.sending = 0
+                self.condition.notify_all()
+
+    def _take_batch(self):
+        """
+        Take a batch of the oldest buffered events.
+
+        Returns a tuple with a dictionary with a list of events
+        per collection, and a list with the tracker of each event
+        in the batch (None if the event isn't tracked).
+        The batch holds at most batch_events events and batch_bytes bytes,
+        or the oldest event if it is larger.
+        """
+        batch = {}
+        trackers = []
+        size = 0
+        while self.events and len(trackers) < self.batch_events:
+            event_collection, event, event_size, tracker = self.events[0]
+            if trackers and size + event_size > self.batch_bytes:
+                break
+            self.events.popleft()
+            batch.setdefault(event_collection, []).append(event)
+            trackers.append(tracker)
+            size += event_size
+
+        self.event_count -= len(trackers)
+        self.event_bytes -= size
+        return batch, trackers
+
+    def _send_batch(self, batch, count):
+        """
+        Send a batch of events to Keen.io.
+
+        Returns True if the batch was sent.
+
+        Parameters:
+        - batch : dictionary with a list of events per collection
+        - count : number of events in the batch
+        """
+        try:
+            self.send_events(batch)
+        except Exception as msg:
+            self.failed += count
+            logger.error(
+                "Error sending %d events to Keen.io : %s", count, msg
+            )
+            return False
+
+        self.sent += count
+        logger.info(
+            "Sent %d events to collections %s (Keen.io)",
+            count, ", ".join(sorted(batch))
+        )
+        return True
 
 
 def get_dashboard_keen_config(repo):
@@ -0,0 +1,508 @@
+# vim: set expandtab sw=4 ts=4:
+"""
+Durable on-disk spool for Keen.io events.
+
+Events are appended to a local spool, so storing events doesn't depend
+on the availability or latency of Keen.io.
+A drainer sends the spooled events to Keen.io in batches.
+
+The spool is a directory with segment files, each containing
+one JSON encoded event per line (with its collection).
+Segments are numbered, events are appended to the last segment,
+a new segment is started when it reaches the maximum segment size.
+The drainer stores the position up to which the events were sent
+in a checkpoint file, and removes completely sent segments.
+Events are sent at least once : if the drainer stops after sending a batch,
+but before storing the checkpoint, the batch is sent again.
+
+Use a separate spool directory for each process appending events.
+
+Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+
+This file is part of buildtimetrend/python-lib
+<https://github.com/buildtimetrend/python-lib/>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+from builtins import object
+import os
+import json
+import threading
+import keen
+from buildtimetrend import logger
+from buildtimetrend import keenio
+
+SEGMENT_SUFFIX = ".spool"
+CHECKPOINT_FILE = "checkpoint.json"
+# size (in bytes) at which a new segment is started
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+# interval (in seconds) at which appended events are synced to disk,
+# 0 : sync after each append
+DEFAULT_SYNC_INTERVAL = 0.1
+# interval (in seconds) at which the drainer checks for new events
+DEFAULT_DRAIN_INTERVAL = 1
+
+
+def get_segment_path(spool_dir, number):
+    """
+    Return the path of a spool segment.
+
+    Parameters:
+    - spool_dir : spool directory
+    - number : segment number
+    """
+    return os.path.join(
+        spool_dir, "{0:010d}{1}".format(number, SEGMENT_SUFFIX)
+    )
+
+
+def get_segments(spool_dir):
+    """
+    Return a sorted list with the numbers of the segments in a spool.
+
+    Parameters:
+    - spool_dir : spool directory
+    """
+    if not os.path.isdir(spool_dir):
+        return []
+
+    return sorted(
+        int(filename[:-len(SEGMENT_SUFFIX)])
+        for filename in os.listdir(spool_dir)
+        if filename.endswith(SEGMENT_SUFFIX) and
+        filename[:-len(SEGMENT_SUFFIX)].isdigit()
+    )
+
+
+def read_checkpoint(spool_dir):
+    """
+    Return segment number and offset up to which events were drained.
+
+    Returns (0, 0) if no checkpoint was stored.
+
+    Parameters:
+    - spool_dir : spool directory
+    """
+    try:
+        with open(os.path.join(spool_dir, CHECKPOINT_FILE)) as file_stream:
+            checkpoint = json.load(file_stream)
+        return int(checkpoint["segment"]), int(checkpoint["offset"])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return 0, 0
+
+
+def write_checkpoint(spool_dir, segment, offset):
+    """
+    Store segment number and offset up to which events were drained.
+
+    The checkpoint is replaced atomically.
+
+    Parameters:
+    - spool_dir : spool directory
+    - segment : segment number
+    - offset : position (in bytes) in the segment
+    """
+    path = os.path.join(spool_dir, CHECKPOINT_FILE)
+    temp_path = path + ".tmp"
+
+    with open(temp_path, 'w') as file_stream:
+        json.dump({"segment": segment, "offset": offset}, file_stream)
+        file_stream.flush()
+        os.fsync(file_stream.fileno())
+
+    os.rename(temp_path, path)
+
+
+class EventSpool(object):
+
+    """
+    Append Keen.io events to an on-disk spool.
+
+    Appending an event writes it to the last segment file, without waiting
+    for the disk : events are synced to disk in the background,
+    every sync_interval seconds, so an event can be lost if the system
+    (not the process) fails within sync_interval after it was appended.
+    An EventSpool can be used as writer for keenio.send_build_data()
+    and keenio.send_build_data_service().
+    """
+
+    def __init__(self, spool_dir, segment_size=DEFAULT_SEGMENT_SIZE,
+                 sync_interval=DEFAULT_SYNC_INTERVAL):
+        """
+        Constructor.
+
+        Parameters:
+        - spool_dir : spool directory, created if it doesn't exist
+        - segment_size : size (in bytes) at which a new segment is started
+        - sync_interval : interval (in seconds) at which appended events
+                          are synced to disk (0 : sync after each append)
+        """
+        if not os.path.isdir(spool_dir):
+            os.makedirs(spool_dir)
+
+        self.spool_dir = spool_dir
+        self.segment_size = segment_size
+        self.sync_interval = sync_interval
+
+        # lock for appending, sync_lock serialises syncing and closing
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.closed = False
+        self.unsynced = 0
+        # segments that are complete, but not synced yet
+        self.retired_files = []
+
+        segments = get_segments(spool_dir)
+        self.segment = segments[-1] if segments else 1
+        self.file = self._open_segment(self.segment)
+
+        self.thread = None
+        if sync_interval > 0:
+            self.thread = threading.Thread(target=self._run_sync)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def add_event(self, event_collection, payload):
+        """
+        Add project info to an event and append it to the spool.
+
+        Parameters:
+        - event_collection : collection event data is submitted to
+        - payload : data that is submitted
+        """
+        self.add_events(event_collection, [payload])
+
+    def add_events(self, event_collection, payload):
+        """
+        Add project info to each event and append them to the spool.
+
+        Parameters:
+        - event_collection : collection event data is submitted to
+        - payload : list of events that is submitted
+        """
+        events = keenio.add_project_info_list(payload)
+        if not events:
+            return
+
+        data = "".join(
+            json.dumps({"collection": event_collection, "event": event}) +
+            "\n" for event in events
+        ).encode('utf-8')
+
+        with self.lock:
+            if self.closed:
+                raise ValueError("EventSpool is closed")
+
+            if self.file.tell() >= self.segment_size:
+                # start a new segment, the current segment is synced later
+                self.retired_files.append(self.file)
+                self.segment += 1
+                self.file = self._open_segment(self.segment)
+
+            self.file.write(data)
+            self.file.flush()
+            self.unsynced += len(events)
+
+        if self.sync_interval <= 0:
+            self.sync()
+
+    def track(self):
+        """
+        Create an EventTracker, for compatibility with EventWriter.
+
+        Appended events are stored, so the tracker has no pending events.
+        """
+        return keenio.EventTracker()
+
+    def sync(self):
+        """Sync appended events to disk."""
+        with self.sync_lock:
+            with self.lock:
+                if self.closed:
+                    return
+                current_file = self.file
+                retired_files = self.retired_files
+                self.retired_files = []
+                unsynced = self.unsynced
+                self.unsynced = 0
+
+            for retired_file in retired_files:
+                os.fsync(retired_file.fileno())
+                retired_file.close()
+            if unsynced > 0:
+                os.fsync(current_file.fileno())
+
+    def flush(self):
+        """Sync appended events to disk (same as sync())."""
+        self.sync()
+
+    def close(self):
+        """Sync appended events to disk, and close the spool."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        self.sync()
+        with self.sync_lock:
+            with self.lock:
+                if not self.closed:
+                    self.closed = True
+                    self.file.close()
+
+    def __enter__(self):
+        """Enter context, returns the spool."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit context, sync and close the spool."""
+        self.close()
+
+    def _open_segment(self, number):
+        """
+        Open a segment to append events.
+
+        An incomplete last event (fe. when a process was killed while
+        appending it) is removed.
+
+        Parameters:
+        - number : segment number
+        """
+        path = get_segment_path(self.spool_dir, number)
+        segment_file = open(path, 'ab+')
+
+        segment_file.seek(0, os.SEEK_END)
+        size = segment_file.tell()
+        if size > 0:
+            # find the end of the last complete line
+            position = max(0, size - 4096)
+            while True:
+                segment_file.seek(position)
+                tail = segment_file.read(size - position)
+                end = tail.rfind(b"\n")
+                if end >= 0 or position == 0:
+                    break
+                position = max(0, position - 4096)
+
+            complete_size = position + end + 1
+            if complete_size < size:
+                logger.warning(
+                    "Removed incomplete event at the end of spool segment %s",
+                    path
+                )
+                segment_file.truncate(complete_size)
+            segment_file.seek(0, os.SEEK_END)
+
+        return segment_file
+
+    def _run_sync(self):
+        """Sync appended events to disk periodically, until closed."""
+        while not self.stop_event.wait(self.sync_interval):
+            try:
+                self.sync()
+            except (IOError, OSError) as msg:
+                logger.error("Error syncing event spool : %s", msg)
+
+
+class SpoolDrainer(object):
+
+    """
+    Send the events in an on-disk spool to Keen.io, in batches.
+
+    Events of all collections are sent with a single keen.add_events() call
+    per batch. After each sent batch, the position in the spool is stored
+    in a checkpoint, so draining resumes after the last sent batch.
+    If sending a batch fails, draining stops and is retried later.
+    """
+
+    def __init__(self, spool_dir, batch_events=keenio.DEFAULT_BATCH_EVENTS,
+                 batch_bytes=keenio.DEFAULT_BATCH_BYTES, send_events=None,
+                 interval=DEFAULT_DRAIN_INTERVAL):
+        """
+        Constructor.
+
+        Parameters:
+        - spool_dir : spool directory
+        - batch_events : maximum number of events in a batch
+        - batch_bytes : maximum size of the events in a batch (in bytes)
+        - send_events : function sending a dictionary with a list of events
+                        per collection (default : keen.add_events())
+        - interval : interval (in seconds) at which the background thread
+                     checks for new events
+        """
+        self.spool_dir = spool_dir
+        self.batch_events = batch_events
+        self.batch_bytes = batch_bytes
+        self.send_events = send_events or keen.add_events
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # number of sent events
+        self.sent = 0
+
+    def drain(self):
+        """
+        Send the events in the spool.
+
+        Returns the number of sent events.
+        """
+        sent = 0
+        checkpoint_segment, checkpoint_offset = read_checkpoint(self.spool_dir)
+        segments = get_segments(self.spool_dir)
+
+        for index, number in enumerate(segments):
+            # a new segment was started after this one, it is complete
+            is_complete = index < len(segments) - 1
+
+            if number < checkpoint_segment:
+                if is_complete:
+                    self._remove_segment(number)
+                continue
+
+            offset = checkpoint_offset if number == checkpoint_segment else 0
+            count, offset = self.drain_segment(number, offset)
+            sent += count
+            if offset is None:
+                # sending failed, retry later
+                break
+
+            if is_complete:
+                write_checkpoint(self.spool_dir, segments[index + 1], 0)
+                self._remove_segment(number)
+
+        self.sent += sent
+        return sent
+
+    def drain_segment(self, number, offset=0):
+        """
+        Send the events in a segment, starting at offset.
+
+        Returns a tuple with the number of sent events and the offset
+        after the last sent event (None if sending failed).
+
+        Parameters:
+        - number : segment number
+        - offset : position (in bytes) in the segment to start from
+        """
+        sent = 0
+        batch = {}
+        batch_count = 0
+        batch_size = 0
+
+        with open(get_segment_path(self.spool_dir, number), 'rb') as segment:
+            segment.seek(offset)
+            # offset after the last complete event read
+            end = offset
+            for line in iter(segment.readline, b""):
+                # the last event is still being appended
+                if not line.endswith(b"\n"):
+                    break
+                end += len(line)
+
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                    batch.setdefault(record["collection"], []).append(
+                        record["event"]
+                    )
+                    batch_count += 1
+                    batch_size += len(line)
+                except (ValueError, KeyError, TypeError) as msg:
+                    logger.warning(
+                        "Skipped invalid event in spool segment %d : %s",
+                        number, msg
+                    )
+
+                if batch_count >= self.batch_events or \
+                        batch_size >= self.batch_bytes:
+                    if not self._send_batch(batch, batch_count):
+                        return sent, None
+                    sent += batch_count
+                    offset = end
+                    write_checkpoint(self.spool_dir, number, offset)
+                    batch, batch_count, batch_size = {}, 0, 0
+
+        if batch_count > 0 and not self._send_batch(batch, batch_count):
+            return sent, None
+        sent += batch_count
+
+        if end > offset:
+            offset = end
+            write_checkpoint(self.spool_dir, number, offset)
+
+        return sent, offset
+
+    def start(self):
+        """Drain the spool in a background thread, until stopped."""
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """Stop the background thread, after draining the spool."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        """Drain the spool periodically, until stopped."""
+        while True:
+            try:
+                self.drain()
+            except (IOError, OSError) as msg:
+                logger.error("Error draining event spool : %s", msg)
+            if self.stop_event.wait(self.interval):
+                # drain events appended before stopping
+                self.drain()
+                return
+
+    def _send_batch(self, batch, count):
+        """
+        Send a batch of events to Keen.io.
+
+        Returns true if the batch was sent.
+
+        Parameters:
+        - batch : dictionary with a list of events per collection
+        - count : number of events in the batch
+        """
+        try:
+            self.send_events(batch)
+        except Exception as msg:
+            logger.error(
+                "Error sending %d spooled events to Keen.io : %s", count, msg
+            )
+            return False
+
+        logger.info(
+            "Sent %d spooled events to collections %s (Keen.io)",
+            count, ", ".join(sorted(batch))
+        )
+        return True
+
+    def _remove_segment(self, number):
+        """
+        Remove a drained segment.
+
+        Parameters:
+        - number : segment number
+        """
+        try:
+            os.remove(get_segment_path(self.spool_dir, number))
+        except OSError as msg:
+            logger.warning("Error removing spool segment %d : %s", number, msg)
@@ -550,6 +550,56 @@ class TestBuildJob(unittest.TestCase):
             }],
             self.build.stages_to_list())
 
+    def test_stages_to_compact_list(self):
+        """Test exporting stages as a list, with a build job reference."""
+        # read and parse sample file
+        self.build = BuildJob(constants.TEST_SAMPLE_TIMESTAMP_FILE)
+
+        # timestamp of last stage is used as event timestamp
+        stage_list = self.build.stages_to_list(compact=True)
+        self.assertEqual(3, len(stage_list))
+        self.assertDictEqual(
+            {
+                'stage': {
+                    'duration': 2,
+                    'finished_at': constants.SPLIT_TIMESTAMP2,
+                    'name': 'stage1',
+                    'started_at': constants.SPLIT_TIMESTAMP1},
+                'keen': {
+                    'timestamp': constants.SPLIT_TIMESTAMP4['isotimestamp']}
+            },
+            stage_list[0]
+        )
+
+        # add properties, only the build job reference is added
+        for name in ('repo', 'job', 'build', 'branch', 'result'):
+            self.build.add_property(name, name + '_value')
+        self.build.add_property('build_matrix', {'language': 'python'})
+        self.build.set_finished_at(constants.ISOTIMESTAMP_FINISHED)
+
+        stage_list = self.build.stages_to_list(compact=True)
+        self.assertDictEqual(
+            {
+                'stage': {
+                    'duration': 10,
+                    'finished_at': constants.SPLIT_TIMESTAMP4,
+                    'name': 'stage3',
+                    'started_at': constants.SPLIT_TIMESTAMP3},
+                'job': {
+                    'repo': 'repo_value',
+                    'job': 'job_value',
+                    'build': 'build_value',
+                    'branch': 'branch_value',
+                    'result': 'result_value'},
+                'keen': {'timestamp': constants.ISOTIMESTAMP_FINISHED}
+            },
+            stage_list[2]
+        )
+
+        # stages are copied
+        stage_list[0]['stage']['name'] = 'changed'
+        self.assertEqual('stage1', self.build.stages.stages[0]['name'])
+
     def test_to_xml(self):
         """Test exporting in XML format."""
         # read and parse sample file
@@ -59,6 +59,18 @@ class TestCollection(unittest.TestCase):
         self.assertDictEqual({'property1': 2, 'property2': 4},
                              self.collection.items)
 
+    def test_add_item_dict(self):
+        """Test add_item() merging dictionaries"""
+        shared_value = {'key1': 1}
+        self.collection.add_item('property1', shared_value)
+        self.collection.add_item('property1', {'key2': 2})
+        self.assertDictEqual(
+            {'property1': {'key1': 1, 'key2': 2}}, self.collection.items
+        )
+
+        # merged value replaces the existing value, which isn't modified
+        self.assertDictEqual({'key1': 1}, shared_value)
+
     def test_get_size(self):
         """Test get_size()"""
         self.collection.add_item('property1', 2)
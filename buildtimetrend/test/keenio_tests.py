@@ -22,6 +22,9 @@
 
 import os
 import copy
+import json
+import time
+import threading
 import unittest
 from datetime import datetime, timedelta
 import keen
@@ -200,6 +203,69 @@ class TestKeen(unittest.TestCase):
                 {"test2": "value2"}])
         )
 
+    def test_add_project_info_shared(self):
+        """Test sharing project info and payload values between events"""
+        job = {"repo": "test/name", "build": "123"}
+        payload = [{"stage": {"name": "script"}, "job": job}, {"job": job}]
+
+        events = keenio.add_project_info_list(payload)
+        self.assertEqual(2, len(events))
+
+        # payload isn't modified
+        self.assertNotIn("buildtime_trend", payload[0])
+        self.assertIsNot(payload[0], events[0])
+
+        # payload values aren't copied
+        self.assertIs(job, events[0]["job"])
+        self.assertIs(payload[0]["stage"], events[0]["stage"])
+
+        # project info with overridden project name is created once
+        self.assertEqual(
+            "test/name", events[0]["buildtime_trend"]["project_name"]
+        )
+        self.assertIs(
+            events[0]["buildtime_trend"], events[1]["buildtime_trend"]
+        )
+        self.assertEqual(
+            self.project_info["project_name"],
+            keenio.add_project_info_list([{}])[0]["buildtime_trend"][
+                "project_name"
+            ]
+        )
+
+        # project info is passed
+        project_info = {"project_name": "test/name"}
+        self.assertIs(
+            project_info,
+            keenio.add_project_info_dict(
+                {"job": job}, project_info
+            )["buildtime_trend"]
+        )
+
+    def test_get_repo_project_info(self):
+        """Test keenio.get_repo_project_info()"""
+        project_info = {"project_name": "test/name", "lib_version": "1.0"}
+        self.assertIs(
+            project_info,
+            keenio.get_repo_project_info(project_info, "test/name")
+        )
+
+        repo_project_info = {}
+        other_project_info = keenio.get_repo_project_info(
+            project_info, "test/other", repo_project_info
+        )
+        self.assertDictEqual(
+            {"project_name": "test/other", "lib_version": "1.0"},
+            other_project_info
+        )
+        self.assertEqual("test/name", project_info["project_name"])
+        self.assertIs(
+            other_project_info,
+            keenio.get_repo_project_info(
+                project_info, "test/other", repo_project_info
+            )
+        )
+
     def test_has_project_id_keen_var(self):
         """Test keenio.has_project_id() with keen vars"""
         keen.project_id = "1234abcd"
@@ -1099,9 +1165,17 @@ class TestKeen(unittest.TestCase):
         )
         self.assertDictEqual(kwargs, {})
 
+        # build job without stages, no stage events are sent
+        self.assertFalse(add_events_func.called)
+
+        # stage events are sent
+        buildjob.stages.create_stage("stage1", 1, 2)
+        add_event_func.reset_mock()
+        keenio.send_build_data(buildjob)
         args, kwargs = add_events_func.call_args
         self.assertEqual(args[0], "build_stages")
-        self.assertListEqual(args[1], [])
+        self.assertEqual(1, len(args[1]))
+        self.assertEqual("stage1", args[1][0]["stage"]["name"])
         self.assertDictEqual(kwargs, {})
 
         # test data_detail parameter = basic
@@ -1127,6 +1201,17 @@ class TestKeen(unittest.TestCase):
         self.assertTrue(add_event_func.called)
         self.assertTrue(add_events_func.called)
 
+        # test with "minimal" setting and "compact" override
+        add_event_func.reset_mock()
+        add_events_func.reset_mock()
+        buildjob.add_property("repo", "test/repo")
+        buildjob.add_property("build_matrix", {"language": "python"})
+        keenio.send_build_data(buildjob, 'compact')
+        self.assertTrue(add_event_func.called)
+        args, kwargs = add_events_func.call_args
+        self.assertEqual(1, len(args[1]))
+        self.assertDictEqual({"repo": "test/repo"}, args[1][0]["job"])
+
         # test with "minimal" setting and no override
         add_event_func.reset_mock()
         add_events_func.reset_mock()
@@ -1171,9 +1256,17 @@ class TestKeen(unittest.TestCase):
         )
         self.assertDictEqual(kwargs, {})
 
+        # build job without stages, no stage events are sent
+        self.assertFalse(add_events_func.called)
+
+        # stage events are sent
+        buildjob.stages.create_stage("stage1", 1, 2)
+        add_event_func.reset_mock()
+        keenio.send_build_data_service(buildjob)
         args, kwargs = add_events_func.call_args
         self.assertEqual(args[0], "build_substages")
-        self.assertListEqual(args[1], [])
+        self.assertEqual(1, len(args[1]))
+        self.assertEqual("stage1", args[1][0]["stage"]["name"])
         self.assertDictEqual(kwargs, {})
 
         # test data_detail parameter = basic
@@ -1199,9 +1292,450 @@ class TestKeen(unittest.TestCase):
         self.assertTrue(add_event_func.called)
         self.assertTrue(add_events_func.called)
 
+        # test with "minimal" setting and "compact" override
+        add_event_func.reset_mock()
+        add_events_func.reset_mock()
+        buildjob.add_property("repo", "test/repo")
+        buildjob.add_property("build_matrix", {"language": "python"})
+        keenio.send_build_data_service(buildjob, 'compact')
+        self.assertTrue(add_event_func.called)
+        args, kwargs = add_events_func.call_args
+        self.assertEqual(1, len(args[1]))
+        self.assertDictEqual({"repo": "test/repo"}, args[1][0]["job"])
+
         # test with "minimal" setting and no override
         add_event_func.reset_mock()
         add_events_func.reset_mock()
         keenio.send_build_data_service(buildjob)
         self.assertTrue(add_event_func.called)
         self.assertFalse(add_events_func.called)
+
+
+class TestEventWriter(unittest.TestCase):
+
+    """Unit tests for keenio.EventWriter"""
+
+    def setUp(self):
+        """Initialise test environment before each test."""
+        self.batches = []
+        self.send_started = threading.Event()
+        self.send_allowed = threading.Event()
+        self.send_allowed.set()
+        self.batch_sent = threading.Event()
+
+    def send_events(self, batch):
+        """Record sent batch, wait until sending is allowed."""
+        self.send_started.set()
+        self.send_allowed.wait()
+        self.batches.append(batch)
+        self.batch_sent.set()
+
+    def count_sent(self, event_collection=None):
+        """Return number of sent events (of a collection)."""
+        return sum(
+            len(events) for batch in self.batches
+            for collection, events in batch.items()
+            if event_collection in (None, collection)
+        )
+
+    def test_flush(self):
+        """Test sending buffered events of several collections in a batch"""
+        writer = keenio.EventWriter(
+            batch_events=100, batch_delay=60, send_events=self.send_events
+        )
+        # nothing to flush
+        writer.flush()
+
+        writer.add_event("build_jobs", {"job": {"id": 1}})
+        writer.add_events("build_stages", [{"stage": 1}, {"stage": 2}])
+        writer.add_events("build_stages", [])
+        self.assertListEqual([], self.batches)
+
+        writer.flush()
+        self.assertEqual(1, len(self.batches))
+        self.assertListEqual(
+            ["build_jobs", "build_stages"], sorted(self.batches[0])
+        )
+        self.assertEqual(1, self.count_sent("build_jobs"))
+        self.assertEqual(2, self.count_sent("build_stages"))
+        # project info is added
+        self.assertIn("buildtime_trend", self.batches[0]["build_jobs"][0])
+        self.assertEqual(3, writer.sent)
+
+        writer.close()
+        self.assertEqual(1, len(self.batches))
+        self.assertRaises(
+            ValueError, writer.add_event, "build_jobs", {"job": {}}
+        )
+
+    def test_batch_thresholds(self):
+        """Test sending a batch when a threshold is reached"""
+        # number of events
+        with keenio.EventWriter(
+                batch_events=5, batch_delay=60,
+                send_events=self.send_events) as writer:
+            writer.add_events("build_stages", [{"stage": i} for i in range(5)])
+            self.assertTrue(self.batch_sent.wait(5))
+            self.assertEqual(5, self.count_sent("build_stages"))
+            writer.add_event("build_jobs", {"job": {}})
+        self.assertEqual(6, self.count_sent())
+
+        # size of events
+        self.batches = []
+        self.batch_sent.clear()
+        with keenio.EventWriter(
+                batch_bytes=200, batch_delay=60,
+                send_events=self.send_events) as writer:
+            writer.add_event("build_jobs", {"job": {"log": "x" * 200}})
+            self.assertTrue(self.batch_sent.wait(5))
+            self.assertEqual(1, self.count_sent())
+
+        # age of the oldest event
+        self.batches = []
+        self.batch_sent.clear()
+        with keenio.EventWriter(
+                batch_delay=0.05, send_events=self.send_events) as writer:
+            writer.add_event("build_jobs", {"job": {}})
+            self.assertTrue(self.batch_sent.wait(5))
+
+        self.assertEqual(1, self.count_sent())
+
+    def test_batch_size(self):
+        """Test each batch holds at most batch_events events or batch_bytes"""
+        self.send_allowed.clear()
+        with keenio.EventWriter(
+                batch_events=2, batch_delay=60,
+                send_events=self.send_events) as writer:
+            writer.add_events("build_stages", [{"stage": i} for i in range(5)])
+            self.send_allowed.set()
+        self.assertListEqual(
+            [2, 2, 1], [len(batch["build_stages"]) for batch in self.batches]
+        )
+
+        # size of an event with project info
+        event_size = len(json.dumps(
+            keenio.add_project_info_dict({"log": "x" * 50})
+        ))
+        batch_bytes = 2 * event_size + 10
+        self.batches = []
+        with keenio.EventWriter(
+                batch_bytes=batch_bytes, batch_delay=60,
+                send_events=self.send_events) as writer:
+            writer.add_event("build_jobs", {"log": "x" * batch_bytes})
+            writer.add_events(
+                "build_stages", [{"log": "x" * 50} for i in range(5)]
+            )
+        # an event larger than batch_bytes is sent in a batch of its own
+        self.assertListEqual(
+            [{"build_jobs": 1}, {"build_stages": 2}, {"build_stages": 2},
+             {"build_stages": 1}],
+            [
+                dict((collection, len(events))
+                     for collection, events in batch.items())
+                for batch in self.batches
+            ]
+        )
+        for batch in self.batches[1:]:
+            self.assertLessEqual(
+                sum(len(json.dumps(event))
+                    for event in batch["build_stages"]),
+                batch_bytes
+            )
+
+    def test_bounded_buffer(self):
+        """Test adding events blocks while the buffer is full"""
+        self.send_allowed.clear()
+        writer = keenio.EventWriter(
+            batch_events=2, max_batches=1, batch_delay=60,
+            send_events=self.send_events
+        )
+
+        # first batch is being sent, second batch fills the buffer
+        writer.add_events("build_jobs", [{"id": 1}, {"id": 2}])
+        self.send_started.wait(5)
+        writer.add_events("build_jobs", [{"id": 3}, {"id": 4}])
+
+        added = threading.Event()
+
+        def add_event():
+            """Add an event to a full buffer."""
+            writer.add_event("build_jobs", {"id": 5})
+            added.set()
+
+        thread = threading.Thread(target=add_event)
+        thread.start()
+        self.assertFalse(added.wait(0.1))
+
+        # sending the first batch makes room in the buffer
+        self.send_allowed.set()
+        self.assertTrue(added.wait(5))
+        thread.join()
+
+        writer.close()
+        self.assertEqual(5, self.count_sent())
+        self.assertListEqual(
+            [1, 2, 3, 4, 5],
+            [
+                event["id"] for batch in self.batches
+                for event in batch["build_jobs"]
+            ]
+        )
+
+    def test_send_error(self):
+        """Test failed events are reported, writer continues"""
+        def send_events(batch):
+            """Fail sending the first batch."""
+            if writer.failed == 0:
+                raise requests.ConnectionError("Keen.io is down")
+            self.batches.append(batch)
+
+        writer = keenio.EventWriter(send_events=send_events)
+        writer.add_events("build_jobs", [{"id": 1}, {"id": 2}])
+        self.assertEqual(2, writer.flush())
+        # failed events are reported once
+        self.assertEqual(0, writer.flush())
+        writer.add_event("build_jobs", {"id": 3})
+        self.assertEqual(0, writer.close())
+
+        self.assertEqual(2, writer.failed)
+        self.assertEqual(1, writer.sent)
+        self.assertEqual(1, self.count_sent())
+
+    def test_track(self):
+        """Test tracking the delivery of the events added by a thread"""
+        def send_events(batch):
+            """Fail sending the batch with event 2."""
+            if batch["build_jobs"][0]["id"] == 2:
+                raise requests.ConnectionError("Keen.io is down")
+            self.batches.append(batch)
+
+        writer = keenio.EventWriter(batch_events=1, send_events=send_events)
+        with writer.track() as tracker1:
+            writer.add_event("build_jobs", {"id": 1})
+        with writer.track() as tracker2:
+            writer.add_event("build_jobs", {"id": 2})
+            writer.add_event("build_jobs", {"id": 3})
+        # untracked event
+        writer.add_event("build_jobs", {"id": 4})
+        self.assertEqual(1, writer.close())
+
+        self.assertTrue(tracker1.is_done())
+        self.assertTrue(tracker1.is_sent())
+        self.assertTrue(tracker2.is_done())
+        self.assertFalse(tracker2.is_sent())
+        self.assertEqual(1, tracker2.failed)
+        self.assertEqual(3, self.count_sent())
+
+        # events added by another thread aren't tracked
+        writer = keenio.EventWriter(send_events=self.send_events)
+        with writer.track() as tracker:
+            thread = threading.Thread(
+                target=writer.add_event, args=("build_jobs", {"id": 5})
+            )
+            thread.start()
+            thread.join()
+            self.assertEqual(0, tracker.pending)
+        writer.close()
+
+    @mock.patch('buildtimetrend.keenio.add_event')
+    @mock.patch('buildtimetrend.keenio.add_events')
+    def test_send_build_data_service(self, add_events_func, add_event_func):
+        """Test keenio.send_build_data_service() with an EventWriter"""
+        keen.project_id = "1234abcd"
+        keen.write_key = "1234abcd5678efgh"
+        self.addCleanup(setattr, keen, "project_id", None)
+        self.addCleanup(setattr, keen, "write_key", None)
+
+        buildjob = BuildJob()
+        buildjob.stages.create_stage("stage1", 1418673017, 1418673018)
+        with keenio.EventWriter(send_events=self.send_events) as writer:
+            keenio.send_build_data_service(buildjob, 'full', writer)
+            keenio.send_build_data(buildjob, 'full', writer)
+
+        self.assertFalse(add_event_func.called)
+        self.assertFalse(add_events_func.called)
+        self.assertEqual(1, len(self.batches))
+        self.assertEqual(2, self.count_sent("build_jobs"))
+        self.assertEqual(1, self.count_sent("build_substages"))
+        self.assertEqual(1, self.count_sent("build_stages"))
+
+
+class TestChunkedUpload(unittest.TestCase):
+
+    """Unit tests for sending events in chunks"""
+
+    def setUp(self):
+        """Initialise test environment before each test."""
+        self.chunks = []
+        self.lock = threading.Lock()
+        self.sending = 0
+        self.max_sending = 0
+        self.created = 0
+        self.fail_chunk = None
+
+    def create_events(self, count):
+        """Generator creating events, counting the created events."""
+        for event_id in range(count):
+            self.created += 1
+            yield {"id": event_id}
+
+    def send_events(self, event_collection, payload):
+        """Record sent chunk, count concurrently sent chunks."""
+        with self.lock:
+            self.sending += 1
+            self.max_sending = max(self.max_sending, self.sending)
+            # events created before the chunk is sent
+            self.chunks.append((payload, self.created))
+
+        time.sleep(0.01)
+
+        with self.lock:
+            self.sending -= 1
+        if payload[0]["id"] == self.fail_chunk:
+            raise IOError("error sending chunk")
+
+    def get_sent_ids(self):
+        """Return sorted ids of the sent events."""
+        return sorted(
+            event["id"] for chunk, created in self.chunks for event in chunk
+        )
+
+    def test_get_event_chunks(self):
+        """Test keenio.get_event_chunks()"""
+        self.assertListEqual([], list(keenio.get_event_chunks([])))
+
+        # chunks by number of events
+        self.assertListEqual(
+            [[{"id": 0}, {"id": 1}], [{"id": 2}]],
+            list(keenio.get_event_chunks(self.create_events(3), 2))
+        )
+
+        # chunks by size, '{"id": 0}' is 9 bytes
+        self.assertListEqual(
+            [[{"id": 0}, {"id": 1}], [{"id": 2}, {"id": 3}]],
+            list(keenio.get_event_chunks(self.create_events(4), 10, 18))
+        )
+        self.assertListEqual(
+            [[{"id": 0}], [{"id": 1}]],
+            list(keenio.get_event_chunks(self.create_events(2), 10, 18, 1))
+        )
+
+        # event larger than chunk size
+        self.assertListEqual(
+            [[{"id": 0}], [{"id": 1}]],
+            list(keenio.get_event_chunks(self.create_events(2), 10, 5))
+        )
+
+    def test_get_event_size(self):
+        """Test keenio.get_event_size()"""
+        job = {"repo": "test/repo", "build_matrix": {"language": "python"}}
+        events = [
+            {"stage": {"name": "stage1"}, "job": job},
+            {"stage": {"name": "stage22"}, "job": job},
+            {"job": {"repo": "test/repo2"}},
+            {},
+        ]
+
+        value_sizes = {}
+        for event in events:
+            self.assertEqual(
+                len(json.dumps(event)),
+                keenio.get_event_size(event, value_sizes)
+            )
+            self.assertEqual(
+                len(json.dumps(event)), keenio.get_event_size(event)
+            )
+
+        # size of a value shared with the previous event is reused
+        value_sizes = {}
+        keenio.get_event_size(events[0], value_sizes)
+        with mock.patch('json.dumps', return_value="") as dumps_func:
+            keenio.get_event_size(events[1], value_sizes)
+            # keys "stage", "job" and value of "stage"
+            self.assertEqual(3, dumps_func.call_count)
+
+    @mock.patch('buildtimetrend.keenio.add_events')
+    def test_add_events_chunked_single(self, add_events_func):
+        """Test keenio.add_events_chunked() with a single chunk"""
+        self.assertEqual(
+            0, keenio.add_events_chunked("build_stages", iter([]))
+        )
+        self.assertFalse(add_events_func.called)
+
+        self.assertEqual(
+            3, keenio.add_events_chunked(
+                "build_stages", self.create_events(3)
+            )
+        )
+        add_events_func.assert_called_once_with(
+            "build_stages", [{"id": 0}, {"id": 1}, {"id": 2}]
+        )
+
+    def test_add_events_chunked(self):
+        """Test sending chunks concurrently, creating events lazily"""
+        self.assertEqual(
+            100, keenio.add_events_chunked(
+                "build_stages", self.create_events(100), chunk_events=5,
+                max_workers=3, send_events=self.send_events
+            )
+        )
+        self.assertEqual(20, len(self.chunks))
+        self.assertListEqual(list(range(100)), self.get_sent_ids())
+
+        # number of chunks sent concurrently is limited
+        self.assertGreater(self.max_sending, 1)
+        self.assertLessEqual(self.max_sending, 3)
+
+        # events are created when chunks are created, so the chunks
+        # being sent and the next chunk are created,
+        # not all events
+        for chunk, created in self.chunks:
+            self.assertLessEqual(created - chunk[0]["id"], 5 * (3 + 2))
+
+        # sequentially
+        self.chunks = []
+        self.max_sending = 0
+        keenio.add_events_chunked(
+            "build_stages", self.create_events(10), chunk_events=5,
+            max_workers=1, send_events=self.send_events
+        )
+        self.assertEqual(2, len(self.chunks))
+        self.assertEqual(1, self.max_sending)
+
+    def test_add_events_chunked_error(self):
+        """Test error when sending chunks, the next chunks are not sent"""
+        self.fail_chunk = 10
+        self.assertRaises(
+            IOError, keenio.add_events_chunked,
+            "build_stages", self.create_events(1000), chunk_events=5,
+            max_workers=2, send_events=self.send_events
+        )
+        self.assertIn(10, self.get_sent_ids())
+        self.assertLess(len(self.chunks), 10)
+        self.assertLess(self.created, 100)
+
+    def test_get_send_functions(self):
+        """Test keenio.get_send_functions() with a writer"""
+        writer = keenio.EventWriter(
+            batch_events=100, send_events=lambda batch: None
+        )
+        writer.add_events = mock.MagicMock()
+
+        send_event, send_events = keenio.get_send_functions(writer)
+        self.assertEqual(writer.add_event, send_event)
+
+        # a generator is passed to the writer in chunks
+        self.assertEqual(
+            keenio.DEFAULT_BATCH_EVENTS + 1,
+            send_events(
+                "build_stages",
+                self.create_events(keenio.DEFAULT_BATCH_EVENTS + 1)
+            )
+        )
+        self.assertEqual(2, writer.add_events.call_count)
+        writer.close()
+
+        self.assertEqual(
+            (keenio.add_event, keenio.add_events_chunked),
+            keenio.get_send_functions()
+        )
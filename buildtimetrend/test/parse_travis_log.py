@@ -22,7 +22,7 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
-from buildtimetrend.travis import TravisData
+from buildtimetrend.travis.parser import TravisData
 
 REPO = 'buildtimetrend/python-lib'
 BUILD = '241'
@@ -35,7 +35,7 @@ travis_data.parse_job_log_file(LOGFILE)
 
 print()
 print("Finished stages")
-for stage in travis_data.build.stages.stages:
+for stage in travis_data.current_job.stages.stages:
     print("Substage {0!s}, duration {1!s}s, command : {2!s}".format(
         stage["name"], stage["duration"], stage["command"])
     )
@@ -22,8 +22,10 @@
 
 import os
 import logging
+import tempfile
 import unittest
 import keen
+from validate import Validator
 from buildtimetrend.settings import Settings
 from buildtimetrend import logger
 from buildtimetrend import keenio
@@ -578,3 +580,29 @@ class TestSettings(unittest.TestCase):
             DEFAULT_SETTINGS
         )
         self.assertDictEqual(config_dict["keen"], {})
+
+    def test_load_config_ini_file_data_detail(self):
+        """Test loading data detail settings from a config file."""
+        config_file = tempfile.NamedTemporaryFile(
+            "w", suffix=".ini", delete=False
+        )
+        self.addCleanup(os.remove, config_file.name)
+        with config_file:
+            config_file.write(
+                "[buildtimetrend]\n"
+                "data_detail = compact\n"
+                "[[repo_data_detail]]\n"
+                "test/repo = compact\n"
+            )
+
+        config_dict = self.settings.load_config_ini_file(config_file.name)
+        results = config_dict.validate(Validator(), preserve_errors=True)
+        self.assertIs(True, results["buildtimetrend"]["data_detail"])
+        self.assertIs(True, results["buildtimetrend"]["repo_data_detail"])
+        self.assertEqual(
+            "compact", config_dict["buildtimetrend"]["data_detail"]
+        )
+        self.assertEqual(
+            "compact",
+            config_dict["buildtimetrend"]["repo_data_detail"]["test/repo"]
+        )
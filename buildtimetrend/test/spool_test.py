@@ -0,0 +1,258 @@
+# vim: set expandtab sw=4 ts=4:
+#
+# Unit tests for the on-disk Keen.io event spool
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+from buildtimetrend import spool
+from buildtimetrend.spool import EventSpool
+from buildtimetrend.spool import SpoolDrainer
+from buildtimetrend.settings import Settings
+
+
+class TestSpool(unittest.TestCase):
+
+    """Unit tests for the on-disk Keen.io event spool"""
+
+    def setUp(self):
+        """Initialise test environment before each test."""
+        self.spool_dir = tempfile.mkdtemp()
+        self.batches = []
+        self.fail_sending = False
+        Settings().set_project_name("test/project")
+
+    def tearDown(self):
+        """Clean up after tests"""
+        shutil.rmtree(self.spool_dir)
+
+    def send_events(self, batch):
+        """Record sent batch, raise an error if sending should fail."""
+        if self.fail_sending:
+            raise IOError("Keen.io is unavailable")
+        self.batches.append(batch)
+
+    def get_sent_ids(self, event_collection="build_jobs"):
+        """Return ids of the sent events of a collection."""
+        return [
+            event["id"] for batch in self.batches
+            for event in batch.get(event_collection, [])
+        ]
+
+    def test_get_segments(self):
+        """Test get_segments()"""
+        self.assertListEqual(
+            [], spool.get_segments(os.path.join(self.spool_dir, "missing"))
+        )
+        self.assertListEqual([], spool.get_segments(self.spool_dir))
+
+        for filename in ("0000000002.spool", "0000000010.spool",
+                         "checkpoint.json", "abc.spool"):
+            open(os.path.join(self.spool_dir, filename), 'w').close()
+        self.assertListEqual([2, 10], spool.get_segments(self.spool_dir))
+
+    def test_checkpoint(self):
+        """Test read_checkpoint() and write_checkpoint()"""
+        self.assertTupleEqual((0, 0), spool.read_checkpoint(self.spool_dir))
+
+        spool.write_checkpoint(self.spool_dir, 3, 1024)
+        self.assertTupleEqual((3, 1024), spool.read_checkpoint(self.spool_dir))
+        self.assertListEqual(["checkpoint.json"], os.listdir(self.spool_dir))
+
+        # invalid checkpoint
+        with open(os.path.join(self.spool_dir, "checkpoint.json"), 'w') as cp:
+            cp.write('{"segment": 3')
+        self.assertTupleEqual((0, 0), spool.read_checkpoint(self.spool_dir))
+
+    def test_add_events(self):
+        """Test appending events to the spool"""
+        spool_dir = os.path.join(self.spool_dir, "events")
+        event_spool = EventSpool(spool_dir, sync_interval=0)
+        self.assertTrue(os.path.isdir(spool_dir))
+
+        event_spool.add_event("build_jobs", {"id": 1})
+        event_spool.add_events("build_stages", [{"id": 2}, {"id": 3}])
+        event_spool.add_events("build_stages", [])
+        event_spool.close()
+
+        # appending to a closed spool fails
+        self.assertRaises(
+            ValueError, event_spool.add_event, "build_jobs", {"id": 4}
+        )
+        # closing twice is allowed
+        event_spool.close()
+
+        self.assertListEqual([1], spool.get_segments(spool_dir))
+        with open(spool.get_segment_path(spool_dir, 1), 'rb') as segment:
+            self.assertEqual(3, len(segment.readlines()))
+
+        SpoolDrainer(spool_dir, send_events=self.send_events).drain()
+        self.assertEqual(1, len(self.batches))
+        self.assertListEqual([1], self.get_sent_ids())
+        self.assertListEqual([2, 3], self.get_sent_ids("build_stages"))
+        # project info is added
+        self.assertEqual(
+            "test/project",
+            self.batches[0]["build_jobs"][0]["buildtime_trend"]["project_name"]
+        )
+
+    def test_sync(self):
+        """Test syncing appended events to disk"""
+        with mock.patch('os.fsync') as fsync:
+            with EventSpool(self.spool_dir, sync_interval=0) as event_spool:
+                event_spool.add_event("build_jobs", {"id": 1})
+                self.assertEqual(1, fsync.call_count)
+
+            # sync in background
+            event_spool = EventSpool(self.spool_dir, sync_interval=60)
+            event_spool.add_event("build_jobs", {"id": 2})
+            event_spool.add_event("build_jobs", {"id": 3})
+            self.assertEqual(1, fsync.call_count)
+            event_spool.sync()
+            self.assertEqual(2, fsync.call_count)
+            # nothing to sync
+            event_spool.sync()
+            self.assertEqual(2, fsync.call_count)
+
+            event_spool.add_event("build_jobs", {"id": 4})
+            event_spool.close()
+            self.assertEqual(3, fsync.call_count)
+
+    def test_rotate_segments(self):
+        """Test starting new segments and removing drained segments"""
+        with EventSpool(self.spool_dir, segment_size=100) as event_spool:
+            for event_id in range(5):
+                event_spool.add_event(
+                    "build_jobs", {"id": event_id, "data": "x" * 80}
+                )
+
+        segments = spool.get_segments(self.spool_dir)
+        self.assertListEqual([1, 2, 3, 4, 5], segments)
+
+        drainer = SpoolDrainer(
+            self.spool_dir, batch_events=2, send_events=self.send_events
+        )
+        self.assertEqual(5, drainer.drain())
+        self.assertListEqual([0, 1, 2, 3, 4], self.get_sent_ids())
+        # the last segment is kept, new events are appended to it
+        self.assertListEqual([5], spool.get_segments(self.spool_dir))
+        self.assertEqual(
+            5, spool.read_checkpoint(self.spool_dir)[0]
+        )
+
+        # only new events are sent
+        with EventSpool(self.spool_dir, segment_size=100) as event_spool:
+            event_spool.add_event("build_jobs", {"id": 5})
+        self.assertEqual(1, drainer.drain())
+        self.assertEqual(0, drainer.drain())
+        self.assertListEqual([0, 1, 2, 3, 4, 5], self.get_sent_ids())
+        self.assertEqual(6, drainer.sent)
+
+    def test_drain_batches(self):
+        """Test draining events in batches, resuming after failure"""
+        with EventSpool(self.spool_dir) as event_spool:
+            event_spool.add_events(
+                "build_jobs", [{"id": event_id} for event_id in range(5)]
+            )
+
+        drainer = SpoolDrainer(
+            self.spool_dir, batch_events=2, send_events=self.send_events
+        )
+        self.fail_sending = True
+        self.assertEqual(0, drainer.drain())
+        self.assertListEqual([], self.batches)
+        self.assertTupleEqual((0, 0), spool.read_checkpoint(self.spool_dir))
+
+        self.fail_sending = False
+        self.assertEqual(5, drainer.drain())
+        self.assertListEqual([0, 1, 2, 3, 4], self.get_sent_ids())
+        self.assertListEqual(
+            [2, 2, 1], [len(batch["build_jobs"]) for batch in self.batches]
+        )
+
+        # batch size in bytes
+        with EventSpool(self.spool_dir) as event_spool:
+            event_spool.add_events(
+                "build_jobs", [{"id": event_id} for event_id in range(5, 8)]
+            )
+        self.batches = []
+        drainer.batch_bytes = 1
+        self.assertEqual(3, drainer.drain())
+        self.assertListEqual(
+            [1, 1, 1], [len(batch["build_jobs"]) for batch in self.batches]
+        )
+
+    def test_drain_incomplete_events(self):
+        """Test skipping invalid events and waiting for incomplete events"""
+        with EventSpool(self.spool_dir) as event_spool:
+            event_spool.add_event("build_jobs", {"id": 1})
+
+        segment_path = spool.get_segment_path(self.spool_dir, 1)
+        with open(segment_path, 'ab') as segment:
+            segment.write(b'invalid\n{"collection": "build_jobs", "ev')
+
+        drainer = SpoolDrainer(self.spool_dir, send_events=self.send_events)
+        self.assertEqual(1, drainer.drain())
+        self.assertListEqual([1], self.get_sent_ids())
+
+        # the incomplete event is completed
+        with open(segment_path, 'ab') as segment:
+            segment.write(b'ent": {"id": 2}}\n')
+        self.assertEqual(1, drainer.drain())
+        self.assertListEqual([1, 2], self.get_sent_ids())
+
+    def test_remove_incomplete_event(self):
+        """Test removing an incomplete event when opening the spool"""
+        with EventSpool(self.spool_dir) as event_spool:
+            event_spool.add_event("build_jobs", {"id": 1})
+
+        segment_path = spool.get_segment_path(self.spool_dir, 1)
+        with open(segment_path, 'ab') as segment:
+            segment.write(b'{"collection": "build_jobs", "ev')
+
+        with EventSpool(self.spool_dir) as event_spool:
+            event_spool.add_event("build_jobs", {"id": 2})
+
+        SpoolDrainer(self.spool_dir, send_events=self.send_events).drain()
+        self.assertListEqual([1, 2], self.get_sent_ids())
+
+        # segment with only an incomplete event
+        with open(segment_path, 'wb') as segment:
+            segment.write(b'{"collection"')
+        EventSpool(self.spool_dir).close()
+        self.assertEqual(0, os.path.getsize(segment_path))
+
+    def test_drainer_thread(self):
+        """Test draining in a background thread"""
+        drainer = SpoolDrainer(
+            self.spool_dir, send_events=self.send_events, interval=60
+        )
+        drainer.start()
+
+        with EventSpool(self.spool_dir) as event_spool:
+            event_spool.add_event("build_jobs", {"id": 1})
+
+        # events are drained before the thread stops
+        drainer.stop()
+        self.assertListEqual([1], self.get_sent_ids())
+        self.assertIsNone(drainer.thread)
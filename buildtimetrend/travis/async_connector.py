@@ -0,0 +1,138 @@
+# vim: set expandtab sw=4 ts=4:
+"""
+Asynchronous interface to Travis CI API, using asyncio and aiohttp.
+
+Requires Python 3.6 or later and aiohttp (install extra 'async').
+
+Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+
+This file is part of buildtimetrend/python-lib
+<https://github.com/buildtimetrend/python-lib/>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import aiohttp
+from buildtimetrend import logger
+from buildtimetrend.tools import check_dict
+from buildtimetrend.travis.connector import TRAVIS_ORG_API_URL
+import buildtimetrend
+
+
+class AsyncTravisConnector(object):
+
+    """
+    Base class to connect to Travis CI API asynchronously.
+
+    Requests don't block the event loop, the aiohttp client session
+    is created on the first request, and closed with close().
+    """
+
+    def __init__(self, session=None):
+        """
+        Constructor.
+
+        Parameters:
+        - session : aiohttp.ClientSession instance (optional)
+        """
+        self.api_url = None
+        self.request_params = {
+            'user-agent': buildtimetrend.USER_AGENT
+        }
+        self.session = session
+
+    async def download_job_log(self, job_id):
+        """
+        Retrieve Travis CI job log.
+
+        Returns the aiohttp response, the log can be read as it arrives
+        from response.content. Release the response when done.
+
+        Parameters:
+        - job_id : ID of the job to process
+        """
+        request = 'jobs/{}/log'.format(str(job_id))
+        logger.info("Request build job log #%s", str(job_id))
+        return await self._handle_request(request)
+
+    async def json_request(self, json_request):
+        """
+        Retrieve Travis CI data using API.
+
+        Parameters:
+        - json_request : json_request to be sent to API
+        """
+        response = await self._handle_request(
+            json_request,
+            {
+                'accept': 'application/vnd.travis-ci.2+json'
+            }
+        )
+
+        try:
+            return await response.json(content_type=None)
+        finally:
+            response.release()
+
+    async def close(self):
+        """Close client session."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        """Enter async context manager."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Exit async context manager, close client session."""
+        await self.close()
+
+    async def _handle_request(self, request, params=None):
+        """
+        Retrieve Travis CI data using API.
+
+        Raises aiohttp.ClientResponseError if the response has an error status.
+
+        Parameters:
+        - request : request to be sent to API
+        - params : HTTP request parameters
+        """
+        request_url = self.api_url + request
+
+        request_params = self.request_params.copy()
+        if params is not None and check_dict(params, "params"):
+            request_params.update(params)
+
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+
+        logger.info("Request from Travis CI API : %s", request_url)
+        response = await self.session.get(request_url, headers=request_params)
+        try:
+            response.raise_for_status()
+        except aiohttp.ClientResponseError:
+            response.release()
+            raise
+
+        return response
+
+
+class AsyncTravisOrgConnector(AsyncTravisConnector):
+
+    """Connects to Travis.org API asynchronously."""
+
+    def __init__(self, session=None):
+        """Constructor."""
+        super(AsyncTravisOrgConnector, self).__init__(session)
+        self.api_url = TRAVIS_ORG_API_URL
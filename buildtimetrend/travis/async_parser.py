@@ -0,0 +1,287 @@
+# vim: set expandtab sw=4 ts=4:
+"""
+Retrieve and parse Travis CI build data asynchronously, using asyncio.
+
+Requires Python 3.6 or later and aiohttp (install extra 'async').
+
+Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+
+This file is part of buildtimetrend/python-lib
+<https://github.com/buildtimetrend/python-lib/>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import json
+import aiohttp
+from buildtimetrend import logger
+from buildtimetrend.buildjob import BuildJob
+from buildtimetrend.travis.async_connector import AsyncTravisConnector
+from buildtimetrend.travis.async_connector import AsyncTravisOrgConnector
+from buildtimetrend.travis.parser import TravisData
+from buildtimetrend.travis.parser import get_builds_range
+from buildtimetrend.travis.parser import LOG_PHASE_HEADER
+from buildtimetrend.travis.substage import TravisSubstage
+
+
+class AsyncTravisData(TravisData):
+
+    """
+    Gather data from Travis CI using the API, without blocking the event loop.
+
+    The methods that retrieve data are coroutines,
+    job logs are parsed while they are downloaded.
+    """
+
+    def __init__(self, repo, build_id, connector=None, streaming=False):
+        """
+        Retrieve Travis CI build data using the API.
+
+        Parameters:
+        - repo : github repository slug (fe. buildtimetrend/python-lib)
+        - build_id : Travis CI build id (fe. 158)
+        - connector : AsyncTravisConnector instance
+        - streaming : don't keep processed build jobs in build_jobs
+        """
+        super(AsyncTravisData, self).__init__(
+            repo, build_id, streaming=streaming
+        )
+        # set AsyncTravisConnector if it is defined
+        if isinstance(connector, AsyncTravisConnector):
+            self.connector = connector
+        # use Travis Org connector by default
+        else:
+            self.connector = AsyncTravisOrgConnector()
+
+    async def get_build_data(self):
+        """
+        Retrieve Travis CI build data.
+
+        Returns true if retrieving data was succesful, false on error.
+        """
+        request = 'repos/{repo}/builds?number={build_id}'.format(
+            repo=self.repo, build_id=self.build_id
+        )
+        try:
+            self.builds_data = await self.connector.json_request(request)
+        except aiohttp.ClientError as msg:
+            logger.error("Error getting build data from Travis CI: %s", msg)
+            return False
+
+        # log builds_data
+        logger.debug(
+            "Build #%s data : %s",
+            str(self.build_id),
+            json.dumps(self.builds_data, sort_keys=True, indent=2)
+        )
+
+        return True
+
+    async def get_builds_data_pages(self, first_build=None, last_build=None):
+        """
+        Retrieve Travis CI build data of a range of builds, page by page.
+
+        Method is an asynchronous generator,
+        each page of builds is set as builds_data before it is yielded,
+        see TravisData.get_builds_data_pages().
+
+        Parameters:
+        - first_build : number of the first build (default : first build)
+        - last_build : number of the last build (default : latest build)
+        """
+        first_build, after_number = get_builds_range(first_build, last_build)
+
+        while after_number != 0:
+            builds_page = await self.connector.json_request(
+                self.get_builds_page_request(after_number)
+            )
+            after_number = self.process_builds_page(builds_page, first_build)
+            if self.builds_data.get("builds"):
+                yield self.builds_data
+
+    async def process_builds(self, first_build=None, last_build=None,
+                             max_workers=1):
+        """
+        Retrieve Travis CI build job data of a range of builds.
+
+        Method is an asynchronous generator,
+        iterate result (async for) to get each processed build job.
+
+        Parameters:
+        - first_build : number of the first build (default : first build)
+        - last_build : number of the last build (default : latest build)
+        - max_workers : maximum number of build jobs that are retrieved and
+                        parsed concurrently
+        """
+        builds_pages = self.get_builds_data_pages(first_build, last_build)
+        async for builds_data in builds_pages:
+            async for build_job in self.process_build_jobs(max_workers):
+                yield build_job
+
+    async def prefetch_job_data(self, job_ids):
+        """
+        Retrieve Travis CI job data of several jobs in bulk.
+
+        See TravisData.prefetch_job_data().
+
+        Parameters:
+        - job_ids : IDs of the jobs
+        """
+        for batch, request in self.get_job_data_batches(job_ids):
+            try:
+                jobs_data = await self.connector.json_request(request)
+            except aiohttp.ClientError as msg:
+                if getattr(msg, 'status', None) == 429:
+                    raise
+                logger.warning("Error getting job data in bulk : %s", msg)
+                return
+
+            if not self.add_prefetched_job_data(batch, jobs_data):
+                return
+
+    async def process_build_jobs(self, max_workers=1):
+        """
+        Retrieve Travis CI build job data.
+
+        Method is an asynchronous generator,
+        iterate result (async for) to get each processed build job.
+        Build jobs are returned in the order of the job_ids of the build.
+
+        Parameters:
+        - max_workers : maximum number of build jobs that are retrieved and
+                        parsed concurrently
+        """
+        if len(self.builds_data) > 0 and "builds" in self.builds_data:
+            for build in self.builds_data['builds']:
+                self.current_build_data = build
+
+                if "job_ids" in build:
+                    await self.prefetch_job_data(build['job_ids'])
+                    build_jobs = self.process_build_jobs_concurrently(
+                        build['job_ids'], max_workers
+                    )
+                    async for build_job in build_jobs:
+                        yield build_job
+
+            # reset current_build_data after builds are processed
+            self.current_build_data = {}
+
+    async def process_build_jobs_concurrently(self, job_ids, max_workers):
+        """
+        Retrieve and parse Travis CI build jobs concurrently.
+
+        Each job is processed by a separate AsyncTravisData instance
+        (see create_job_parser()), at most max_workers at the same time.
+        Method is an asynchronous generator,
+        build jobs are returned in order of job_ids.
+
+        Parameters:
+        - job_ids : IDs of the jobs to process, of the current build
+        - max_workers : maximum number of concurrently processed jobs
+        """
+        build_data = self.current_build_data
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def process_job(job_id):
+            """Process build job with a separate AsyncTravisData instance."""
+            async with semaphore:
+                job_parser = self.create_job_parser(build_data)
+                return await job_parser.process_build_job(job_id)
+
+        tasks = [asyncio.ensure_future(process_job(job_id))
+                 for job_id in job_ids]
+
+        try:
+            for job_id, task in zip(job_ids, tasks):
+                build_job = await task
+                if build_job is not None:
+                    self.add_build_job(job_id, build_job)
+                yield build_job
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def process_build_job(self, job_id):
+        """
+        Retrieve Travis CI build job data.
+
+        Parameters:
+        - job_id : ID of the job to process
+        """
+        if job_id is None:
+            return None
+
+        # retrieve job data from Travis CI
+        job_data = await self.get_job_data(job_id)
+        # process build/job data
+        self.process_job_data(job_data)
+        # parse Travis CI job log file
+        await self.parse_job_log(job_id)
+
+        # store build job
+        build_job = self.current_job
+        self.add_build_job(job_id, build_job)
+        # create new build job instance
+        self.current_job = BuildJob()
+
+        # return processed build job
+        return build_job
+
+    async def get_job_data(self, job_id):
+        """
+        Retrieve Travis CI job data.
+
+        Job data retrieved with prefetch_job_data() is used if available.
+
+        Parameters:
+        - job_id : ID of the job to process
+        """
+        job_data = self.prefetched_job_data.pop(str(job_id), None)
+        if job_data is not None:
+            return job_data
+
+        request = 'jobs/{:s}'.format(str(job_id))
+        job_data = await self.connector.json_request(request)
+
+        # log job_data
+        logger.debug(
+            "Job #%s data : %s",
+            str(job_id),
+            json.dumps(job_data, sort_keys=True, indent=2)
+        )
+
+        return job_data
+
+    async def parse_job_log(self, job_id):
+        """
+        Download and parse Travis CI job log.
+
+        The log is parsed chunk by chunk, as it is received.
+
+        Parameters:
+        - job_id : ID of the job to process
+        """
+        response = await self.connector.download_job_log(job_id)
+
+        self.travis_substage = TravisSubstage()
+        self.partial_line = None
+        self.log_offset = 0
+        self.log_phase = LOG_PHASE_HEADER
+
+        try:
+            async for chunk in response.content.iter_any():
+                self.feed(chunk)
+            self.feed(b'', True)
+        finally:
+            response.release()
@@ -0,0 +1,386 @@
+# vim: set expandtab sw=4 ts=4:
+"""
+Persistent on-disk cache for Travis CI API responses.
+
+Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+
+This file is part of buildtimetrend/python-lib
+<https://github.com/buildtimetrend/python-lib/>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+from builtins import object
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from buildtimetrend import logger
+
+# default maximum size of the cached response bodies : 1 GB
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+# os.replace() is not available in Python 2
+replace_file = getattr(os, 'replace', os.rename)
+
+
+class ResponseCache(object):
+
+    """
+    Persistent on-disk cache of API responses, keyed on request path.
+
+    Response bodies are stored content-addressed (named by their SHA-256 hash),
+    so identical responses are stored once.
+    Each cached request has a metadata file, with the hash of the body,
+    the validators (ETag, Last-Modified) and if the response is final.
+    When the total size of the stored bodies exceeds max_size,
+    the least recently used requests are evicted.
+    The cache can be shared by threads.
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        """
+        Open cache directory, create it if it doesn't exist.
+
+        Parameters:
+        - cache_dir : cache directory
+        - max_size : maximum size of the stored bodies, in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.meta_dir = os.path.join(cache_dir, 'meta')
+        self.blob_dir = os.path.join(cache_dir, 'blobs')
+        self.lock = threading.Lock()
+        # cached requests, least recently used first
+        self.entries = OrderedDict()
+        # number of requests referencing each stored body
+        self.blob_refs = {}
+        self.size = 0
+
+        for directory in (self.meta_dir, self.blob_dir):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        self.load()
+
+    def load(self):
+        """Load metadata of the cached requests, in order of last use."""
+        meta_files = []
+        for filename in os.listdir(self.meta_dir):
+            path = os.path.join(self.meta_dir, filename)
+            if filename.endswith('.json'):
+                meta_files.append((os.path.getmtime(path), path))
+
+        for mtime, path in sorted(meta_files):
+            try:
+                with open(path) as meta_file:
+                    entry = json.load(meta_file)
+            except ValueError:
+                logger.warning("Invalid cache metadata file : %s", path)
+                continue
+
+            if os.path.isfile(self.get_blob_path(entry['blob'])):
+                self._add_entry(entry)
+
+    def get(self, request):
+        """
+        Return the cache entry of a request, None if it isn't cached.
+
+        The entry is marked as most recently used.
+
+        Parameters:
+        - request : request path
+        """
+        with self.lock:
+            entry = self.entries.pop(request, None)
+            if entry is None:
+                return None
+            self.entries[request] = entry
+
+        # the modification time of the metadata file keeps track of last use
+        try:
+            os.utime(self.get_meta_path(request), None)
+        except OSError:
+            pass
+
+        return entry
+
+    def open(self, entry):
+        """
+        Open the stored body of a cache entry.
+
+        Parameters:
+        - entry : cache entry
+        """
+        return open(self.get_blob_path(entry['blob']), 'rb')
+
+    def writer(self, request, etag=None, last_modified=None, finished=False):
+        """
+        Create a CacheWriter to store the body of a response.
+
+        Parameters:
+        - request : request path
+        - etag : ETag header of the response
+        - last_modified : Last-Modified header of the response
+        - finished : true if the response will not change anymore
+        """
+        return CacheWriter(self, {
+            'request': request,
+            'etag': etag,
+            'last_modified': last_modified,
+            'finished': finished
+        })
+
+    def store(self, entry, temp_path, blob):
+        """
+        Store a downloaded body and the metadata of its request.
+
+        Parameters:
+        - entry : cache entry, without blob and size
+        - temp_path : path of the temporary file with the body
+        - blob : SHA-256 hash of the body
+        """
+        blob_path = self.get_blob_path(blob)
+        entry['blob'] = blob
+
+        with self.lock:
+            if os.path.isfile(blob_path):
+                os.remove(temp_path)
+            else:
+                replace_file(temp_path, blob_path)
+            entry['size'] = os.path.getsize(blob_path)
+            self._write_entry(entry)
+
+            old_entry = self.entries.pop(entry['request'], None)
+            self._add_entry(entry)
+            if old_entry is not None and self._remove_blob_ref(old_entry):
+                self._remove_blob(old_entry['blob'])
+            self._evict()
+
+    def set_finished(self, request):
+        """
+        Mark the cached response of a request as final.
+
+        Parameters:
+        - request : request path
+        """
+        with self.lock:
+            entry = self.entries.get(request)
+            if entry is None or entry['finished']:
+                return
+            entry['finished'] = True
+
+        self._write_entry(entry)
+
+    def is_finished(self, request):
+        """
+        Check if the cached response of a request is final.
+
+        Parameters:
+        - request : request path
+        """
+        with self.lock:
+            entry = self.entries.get(request)
+            return entry is not None and entry['finished']
+
+    def get_meta_path(self, request):
+        """
+        Return the path of the metadata file of a request.
+
+        Parameters:
+        - request : request path
+        """
+        request_hash = hashlib.sha1(request.encode('utf-8')).hexdigest()
+        return os.path.join(self.meta_dir, request_hash + '.json')
+
+    def get_blob_path(self, blob):
+        """
+        Return the path of a stored body.
+
+        Parameters:
+        - blob : SHA-256 hash of the body
+        """
+        return os.path.join(self.blob_dir, blob)
+
+    def _write_entry(self, entry):
+        """Write metadata file of a cache entry."""
+        meta_path = self.get_meta_path(entry['request'])
+        file_handle, temp_path = tempfile.mkstemp(dir=self.meta_dir)
+        with os.fdopen(file_handle, 'w') as meta_file:
+            json.dump(entry, meta_file)
+        replace_file(temp_path, meta_path)
+
+    def _add_entry(self, entry):
+        """Add entry as most recently used, account for its body."""
+        self.entries[entry['request']] = entry
+        blob = entry['blob']
+        if blob not in self.blob_refs:
+            self.blob_refs[blob] = 0
+            self.size += entry['size']
+        self.blob_refs[blob] += 1
+
+    def _remove_blob_ref(self, entry):
+        """
+        Remove reference to the body of an entry.
+
+        Returns true if the body is no longer referenced.
+        """
+        blob = entry['blob']
+        self.blob_refs[blob] -= 1
+        if self.blob_refs[blob] > 0:
+            return False
+
+        del self.blob_refs[blob]
+        self.size -= entry['size']
+        return True
+
+    def _evict(self):
+        """Evict least recently used entries until size is below max_size."""
+        while self.size > self.max_size and len(self.entries) > 1:
+            request, entry = self.entries.popitem(last=False)
+            logger.debug("Evict request from cache : %s", request)
+            try:
+                os.remove(self.get_meta_path(request))
+            except OSError:
+                pass
+            if self._remove_blob_ref(entry):
+                self._remove_blob(entry['blob'])
+
+    def _remove_blob(self, blob):
+        """Remove stored body, that is no longer referenced."""
+        try:
+            os.remove(self.get_blob_path(blob))
+        except OSError:
+            pass
+
+
+class CacheWriter(object):
+
+    """Write a response body to a temporary file, and store it in the cache."""
+
+    def __init__(self, cache, entry):
+        """
+        Constructor.
+
+        Parameters:
+        - cache : ResponseCache instance
+        - entry : cache entry, without blob and size
+        """
+        self.cache = cache
+        self.entry = entry
+        self.hash = hashlib.sha256()
+        file_handle, self.temp_path = tempfile.mkstemp(dir=cache.blob_dir)
+        self.temp_file = os.fdopen(file_handle, 'wb')
+
+    def write(self, data):
+        """
+        Write part of the body.
+
+        Parameters:
+        - data : bytes to write
+        """
+        if self.temp_file is None or not data:
+            return
+        self.hash.update(data)
+        self.temp_file.write(data)
+
+    def commit(self):
+        """Store the body in the cache."""
+        if self.temp_file is None:
+            return
+        self.temp_file.close()
+        self.temp_file = None
+        self.cache.store(self.entry, self.temp_path, self.hash.hexdigest())
+
+    def discard(self):
+        """Discard the body, fe. if the response wasn't read completely."""
+        if self.temp_file is None:
+            return
+        self.temp_file.close()
+        self.temp_file = None
+        os.remove(self.temp_path)
+
+
+class CachingResponse(object):
+
+    """
+    HTTP response that is stored in the cache while it is read.
+
+    The body is stored when it was read completely,
+    it is discarded if the response is closed before that.
+    """
+
+    def __init__(self, response, writer):
+        """
+        Constructor.
+
+        Parameters:
+        - response : HTTP response
+        - writer : CacheWriter instance
+        """
+        self.response = response
+        self.writer = writer
+
+    def read(self, amt=None):
+        """
+        Read response body.
+
+        Parameters:
+        - amt : maximum number of bytes to read (default : all)
+        """
+        if amt is None:
+            data = self.response.read()
+        else:
+            data = self.response.read(amt)
+        self.writer.write(data)
+        if amt is None or not data:
+            self.writer.commit()
+        return data
+
+    def readline(self, limit=-1):
+        """
+        Read a line of the response body.
+
+        Parameters:
+        - limit : maximum number of bytes to read
+        """
+        line = self.response.readline(limit)
+        self.writer.write(line)
+        if not line:
+            self.writer.commit()
+        return line
+
+    def __iter__(self):
+        """Iterate lines of the response body."""
+        for line in self.response:
+            self.writer.write(line)
+            yield line
+        self.writer.commit()
+
+    def info(self):
+        """Return response headers."""
+        return self.response.info()
+
+    def close(self):
+        """Close response, discard the body if it was not read completely."""
+        self.writer.discard()
+        self.response.close()
+
+    def __enter__(self):
+        """Enter context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit context manager, close response."""
+        self.close()
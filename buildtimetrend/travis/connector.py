@@ -21,49 +21,517 @@ You should have received a copy of the GNU Affero General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 from builtins import str
+from builtins import object
 import codecs
 import json
+import zlib
+import socket
+import threading
 from buildtimetrend import logger
 from buildtimetrend.tools import check_dict
+from buildtimetrend.tools import is_dict
+from buildtimetrend.tools import is_list
+from buildtimetrend.travis.cache import CachingResponse
 import buildtimetrend
 try:
     # For Python 3.0 and later
     from urllib.request import Request, build_opener
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import urljoin, urlsplit
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
 except ImportError:
     # Fall back to Python 2's urllib2
-    from urllib2 import Request, build_opener
+    from urllib2 import Request, build_opener, HTTPError, URLError
+    from urlparse import urljoin, urlsplit
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
 
 TRAVIS_ORG_API_URL = 'https://api.travis-ci.org/'
+# default number of idle connections kept open per host
+DEFAULT_POOL_SIZE = 10
+# redirect status codes that are followed by HTTPConnectionPool
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# maximum number of redirects followed for a request (same as urllib)
+MAX_REDIRECTS = 10
+# size of the compressed chunks read from a compressed response
+DECOMPRESS_CHUNK_SIZE = 16 * 1024
+# content encodings that are decompressed
+SUPPORTED_ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+
+
+def is_finished(data):
+    """
+    Check if the job(s) or builds in Travis CI API response data are finished.
+
+    Parameters:
+    - data : Travis CI API response data (job, jobs or builds)
+    """
+    if not is_dict(data):
+        return False
+
+    if "job" in data:
+        return is_dict(data["job"]) and bool(data["job"].get("finished_at"))
+
+    for key in ("jobs", "builds"):
+        if key in data and is_list(data[key]):
+            return len(data[key]) > 0 and all(
+                is_dict(item) and bool(item.get("finished_at"))
+                for item in data[key]
+            )
+
+    return False
+
+
+class HTTPConnectionPool(object):
+
+    """
+    Pool of persistent (keep-alive) HTTP connections.
+
+    Connections are reused for subsequent requests to the same host,
+    so the TCP connection and TLS handshake is only done once.
+    The pool can be shared by several threads, a connection is used
+    by one request at a time.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=None):
+        """
+        Constructor.
+
+        Parameters:
+        - pool_size : maximum number of idle connections kept per host,
+                      more connections are opened if needed,
+                      but they are closed after use
+        - timeout : socket timeout in seconds (default : no timeout)
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.idle_connections = {}
+        self.lock = threading.Lock()
+
+    def request(self, url, headers=None):
+        """
+        Send GET request, using a pooled connection.
+
+        Returns a PooledResponse, the connection is returned to the pool
+        when the response is read completely.
+        Redirects are followed, also to another host.
+        Raises HTTPError if the response has an error status,
+        or if a redirect can't be followed,
+        and URLError if the request failed.
+
+        Parameters:
+        - url : url to request
+        - headers : dictionary with HTTP request headers
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.send_request(url, headers)
+            if response.status not in REDIRECT_STATUSES:
+                return response
+
+            location = response.headers.get('Location')
+            # read the body, so the connection is returned to the pool
+            response.read()
+            response.close()
+            if not location:
+                raise HTTPError(
+                    url, response.status, "Redirect without location",
+                    response.headers, None
+                )
+
+            logger.info("Redirected to %s", location)
+            url = urljoin(url, location)
+
+        raise HTTPError(
+            url, response.status, "Too many redirects",
+            response.headers, None
+        )
+
+    def send_request(self, url, headers=None):
+        """
+        Send GET request, using a pooled connection, without redirects.
+
+        Returns a PooledResponse.
+        Raises HTTPError if the response has an error status,
+        and URLError if the request failed.
+
+        Parameters:
+        - url : url to request
+        - headers : dictionary with HTTP request headers
+        """
+        url_parts = urlsplit(url)
+        host = (url_parts.scheme, url_parts.netloc)
+        path = url_parts.path or '/'
+        if url_parts.query:
+            path += '?' + url_parts.query
+
+        # retry once with a new connection if a reused connection
+        # was closed by the server while it was idle
+        while True:
+            connection, reused = self.get_connection(host)
+            try:
+                connection.request('GET', path, headers=headers or {})
+                response = connection.getresponse()
+                break
+            except (socket.error, HTTPException) as msg:
+                connection.close()
+                if not reused:
+                    raise URLError(msg)
+
+        pooled_response = PooledResponse(self, host, connection, response)
+
+        if response.status >= 400:
+            pooled_response.close()
+            raise HTTPError(
+                url, response.status, response.reason,
+                response.msg, None
+            )
+
+        return pooled_response
+
+    def get_connection(self, host):
+        """
+        Get an idle connection to host, or create a new one.
+
+        Returns a tuple with the connection and if it was reused.
+
+        Parameters:
+        - host : tuple with scheme and network location
+        """
+        with self.lock:
+            idle_connections = self.idle_connections.get(host)
+            if idle_connections:
+                return idle_connections.pop(), True
+
+        scheme, netloc = host
+        if scheme == 'https':
+            connection_class = HTTPSConnection
+        else:
+            connection_class = HTTPConnection
+
+        if self.timeout is None:
+            return connection_class(netloc), False
+        return connection_class(netloc, timeout=self.timeout), False
+
+    def release_connection(self, host, connection):
+        """
+        Return connection to the pool.
+
+        The connection is closed if the pool is full.
+
+        Parameters:
+        - host : tuple with scheme and network location
+        - connection : connection to return to the pool
+        """
+        with self.lock:
+            idle_connections = self.idle_connections.setdefault(host, [])
+            if len(idle_connections) < self.pool_size:
+                idle_connections.append(connection)
+                return
+
+        connection.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self.lock:
+            idle_connections = self.idle_connections
+            self.idle_connections = {}
+
+        for connections in idle_connections.values():
+            for connection in connections:
+                connection.close()
+
+
+class PooledResponse(object):
+
+    """
+    HTTP response of a pooled connection.
+
+    Can be read and iterated like the response returned by urlopen().
+    The connection is returned to the pool when the response body
+    is read completely, closing the response before that
+    closes the connection.
+    """
+
+    def __init__(self, pool, host, connection, response):
+        """
+        Constructor.
+
+        Parameters:
+        - pool : HTTPConnectionPool the connection belongs to
+        - host : tuple with scheme and network location
+        - connection : HTTP connection
+        - response : HTTP response received on the connection
+        """
+        self.pool = pool
+        self.host = host
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.headers = response.msg
+
+    def read(self, amt=None):
+        """
+        Read response body.
+
+        Parameters:
+        - amt : maximum number of bytes to read (default : all)
+        """
+        data = self.response.read(amt)
+        self._check_complete()
+        return data
+
+    def readline(self, limit=-1):
+        """
+        Read a line of the response body.
+
+        Parameters:
+        - limit : maximum number of bytes to read
+        """
+        line = self.response.readline(limit)
+        self._check_complete()
+        return line
+
+    def __iter__(self):
+        """Iterate lines of the response body."""
+        for line in self.response:
+            yield line
+        self._check_complete()
+
+    def getcode(self):
+        """Return HTTP status code."""
+        return self.status
+
+    def info(self):
+        """Return response headers."""
+        return self.headers
+
+    def close(self):
+        """Close response, connection is closed if body was not read."""
+        if self.connection is None:
+            return
+
+        if self._is_complete():
+            self._check_complete()
+        else:
+            self.response.close()
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        """Enter context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit context manager, close response."""
+        self.close()
+
+    def _is_complete(self):
+        """Check if response body was read completely."""
+        # reading the last line doesn't always close the response
+        return self.response.isclosed() or self.response.length == 0
+
+    def _check_complete(self):
+        """Return connection to the pool if response body was read."""
+        if self.connection is not None and self._is_complete():
+            self.response.close()
+            self.pool.release_connection(self.host, self.connection)
+            self.connection = None
+
+
+class DecompressingResponse(object):
+
+    """
+    Decompress a gzip or deflate encoded HTTP response while it is read.
+
+    The response is read and decompressed in small chunks,
+    so lines can be processed as they arrive
+    and the whole body is never kept in memory.
+    """
+
+    def __init__(self, response):
+        """
+        Constructor.
+
+        Parameters:
+        - response : HTTP response with a compressed body
+        """
+        self.response = response
+        # detect zlib or gzip header automatically
+        self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+        self.first_chunk = True
+        self.buffer = b''
+        self.position = 0
+        self.eof = False
+
+    def read(self, amt=None):
+        """
+        Read decompressed response body.
+
+        Parameters:
+        - amt : maximum number of bytes to read (default : all)
+        """
+        if amt is None:
+            parts = [self.buffer[self.position:]]
+            while not self.eof:
+                parts.append(self._decompress_chunk())
+            self.buffer = b''
+            self.position = 0
+            return b''.join(parts)
+
+        while not self.eof and len(self.buffer) - self.position < amt:
+            self._fill_buffer()
+
+        end = min(self.position + amt, len(self.buffer))
+        data = self.buffer[self.position:end]
+        self.position = end
+        return data
+
+    def readline(self, limit=-1):
+        """
+        Read a line of the decompressed response body.
+
+        Parameters:
+        - limit : maximum number of bytes to read
+        """
+        line_end = self.buffer.find(b'\n', self.position)
+        while line_end < 0 and not self.eof:
+            # search only the newly added data
+            searched = len(self.buffer) - self.position
+            self._fill_buffer()
+            line_end = self.buffer.find(b'\n', self.position + searched)
+
+        if line_end < 0:
+            end = len(self.buffer)
+        else:
+            end = line_end + 1
+        if limit is not None and limit >= 0:
+            end = min(end, self.position + limit)
+
+        line = self.buffer[self.position:end]
+        self.position = end
+        return line
+
+    def __iter__(self):
+        """Iterate lines of the decompressed response body."""
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def getcode(self):
+        """Return HTTP status code."""
+        return self.response.getcode()
+
+    def info(self):
+        """Return response headers."""
+        return self.response.info()
+
+    def close(self):
+        """Close response."""
+        self.response.close()
+
+    def __enter__(self):
+        """Enter context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit context manager, close response."""
+        self.close()
+
+    def _fill_buffer(self):
+        """Add the next decompressed chunk to the buffer."""
+        data = self._decompress_chunk()
+        # drop data that was already read
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+
+    def _decompress_chunk(self):
+        """Read and decompress the next chunk of the response."""
+        chunk = self.response.read(DECOMPRESS_CHUNK_SIZE)
+
+        if not chunk:
+            self.eof = True
+            return self.decompressor.flush()
+
+        if self.first_chunk:
+            self.first_chunk = False
+            try:
+                return self.decompressor.decompress(chunk)
+            except zlib.error:
+                # some servers send deflate data without zlib header
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+        return self.decompressor.decompress(chunk)
+
+
+def decompress_response(response):
+    """
+    Decompress response while it is read, if it is compressed.
+
+    Parameters:
+    - response : HTTP response
+    """
+    encoding = response.info().get('Content-Encoding', '')
+    if encoding.strip().lower() in SUPPORTED_ENCODINGS:
+        return DecompressingResponse(response)
+
+    return response
 
 
 class TravisConnector(object):
 
     """Base class to connect to Travis CI API."""
 
-    def __init__(self):
-        """Constructor."""
+    def __init__(self, pool_size=None, cache=None):
+        """
+        Constructor.
+
+        Parameters:
+        - pool_size : reuse persistent connections to the API, keeping at most
+                      pool_size idle connections (default : a new connection
+                      is opened for every request)
+        - cache : ResponseCache instance, responses of finished jobs
+                  and builds are served from the cache, other cached
+                  responses are revalidated (default : no caching)
+        """
         self.api_url = None
         self.request_params = {
-            'user-agent': buildtimetrend.USER_AGENT
+            'user-agent': buildtimetrend.USER_AGENT,
+            'accept-encoding': 'gzip, deflate'
         }
+        if pool_size is None:
+            self.pool = None
+        else:
+            self.pool = HTTPConnectionPool(pool_size)
+        self.cache = cache
 
-    def download_job_log(self, job_id):
+    def download_job_log(self, job_id, finished=False):
         """
         Retrieve Travis CI job log.
 
         Parameters:
         - job_id : ID of the job to process
+        - finished : true if the job is finished (fe. from the job data),
+                     the log of a finished job doesn't change anymore
         """
         request = 'jobs/{}/log'.format(str(job_id))
         logger.info("Request build job log #%s", str(job_id))
-        return self._handle_request(request)
 
-    def json_request(self, json_request):
+        # the log of a finished job doesn't change anymore
+        finished = finished or self.cache is not None and \
+            self.cache.is_finished('jobs/{}'.format(str(job_id)))
+
+        return self._handle_request(request, finished=finished)
+
+    def json_request(self, json_request, final=True):
         """
         Retrieve Travis CI data using API.
 
         Parameters:
         - json_request : json_request to be sent to API
+        - final : store the response as final in the cache if the jobs or
+                  builds it contains are finished, set to false if
+                  the response can change anyway (fe. the latest builds)
         """
         result = self._handle_request(
             json_request,
@@ -73,15 +541,24 @@ class TravisConnector(object):
         )
 
         reader = codecs.getreader('utf-8')
-        return json.load(reader(result))
+        data = json.load(reader(result))
+
+        if self.cache is not None and final and is_finished(data):
+            self.cache.set_finished(json_request)
+
+        return data
 
-    def _handle_request(self, request, params=None):
+    def _handle_request(self, request, params=None, finished=False):
         """
         Retrieve Travis CI data using API.
 
+        If a cache is set, the response is served from the cache
+        if it is final, or revalidated if it isn't.
+
         Parameters:
         - request : request to be sent to API
         - params : HTTP request parameters
+        - finished : true if the response will not change anymore
         """
         request_url = self.api_url + request
 
@@ -89,21 +566,85 @@ class TravisConnector(object):
         if params is not None and check_dict(params, "params"):
             request_params.update(params)
 
-        req = Request(
-            request_url,
-            None,
-            request_params
-        )
-        opener = build_opener()
+        if self.cache is None:
+            return self._send_request(request_url, request_params)
+
+        entry = self.cache.get(request)
+        if entry is not None:
+            if entry['finished']:
+                logger.info("Request from cache : %s", request)
+                return self.cache.open(entry)
+
+            # revalidate cached response
+            if entry['etag']:
+                request_params['if-none-match'] = entry['etag']
+            if entry['last_modified']:
+                request_params['if-modified-since'] = entry['last_modified']
+
+        try:
+            response = self._send_request(request_url, request_params)
+        except HTTPError as msg:
+            if entry is None or msg.code != 304:
+                raise
+            response = msg
+
+        if response.getcode() == 304:
+            logger.info("Cached response is still valid : %s", request)
+            response.close()
+            if finished:
+                self.cache.set_finished(request)
+            return self.cache.open(entry)
+
+        headers = response.info()
+        return CachingResponse(response, self.cache.writer(
+            request,
+            headers.get('ETag'),
+            headers.get('Last-Modified'),
+            finished
+        ))
+
+    def _send_request(self, request_url, request_params):
+        """
+        Send request to Travis CI API.
+
+        Parameters:
+        - request_url : url to request
+        - request_params : HTTP request headers
+        Returns the response, compressed responses are decompressed
+        while they are read.
+        """
         logger.info("Request from Travis CI API : %s", request_url)
-        return opener.open(req)
+        if self.pool is not None:
+            response = self.pool.request(request_url, request_params)
+        else:
+            req = Request(
+                request_url,
+                None,
+                request_params
+            )
+            opener = build_opener()
+            response = opener.open(req)
+
+        return decompress_response(response)
+
+    def close(self):
+        """Close idle pooled connections."""
+        if self.pool is not None:
+            self.pool.close()
 
 
 class TravisOrgConnector(TravisConnector):
 
     """Connects to Travis.org API."""
 
-    def __init__(self):
-        """Constructor."""
-        super(TravisOrgConnector, self).__init__()
+    def __init__(self, pool_size=None, cache=None):
+        """
+        Constructor.
+
+        Parameters:
+        - pool_size : maximum number of idle persistent connections
+                      (default : no connection pooling)
+        - cache : ResponseCache instance (default : no caching)
+        """
+        super(TravisOrgConnector, self).__init__(pool_size, cache)
         self.api_url = TRAVIS_ORG_API_URL
@@ -0,0 +1,403 @@
+# vim: set expandtab sw=4 ts=4:
+"""
+Import a range of Travis CI builds, respecting the API rate limit.
+
+Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+
+This file is part of buildtimetrend/python-lib
+<https://github.com/buildtimetrend/python-lib/>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import division
+from builtins import str
+from builtins import object
+import time
+import threading
+from email.utils import parsedate_tz, mktime_tz
+from multiprocessing.pool import ThreadPool
+from buildtimetrend import logger
+from buildtimetrend.settings import Settings
+from buildtimetrend.service import get_repo_data_detail
+from buildtimetrend.travis.parser import TravisData
+from buildtimetrend.travis.pipeline import ImportPipeline
+try:
+    # For Python 3.0 and later
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    # Fall back to Python 2's urllib2
+    from urllib2 import HTTPError, URLError
+
+# default number of builds imported concurrently
+DEFAULT_MAX_WORKERS = 4
+# default number of retries of a build import after a transient error
+DEFAULT_MAX_RETRIES = 3
+# minimal pause (in seconds) after an error, if Retry-After is not set
+MIN_BACKOFF = 1
+
+
+def import_travis_build(repo, build, stored_jobs=None, connector=None,
+                        writer=None):
+    """
+    Retrieve and parse a Travis CI build, and send its build jobs to Keen.io.
+
+    Returns the number of imported build jobs.
+    Raises HTTPError or URLError if retrieving data fails,
+    and IOError if the writer failed to send the events of a build job.
+
+    Parameters:
+    - repo : github repository slug (fe. buildtimetrend/python-lib)
+    - build : Travis CI build number
+    - stored_jobs : set with the ids of the jobs of the build that are
+                    already stored by an earlier attempt, they are skipped,
+                    the ids of the jobs that are stored are added
+    - connector : TravisConnector instance
+    - writer : keenio.EventWriter instance, events are sent in batches
+               (default : events are sent immediately)
+    """
+    if stored_jobs is None:
+        stored_jobs = set()
+
+    # build jobs are only sent, don't keep them
+    travis_data = TravisData(repo, build, connector, streaming=True)
+
+    if not travis_data.get_build_data():
+        raise URLError("Error getting build data of build #{}".format(build))
+
+    # download, parse and send build jobs in a pipeline
+    pipeline = ImportPipeline(
+        travis_data, detail=get_repo_data_detail(repo), writer=writer,
+        stored_jobs=stored_jobs
+    )
+    pipeline.run()
+    return len(stored_jobs)
+
+
+def get_retry_after(error):
+    """
+    Return the delay (in seconds) requested by the Retry-After header.
+
+    Returns None if the header is not set or invalid.
+
+    Parameters:
+    - error : HTTPError
+    """
+    headers = getattr(error, 'headers', None)
+    if headers is None:
+        return None
+
+    retry_after = headers.get('Retry-After')
+    if retry_after is None:
+        return None
+
+    retry_after = retry_after.strip()
+    if retry_after.isdigit():
+        return int(retry_after)
+
+    # Retry-After can be an HTTP date
+    retry_date = parsedate_tz(retry_after)
+    if retry_date is None:
+        return None
+    return max(0, mktime_tz(retry_date) - time.time())
+
+
+class TokenBucket(object):
+
+    """
+    Token bucket rate limiter, can be shared by threads.
+
+    Tokens are added at a constant rate, up to the capacity of the bucket.
+    Each request takes a token, so requests that were not made
+    while idle can be made in a burst afterwards.
+    """
+
+    def __init__(self, rate=None, capacity=1):
+        """
+        Constructor.
+
+        Parameters:
+        - rate : number of tokens added per second (None : unlimited)
+        - capacity : maximum number of tokens in the bucket
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.time()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, wait until one is available."""
+        while True:
+            with self.lock:
+                wait = self._get_wait_time()
+                if wait <= 0:
+                    self.tokens -= 1
+                    return
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        """
+        Change the rate at which tokens are added.
+
+        Parameters:
+        - rate : number of tokens added per second (None : unlimited)
+        """
+        with self.lock:
+            self._refill()
+            self.rate = rate
+
+    def pause(self, seconds):
+        """
+        Don't hand out tokens for a while, and empty the bucket.
+
+        Parameters:
+        - seconds : duration of the pause
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+            self.tokens = 0
+            self.updated_at = self.paused_until
+
+    def _refill(self):
+        """Add the tokens for the time passed since the last update."""
+        now = time.time()
+        if self.rate and now > self.updated_at:
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.updated_at) * self.rate
+            )
+        self.updated_at = max(self.updated_at, now)
+
+    def _get_wait_time(self):
+        """Return time to wait for a token, 0 if a token is available."""
+        now = time.time()
+        if self.paused_until > now:
+            return self.paused_until - now
+
+        if not self.rate:
+            return 0
+
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class MultiImport(object):
+
+    """
+    Import a range of Travis CI builds of a repo.
+
+    Builds are imported concurrently, the rate at which imports are started
+    is limited by a token bucket, with a rate derived from setting
+    multi_import:delay (seconds between builds).
+    When the API rate limit is exceeded (status 429), all imports pause
+    for the time requested by the Retry-After header, and the import rate is
+    halved. The rate is increased again, up to the configured rate,
+    while builds are imported successfully.
+    When a build import is retried, the jobs that were already stored
+    are skipped, so they aren't stored twice.
+    """
+
+    def __init__(self, repo, import_build=None, max_workers=None,
+                 delay=None, max_builds=None, max_retries=None,
+                 progress=None):
+        """
+        Constructor.
+
+        Parameters:
+        - repo : github repository slug (fe. buildtimetrend/python-lib)
+        - import_build : function importing a build, called with repo,
+                         build number and a set with the ids of the jobs
+                         that are already stored, to which the function
+                         adds the jobs it stores
+                         (default : import_travis_build())
+        - max_workers : number of builds imported concurrently
+        - delay : average delay (in seconds) between starting build imports,
+                  0 : no rate limit (default : setting multi_import:delay)
+        - max_builds : maximum number of builds in a range
+                       (default : setting multi_import:max_builds)
+        - max_retries : number of retries of a build after an error
+        - progress : function called after each build with the build number,
+                     the result of the import (None if it failed)
+                     and the number of builds done and in total
+        """
+        multi_import = Settings().get_setting("multi_import") or {}
+
+        self.repo = repo
+        self.import_build = import_build or import_travis_build
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        if delay is None:
+            delay = multi_import.get("delay", 0)
+        if max_builds is None:
+            max_builds = multi_import.get("max_builds")
+        self.max_builds = max_builds
+        if max_retries is None:
+            max_retries = DEFAULT_MAX_RETRIES
+        self.max_retries = max_retries
+        self.progress = progress
+
+        if delay > 0:
+            self.max_rate = 1 / delay
+        else:
+            self.max_rate = None
+        self.bucket = TokenBucket(self.max_rate, self.max_workers)
+
+        self.lock = threading.Lock()
+        self.done = 0
+        self.total = 0
+
+    def import_builds(self, first_build, last_build):
+        """
+        Import a range of builds.
+
+        Returns a dictionary with the result of each imported build,
+        and the errors of the failed builds.
+
+        Parameters:
+        - first_build : number of the first build to import
+        - last_build : number of the last build to import
+        """
+        builds = list(range(int(first_build), int(last_build) + 1))
+        if self.max_builds is not None and len(builds) > self.max_builds:
+            logger.warning(
+                "Only the first %d of %d builds are imported",
+                self.max_builds, len(builds)
+            )
+            builds = builds[:self.max_builds]
+
+        self.done = 0
+        self.total = len(builds)
+        results = {"imported": {}, "failed": {}}
+        start_time = time.time()
+
+        pool = ThreadPool(self.max_workers)
+        try:
+            for build, result, error in pool.imap_unordered(
+                    self.import_with_retry, builds):
+                if error is None:
+                    results["imported"][build] = result
+                else:
+                    results["failed"][build] = error
+        finally:
+            pool.terminate()
+
+        logger.info(
+            "Imported %d builds of %s in %.1fs, %d failed",
+            len(results["imported"]), self.repo,
+            time.time() - start_time, len(results["failed"])
+        )
+        return results
+
+    def import_with_retry(self, build):
+        """
+        Import a build, retry after transient errors.
+
+        Returns a tuple with the build number, result of the import
+        and error message (None if the import succeeded).
+
+        Parameters:
+        - build : number of the build to import
+        """
+        error = None
+        # jobs stored by a failed attempt are skipped when retrying
+        stored_jobs = set()
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                result = self.import_build(self.repo, build, stored_jobs)
+            except HTTPError as msg:
+                error = str(msg)
+                if msg.code == 429:
+                    self.rate_limited(get_retry_after(msg), attempt)
+                elif msg.code < 500:
+                    # client error, retrying doesn't help
+                    break
+                else:
+                    self.bucket.pause(get_retry_after(msg) or
+                                      MIN_BACKOFF * 2 ** attempt)
+            except (URLError, IOError) as msg:
+                # fe. connection failed, or sending events failed
+                error = str(msg)
+                self.bucket.pause(MIN_BACKOFF * 2 ** attempt)
+            except Exception as msg:
+                # fe. storing failed, retrying doesn't help
+                logger.error(
+                    "Error importing build #%s of %s : %s",
+                    str(build), self.repo, msg
+                )
+                return self.report(build, None, str(msg))
+            else:
+                self.increase_rate()
+                return self.report(build, result, None)
+
+            logger.warning(
+                "Error importing build #%s of %s (attempt %d) : %s",
+                str(build), self.repo, attempt + 1, error
+            )
+
+        return self.report(build, None, error)
+
+    def rate_limited(self, retry_after, attempt):
+        """
+        Pause imports and halve the import rate after exceeding rate limit.
+
+        Parameters:
+        - retry_after : delay requested by the API (None if not set)
+        - attempt : number of the failed attempt
+        """
+        if retry_after is None:
+            retry_after = MIN_BACKOFF * 2 ** attempt
+        logger.warning("Travis CI API rate limit exceeded, pause %.1fs",
+                       retry_after)
+
+        with self.lock:
+            if self.bucket.rate:
+                self.bucket.set_rate(self.bucket.rate / 2)
+        self.bucket.pause(retry_after)
+
+    def increase_rate(self):
+        """Increase import rate after a succesful import, up to max rate."""
+        with self.lock:
+            if self.bucket.rate and self.max_rate and \
+                    self.bucket.rate < self.max_rate:
+                self.bucket.set_rate(min(
+                    self.max_rate, self.bucket.rate + self.max_rate / 10
+                ))
+
+    def report(self, build, result, error):
+        """
+        Report progress after a build is imported.
+
+        Returns a tuple with the build number, result and error.
+
+        Parameters:
+        - build : number of the imported build
+        - result : result of the import
+        - error : error message, None if the import succeeded
+        """
+        with self.lock:
+            self.done += 1
+            done = self.done
+
+        logger.info(
+            "Build #%s of %s %s (%d/%d)",
+            str(build), self.repo,
+            "imported" if error is None else "failed", done, self.total
+        )
+        if self.progress is not None:
+            self.progress(build, result, done, self.total)
+
+        return build, result, error
@@ -22,14 +22,23 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 from builtins import str
 from builtins import object
+import io
+import os
+import itertools
 import re
+import copy
 import json
+import mmap
+import logging
+from multiprocessing.pool import ThreadPool
 from buildtimetrend import logger
 from buildtimetrend import tools
 from buildtimetrend.buildjob import BuildJob
+from buildtimetrend.stages import Stages
 from buildtimetrend.collection import Collection
 from buildtimetrend.travis.connector import TravisOrgConnector
 from buildtimetrend.travis.connector import TravisConnector
+from buildtimetrend.travis.connector import is_finished
 from buildtimetrend.travis.substage import TravisSubstage
 try:
     # For Python 3.0 and later
@@ -40,22 +49,600 @@ except ImportError:
 
 
 # strings to parse timestamps in Travis CI log file
+#
+# Timing tags are terminated by a carriage return (CR),
+# each pattern is matched against a log line segment between two CR's.
+# The variable fields can't contain the separators surrounding them,
+# so matching time is linear, even on very long lines.
 TRAVIS_LOG_PARSE_TIMING_STRINGS = [
-    r'travis_time:end:(?P<end_hash>.*):start=(?P<start_timestamp>\d+),'
-    r'finish=(?P<finish_timestamp>\d+),duration=(?P<duration>\d+)\x0d\x1b',
-    r'travis_fold:end:(?P<end_stage>\w+)\.(?P<end_substage>\d+)\x0d\x1b',
-    r'travis_fold:start:(?P<start_stage>\w+)\.(?P<start_substage>\d+)\x0d\x1b',
-    r'travis_time:start:(?P<start_hash>.*)\x0d\x1b\[0K',
-    r'\$\ (?P<command>.*)\r',
+    r'travis_time:end:(?P<end_hash>[^:\x1b]*):start=(?P<start_timestamp>\d+),'
+    r'finish=(?P<finish_timestamp>\d+),duration=(?P<duration>\d+)',
+    r'travis_fold:end:(?P<end_stage>\w+)\.(?P<end_substage>\d+)',
+    r'travis_fold:start:(?P<start_stage>\w+)\.(?P<start_substage>\d+)',
+    r'travis_time:start:(?P<start_hash>[^:\x1b]*)',
+    r'\$\ (?P<command>[^\r]*)',
+]
+# tag types matched by TRAVIS_LOG_PARSE_TIMING_STRINGS (in the same order),
+# the named groups each tag type provides,
+# and the escape sequence that should follow the CR terminating the tag
+TRAVIS_LOG_PARSE_TIMING_TAGS = [
+    ('end_time', ('end_hash', 'start_timestamp', 'finish_timestamp',
+                  'duration'), '\x1b'),
+    ('end_stage', ('end_stage', 'end_substage'), '\x1b'),
+    ('start_stage', ('start_stage', 'start_substage'), '\x1b'),
+    ('start_time', ('start_hash',), '\x1b[0K'),
+    ('command', ('command',), ''),
 ]
 TRAVIS_LOG_PARSE_WORKER_STRING = r'Using worker:\ (?P<hostname>.*):(?P<os>.*)'
+# substrings marking log lines with timing tags, a worker tag
+# and the start of the first timed command (end of the log header)
+TRAVIS_LOG_MARKERS = ('travis_', 'Using worker:', 'travis_time:start')
+TRAVIS_LOG_MARKERS_BYTES = (b'travis_', b'Using worker:', b'travis_time:start')
+# phases of parsing a job log :
+# - header : lines before the first timed command, containing the worker tag
+# - body : lines with the timed commands, only timing tags are parsed
+LOG_PHASE_HEADER = "header"
+LOG_PHASE_BODY = "body"
+# size of the window used to scan memory mapped log files
+MMAP_WINDOW_SIZE = 32 * 1024 * 1024
+# maximum number of jobs of which the data is retrieved in one request
+JOB_DATA_BATCH_SIZE = 50
+# size of the blocks in which the unparsed rest of a job log is read
+LOG_READ_SIZE = 64 * 1024
+
+
+def compile_timing_tag_scanner(parse_strings, tags, as_bytes=False):
+    """
+    Compile the timing tag patterns in one regular expression.
+
+    Each pattern is wrapped in a named group (the tag type),
+    so the tag type of a match is available as match.lastgroup.
+    The expression matches a tag at the end of a log line segment.
+
+    Parameters:
+    - parse_strings : list of timing tag patterns
+    - tags : list of (tag type, named groups, terminator) tuples,
+             in the same order as parse_strings
+    - as_bytes : compile a pattern to scan bytes instead of strings
+    """
+    alternatives = []
+    for (tag_type, _, _), parse_string in zip(tags, parse_strings):
+        alternatives.append(
+            r'(?P<tag_{name}>{pattern})'.format(
+                name=tag_type, pattern=parse_string
+            )
+        )
+
+    # all timing tags start with 'travis_' or '$ ',
+    # checking this first allows skipping other positions quickly
+    pattern = r'(?=travis_|\$\ )(?:{0})\Z'.format('|'.join(alternatives))
+
+    if as_bytes:
+        return re.compile(pattern.encode('utf-8'))
+
+    return re.compile(pattern)
+
+
+TIMING_TAG_SCANNER = compile_timing_tag_scanner(
+    TRAVIS_LOG_PARSE_TIMING_STRINGS, TRAVIS_LOG_PARSE_TIMING_TAGS
+)
+TIMING_TAG_SCANNER_BYTES = compile_timing_tag_scanner(
+    TRAVIS_LOG_PARSE_TIMING_STRINGS, TRAVIS_LOG_PARSE_TIMING_TAGS, True
+)
+# named groups of each tag type, indexed by the name of the wrapping group
+TIMING_TAG_GROUPS = dict(
+    ('tag_' + tag_type, groups)
+    for tag_type, groups, _ in TRAVIS_LOG_PARSE_TIMING_TAGS
+)
+# terminator of each tag type, indexed by the name of the wrapping group
+TIMING_TAG_TERMINATORS = dict(
+    ('tag_' + tag_type, terminator)
+    for tag_type, _, terminator in TRAVIS_LOG_PARSE_TIMING_TAGS
+)
+TIMING_TAG_TERMINATORS_BYTES = dict(
+    (name, terminator.encode('utf-8'))
+    for name, terminator in TIMING_TAG_TERMINATORS.items()
+)
+
+
+def decode_log_line(line):
+    """
+    Convert a log line to a string.
+
+    Invalid UTF-8 sequences are replaced instead of raising an error.
+
+    Parameters:
+    - line : line from logfile (bytes or string)
+    """
+    if isinstance(line, bytes):
+        return line.decode('utf-8', 'replace')
+
+    return line
+
+
+def scan_timing_tags(line):
+    """
+    Scan a log line for Travis CI timing tags.
+
+    Generator yielding a dictionary with the parsed tags
+    of each timing tag found in the line, in order of appearance.
+    If the line is bytes, only the parsed tag values are decoded.
+
+    The line is split in segments on carriage returns,
+    a segment can end with one tag. Scanning time is linear
+    in the length of the line.
+
+    Parameters:
+    - line : line from logfile containing Travis CI tags
+    """
+    if isinstance(line, bytes):
+        segments = line.split(b'\r')
+        scanner = TIMING_TAG_SCANNER_BYTES
+        terminators = TIMING_TAG_TERMINATORS_BYTES
+    else:
+        segments = line.split('\r')
+        scanner = TIMING_TAG_SCANNER
+        terminators = TIMING_TAG_TERMINATORS
+
+    # the last segment isn't terminated by a carriage return
+    for index in range(len(segments) - 1):
+        match = scanner.search(segments[index])
+        if match and \
+                segments[index + 1].startswith(terminators[match.lastgroup]):
+            yield {
+                group: decode_log_line(match.group(group))
+                for group in TIMING_TAG_GROUPS[match.lastgroup]
+            }
+
+
+def find_tag_lines(buffer, markers, start=0, end=None):
+    """
+    Find the lines in a buffer that contain a marker.
+
+    Generator yielding each line (including the line ending)
+    that contains any of the markers, in order of appearance.
+    Only the matching lines are copied from the buffer,
+    so it can be used to scan a memory mapped file.
+
+    Parameters:
+    - buffer : bytes or mmap object
+    - markers : list of markers (bytes) to look for
+    - start : position in buffer where the first line starts
+    - end : position in buffer where the last line ends (default : end)
+    """
+    if end is None:
+        end = len(buffer)
+
+    position = start
+    next_found = [buffer.find(marker, start, end) for marker in markers]
+
+    while True:
+        found = [index for index in next_found if index >= 0]
+        if not found:
+            return
+
+        index = min(found)
+        # start of the line containing the marker
+        line_start = buffer.rfind(b'\n', position, index)
+        line_start = position if line_start < 0 else line_start + 1
+        # end of the line, including the line ending
+        line_end = buffer.find(b'\n', index, end)
+        line_end = end if line_end < 0 else line_end + 1
+
+        yield buffer[line_start:line_end]
+
+        # find next occurrence of the markers found in the yielded line
+        position = line_end
+        next_found = [
+            buffer.find(marker, position, end) if 0 <= found_at < position
+            else found_at
+            for found_at, marker in zip(next_found, markers)
+        ]
+
+
+def find_tag_lines_mmap(file_stream, markers, window_size=MMAP_WINDOW_SIZE):
+    """
+    Find the lines in a file that contain a marker, using memory mapping.
+
+    Generator yielding each line (including the line ending)
+    that contains any of the markers, in order of appearance.
+    The file is mapped in windows of window_size bytes,
+    so memory usage doesn't depend on the file size.
+    Of a line continuing in the next window, only its offset is kept,
+    and if it contains a marker, it is read from the file when it ends.
+
+    Parameters:
+    - file_stream : file object, opened in binary mode
+    - markers : list of markers (bytes) to look for
+    - window_size : size of the mapped window,
+                    a multiple of mmap.ALLOCATIONGRANULARITY
+    """
+    file_size = os.fstat(file_stream.fileno()).st_size
+    offset = 0
+    # number of bytes at the end of a window that can hold
+    # the start of a marker continuing in the next window
+    overlap = max(len(marker) for marker in markers) - 1
+    # offset in the file of the incomplete last line of the previous window
+    # (None if the window ended with a line ending),
+    # if it contains a marker and its last overlap bytes
+    line_offset = None
+    line_has_marker = False
+    line_tail = b''
+
+    while offset < file_size:
+        length = min(window_size, file_size - offset)
+        window = mmap.mmap(
+            file_stream.fileno(), length,
+            access=mmap.ACCESS_READ, offset=offset
+        )
+        try:
+            lines_start = 0
+
+            if line_offset is not None:
+                # continue the line started in a previous window
+                lines_start = window.find(b'\n') + 1
+                if lines_start == 0 and offset + length >= file_size:
+                    lines_start = length
+                line_part_end = lines_start or length
+
+                line_has_marker = line_has_marker or has_marker(
+                    line_tail + window[:min(overlap, line_part_end)],
+                    markers
+                ) or has_marker(window, markers, 0, line_part_end)
+                line_tail = (line_tail + window[
+                    max(0, line_part_end - overlap):line_part_end
+                ])[-overlap:] if overlap else b''
+
+                if lines_start > 0:
+                    if line_has_marker:
+                        file_stream.seek(line_offset)
+                        yield file_stream.read(
+                            offset + lines_start - line_offset
+                        )
+                    line_offset = None
+
+            if line_offset is None:
+                if offset + length < file_size:
+                    # lines after the last line ending continue
+                    # in the next window
+                    lines_end = max(lines_start, window.rfind(b'\n') + 1)
+                else:
+                    lines_end = length
+
+                for line in find_tag_lines(
+                        window, markers, lines_start, lines_end):
+                    yield line
+
+                if lines_end < length:
+                    line_offset = offset + lines_end
+                    line_has_marker = has_marker(
+                        window, markers, lines_end, length
+                    )
+                    line_tail = window[
+                        max(lines_end, length - overlap):length
+                    ] if overlap else b''
+        finally:
+            window.close()
+
+        offset += length
+
+
+def has_marker(buffer, markers, start=0, end=None):
+    """
+    Check if a part of a buffer contains any of the markers.
+
+    Parameters:
+    - buffer : bytes or mmap to search
+    - markers : list of markers (bytes) to look for
+    - start : start of the searched part
+    - end : end of the searched part (default : end of the buffer)
+    """
+    if end is None:
+        end = len(buffer)
+    return any(buffer.find(marker, start, end) >= 0 for marker in markers)
+
+
+def get_log_markers(line):
+    """
+    Return the markers of lines with Travis CI tags, as bytes or string.
+
+    Returns a tuple with the timing tag, worker tag and
+    command start markers (see TRAVIS_LOG_MARKERS),
+    of the same type as line.
+
+    Parameters:
+    - line : log line (bytes or string)
+    """
+    if isinstance(line, bytes):
+        return TRAVIS_LOG_MARKERS_BYTES
+    return TRAVIS_LOG_MARKERS
+
+
+def get_tagged_body_lines(lines):
+    """
+    Return the lines with timing tags of the body of a job log.
+
+    Generator yielding the lines containing a timing tag marker,
+    each line is checked with a single substring test.
+
+    Parameters:
+    - lines : iterator with the job log lines after the header
+    """
+    first_line = next(lines, None)
+    if first_line is None:
+        return
+
+    timing_marker = get_log_markers(first_line)[0]
+    for line in itertools.chain((first_line,), lines):
+        if timing_marker in line:
+            yield line
+
+
+def create_substage_index(build_config):
+    """
+    Create an index of the commands in a Travis CI build config.
+
+    Returns a dictionary with the substage name (fe. install.2) of each
+    command, a command that occurs several times gets the name of its
+    first occurrence. Returns None if build_config is not set.
+
+    Parameters:
+    - build_config : Travis CI build config (None if it is not set)
+    """
+    if build_config is None:
+        return None
+
+    substage_index = {}
+    # check if build_config collection is empty
+    if build_config:
+        for stage_name, commands in build_config.items():
+            if not tools.is_list(commands):
+                continue
+            for substage_number, command in enumerate(commands, 1):
+                if tools.is_string(command) and \
+                        command not in substage_index:
+                    substage_index[command] = "{stage}.{substage:d}".format(
+                        stage=stage_name, substage=substage_number
+                    )
+
+    return substage_index
+
+
+def get_substage_name(command, build_config, substage_index=None):
+    """
+    Resolve Travis CI substage name that corresponds to a cli command.
+
+    Parameters:
+    - command : cli command
+    - build_config : Travis CI build config (None if it is not set)
+    - substage_index : index of the commands in build_config,
+                       see create_substage_index() (created if not set)
+    """
+    if not tools.is_string(command):
+        return ""
+
+    if build_config is None:
+        logger.warning(
+            "Travis CI build config is not set"
+        )
+        return ""
+
+    if substage_index is None:
+        substage_index = create_substage_index(build_config)
+
+    substage_name = substage_index.get(command, "")
+    if substage_name:
+        logger.debug(
+            "Substage %s corresponds to '%s'", substage_name, command
+        )
+
+    return substage_name
+
+
+def parse_timing_tags(line, substage, stages, build_config,
+                      substage_index=None):
+    """
+    Parse and process the Travis CI timing tags in a log line.
+
+    Returns the substage to continue parsing with,
+    a new substage if the current substage finished.
+
+    Parameters:
+    - line : line from logfile containing Travis CI tags (bytes or string)
+    - substage : TravisSubstage instance, substage that is being parsed
+    - stages : Stages or BuildJob instance, finished substages are added
+    - build_config : Travis CI build config, to name substages
+    - substage_index : index of the commands in build_config,
+                       see create_substage_index()
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        escaped_line = decode_log_line(line)
+        escaped_line = \
+            escaped_line.replace('\x0d', '*').replace('\x1b', 'ESC')
+        logger.debug('line : %s', escaped_line)
+
+    # parse Travis CI timing tags
+    for tags_dict in scan_timing_tags(line):
+        substage.process_parsed_tags(tags_dict)
+
+        # when finished : log stage and create a new instance
+        if substage.has_finished():
+            # set substage name, if it is not set
+            if not substage.has_name() and substage.has_command():
+                substage.set_name(
+                    get_substage_name(
+                        substage.get_command(), build_config, substage_index
+                    )
+                )
+
+            # only log complete substages
+            if not substage.finished_incomplete:
+                stages.add_stage(substage.stage)
+            substage = TravisSubstage()
+
+    return substage
+
+
+def parse_worker_tag(line):
+    """
+    Parse Travis CI worker tag.
+
+    Returns a dictionary with the worker hostname and os,
+    None if the line doesn't contain a worker tag.
+
+    Parameters:
+    - line : line from logfile containing Travis CI tags (bytes or string)
+    """
+    line = decode_log_line(line)
+    logger.debug('line : %s', line)
+
+    # parse Travis CI worker tags
+    result = re.search(TRAVIS_LOG_PARSE_WORKER_STRING, line)
+    if not result:
+        return None
+
+    worker_tags = result.groupdict()
+
+    # check if parameter worker_tags is a dictionary and
+    # if it contains all required tags
+    tag_list = list({'hostname', 'os'})
+    if tools.check_dict(worker_tags, "worker_tags", tag_list):
+        logger.debug("Worker tags : %s", worker_tags)
+        return worker_tags
+
+    return None
+
+
+def parse_job_log_data(log, build_config=None, check_timing_tags=True,
+                       substage_index=None):
+    """
+    Parse a Travis CI job log, without side effects.
+
+    The function doesn't depend on or change any shared state,
+    so it can be called concurrently, fe. in a process pool.
+    The result only contains plain (picklable) data, add it to a build job
+    with TravisData.process_parsed_job_log().
+
+    Returns a dictionary with the parsed stages (list of dictionaries),
+    the started_at and finished_at timestamps of the stages
+    and the worker tags (None if not found).
+
+    Parameters:
+    - log : job log (bytes, string or iterable with log lines)
+    - build_config : Travis CI build config, to name substages
+                     (None if it is not set)
+    - check_timing_tags : parse timing tags
+    - substage_index : index of the commands in build_config,
+                       see create_substage_index() (created if not set)
+    """
+    if substage_index is None:
+        substage_index = create_substage_index(build_config)
+
+    if isinstance(log, bytes):
+        log = io.BytesIO(log)
+    elif tools.is_string(log):
+        log = io.StringIO(log)
+
+    stages = Stages()
+    # substage that is being parsed and the worker tags
+    state = {"substage": TravisSubstage(), "worker": None}
+
+    def parse_timing_tag(line):
+        """Parse timing tags, continue with the returned substage."""
+        state["substage"] = parse_timing_tags(
+            line, state["substage"], stages, build_config, substage_index
+        )
+
+    def parse_worker(line):
+        """Parse worker tag, return true if the worker tags are known."""
+        state["worker"] = parse_worker_tag(line) or state["worker"]
+        return state["worker"] is not None
+
+    parse_job_log_phases(
+        log, LOG_PHASE_HEADER, check_timing_tags,
+        parse_timing_tag, parse_worker
+    )
+
+    return {
+        "stages": stages.stages,
+        "started_at": stages.started_at,
+        "finished_at": stages.finished_at,
+        "worker": state["worker"]
+    }
+
+
+def parse_job_log_phases(lines, log_phase, check_timing_tags,
+                         parse_timing_tag, parse_worker):
+    """
+    Parse the lines of a Travis CI job log, in the header and body phase.
+
+    The worker tag is only looked for in the log header,
+    which ends when it is found, or when the first timed command starts.
+    After the header, each line is checked with a single substring test.
+    Returns the log phase after the lines, to continue parsing with.
+
+    Parameters:
+    - lines : iterable with job log lines
+    - log_phase : phase to start parsing with
+                  (LOG_PHASE_HEADER or LOG_PHASE_BODY)
+    - check_timing_tags : parse timing tags
+    - parse_timing_tag : function called with each line with timing tags
+    - parse_worker : function called with each header line with
+                     a worker tag, returns true if the worker is known
+    """
+    lines = iter(lines)
+
+    # header : parse worker tag, until the first timed command starts
+    if log_phase == LOG_PHASE_HEADER:
+        for line in lines:
+            timing_marker, worker_marker, start_marker = get_log_markers(line)
+            end_of_header = False
+            if timing_marker in line:
+                if check_timing_tags:
+                    parse_timing_tag(line)
+                end_of_header = start_marker in line
+            if worker_marker in line:
+                worker_found = parse_worker(line)
+                end_of_header = end_of_header or worker_found
+            if end_of_header:
+                log_phase = LOG_PHASE_BODY
+                break
+
+    # body : only parse timing tags
+    if check_timing_tags:
+        for line in get_tagged_body_lines(lines):
+            parse_timing_tag(line)
+
+    return log_phase
+
+
+def get_builds_range(first_build=None, last_build=None):
+    """
+    Return the range of builds to retrieve with the build listing.
+
+    Returns a tuple with the number of the first build (None : first build)
+    and the build number to request the first page with
+    (None : latest builds, 0 : no builds in the range).
+
+    Parameters:
+    - first_build : number of the first build (default : first build)
+    - last_build : number of the last build (default : latest build)
+    """
+    if first_build is not None:
+        first_build = int(first_build)
+    after_number = None
+    if last_build is not None:
+        after_number = int(last_build) + 1
+        if after_number <= 1:
+            after_number = 0
+    return first_build, after_number
 
 
 class TravisData(object):
 
     """Gather data from Travis CI using the API."""
 
-    def __init__(self, repo, build_id, connector=None):
+    def __init__(self, repo, build_id, connector=None, streaming=False):
         """
         Retrieve Travis CI build data using the API.
 
@@ -63,12 +650,30 @@ class TravisData(object):
         - repo : github repository slug (fe. buildtimetrend/python-lib)
         - build_id : Travis CI build id (fe. 158)
         - connector : Travis Connector instance
+        - streaming : don't keep processed build jobs in build_jobs,
+                      they are only returned, so memory usage doesn't grow
+                      with the number of processed jobs
         """
         self.builds_data = {}
         self.build_jobs = {}
+        self.streaming = streaming
         self.current_build_data = {}
         self.current_job = BuildJob()
         self.travis_substage = None
+        # incomplete last line and size of the log fed with feed()
+        self.partial_line = None
+        self.log_offset = 0
+        # job data retrieved in bulk, by job id
+        self.prefetched_job_data = {}
+        # build config and the index of its commands
+        self.substage_index = (None, None)
+        # build data and the intern table of the build job properties
+        self.property_table = (None, {})
+        # phase of parsing the job log (LOG_PHASE_HEADER or LOG_PHASE_BODY)
+        self.log_phase = LOG_PHASE_HEADER
+        # parse timing tags, set when restoring a checkpoint
+        # (None : decided by has_timing_tags())
+        self.timing_tags = None
         self.repo = repo
         self.build_id = str(build_id)
         # set TravisConnector if it is defined
@@ -83,6 +688,8 @@ class TravisData(object):
         Retrieve Travis CI build data.
 
         Returns true if retrieving data was succesful, false on error.
+        Raises HTTPError if the API rate limit is exceeded (status 429),
+        so the request can be retried later.
         """
         request = 'repos/{repo}/builds?number={build_id}'.format(
             repo=self.repo, build_id=self.build_id
@@ -90,6 +697,8 @@ class TravisData(object):
         try:
             self.builds_data = self.connector.json_request(request)
         except (HTTPError, URLError) as msg:
+            if isinstance(msg, HTTPError) and msg.code == 429:
+                raise
             logger.error("Error getting build data from Travis CI: %s", msg)
             return False
 
@@ -102,6 +711,104 @@ class TravisData(object):
 
         return True
 
+    def get_builds_data_pages(self, first_build=None, last_build=None):
+        """
+        Retrieve Travis CI build data of a range of builds, page by page.
+
+        The builds are retrieved with the paginated build listing of the API,
+        which returns several builds per request, most recent build first.
+        Method is a generator, each page of builds is set as builds_data
+        (with the builds outside the range left out) before it is yielded,
+        so the build jobs can be processed with process_build_jobs().
+
+        Parameters:
+        - first_build : number of the first build (default : first build)
+        - last_build : number of the last build (default : latest build)
+        """
+        first_build, after_number = get_builds_range(first_build, last_build)
+
+        while after_number != 0:
+            # the first page of the listing changes when builds are added,
+            # it is not stored as final in the response cache
+            builds_page = self.connector.json_request(
+                self.get_builds_page_request(after_number),
+                final=after_number is not None
+            )
+            after_number = self.process_builds_page(builds_page, first_build)
+            if self.builds_data.get("builds"):
+                yield self.builds_data
+
+    def get_builds_page_request(self, after_number=None):
+        """
+        Return the request of a page of the build listing.
+
+        Parameters:
+        - after_number : the page lists the builds before this build number
+                         (default : the first page, with the latest builds)
+        """
+        request = 'repos/{repo}/builds'.format(repo=self.repo)
+        if after_number is not None:
+            request += '?after_number={:d}'.format(after_number)
+        return request
+
+    def process_builds_page(self, builds_page, first_build=None):
+        """
+        Set the builds of a page of the build listing as builds_data.
+
+        Builds before first_build are left out.
+        Returns the build number to request the next page with,
+        0 if this is the last page.
+
+        Parameters:
+        - builds_page : page of the build listing, retrieved from the API
+        - first_build : number of the first build (default : first build)
+        """
+        self.builds_data = {}
+        if not tools.check_dict(builds_page, key_list="builds") or \
+                len(builds_page["builds"]) == 0:
+            return 0
+
+        builds = [
+            build for build in builds_page["builds"]
+            if first_build is None or int(build["number"]) >= first_build
+        ]
+        commit_ids = set(build.get("commit_id") for build in builds)
+        self.builds_data = {
+            "builds": builds,
+            "commits": [
+                commit for commit in builds_page.get("commits", [])
+                if commit.get("id") in commit_ids
+            ]
+        }
+        logger.debug("Retrieved %d builds of %s", len(builds), self.repo)
+
+        after_number = min(
+            int(build["number"]) for build in builds_page["builds"]
+        )
+        if after_number <= 1 or \
+                first_build is not None and after_number <= first_build:
+            return 0
+        return after_number
+
+    def process_builds(self, first_build=None, last_build=None,
+                       max_workers=1):
+        """
+        Retrieve Travis CI build job data of a range of builds.
+
+        Method is a generator, iterate result to get each processed build job.
+        Builds are retrieved with get_builds_data_pages(),
+        most recent build first.
+
+        Parameters:
+        - first_build : number of the first build (default : first build)
+        - last_build : number of the last build (default : latest build)
+        - max_workers : maximum number of build jobs that are retrieved and
+                        parsed concurrently
+        """
+        for builds_data in self.get_builds_data_pages(first_build, last_build):
+            for build_job in self.process_build_jobs(max_workers):
+                yield build_job
+
     def get_substage_name(self, command):
         """
         Resolve Travis CI substage name that corresponds to a cli command.
@@ -109,51 +816,168 @@ class TravisData(object):
         Parameters:
         - command : cli command
         """
-        if not tools.is_string(command):
-            return ""
+        return get_substage_name(
+            command, self.get_build_config(), self.get_substage_index()
+        )
+
+    def get_substage_index(self):
+        """
+        Return the index of the commands in the Travis CI build config.
+
+        The index is created once per build config (see
+        create_substage_index()), and shared with the job parsers
+        of the build. Returns None if the build config is not set.
+        """
+        build_config = self.get_build_config()
+        config, substage_index = self.substage_index
+
+        if config is not build_config:
+            substage_index = create_substage_index(build_config)
+            self.substage_index = (build_config, substage_index)
+
+        return substage_index
+
+    def get_property_table(self):
+        """
+        Return the intern table of the build job properties of the build.
+
+        The table is created once per build (current_build_data),
+        and shared with the job parsers of the build.
+        """
+        build_data, property_table = self.property_table
+
+        if build_data is not self.current_build_data:
+            property_table = {}
+            self.property_table = (self.current_build_data, property_table)
+
+        return property_table
+
+    def get_build_property(self, key, create_value):
+        """
+        Return a build job property value, shared by the jobs of a build.
+
+        Identical property values of the jobs of a build are created once,
+        and the same object is added to each build job,
+        so shared values shouldn't be changed.
+
+        Parameters:
+        - key : hashable key identifying the property value
+        - create_value : function returning the property value,
+                         called if key is not in the intern table
+        """
+        property_table = self.get_property_table()
+        try:
+            return property_table[key]
+        except KeyError:
+            return property_table.setdefault(key, create_value())
 
+    def get_build_config(self):
+        """Return Travis CI build config, None if it is not set."""
         if len(self.current_build_data) > 0 and \
                 "config" in self.current_build_data:
-            build_config = self.current_build_data["config"]
-        else:
-            logger.warning(
-                "Travis CI build config is not set"
-            )
-            return ""
-
-        # check if build_config collection is empty
-        if build_config:
-            for stage_name, commands in build_config.items():
-                if tools.is_list(commands) and command in commands:
-                    substage_number = commands.index(command) + 1
-                    substage_name = "{stage}.{substage:d}".format(
-                        stage=stage_name, substage=substage_number
-                    )
-                    logger.debug(
-                        "Substage %s corresponds to '%s'",
-                        substage_name, command
-                    )
-                    return substage_name
+            return self.current_build_data["config"]
 
-        return ""
+        return None
 
-    def process_build_jobs(self):
+    def process_build_jobs(self, max_workers=1):
         """
         Retrieve Travis CI build job data.
 
         Method is a generator, iterate result to get each processed build job.
+        Build jobs are returned in the order of the job_ids of the build.
+
+        Parameters:
+        - max_workers : maximum number of build jobs that are retrieved and
+                        parsed concurrently, jobs of a build are processed
+                        one after another by default
         """
         if len(self.builds_data) > 0 and "builds" in self.builds_data:
             for build in self.builds_data['builds']:
                 self.current_build_data = build
 
                 if "job_ids" in build:
-                    for job_id in build['job_ids']:
-                        yield self.process_build_job(job_id)
+                    self.prefetch_job_data(build['job_ids'])
+
+                    if max_workers > 1:
+                        build_jobs = self.process_build_jobs_concurrently(
+                            build['job_ids'], max_workers
+                        )
+                    else:
+                        build_jobs = (
+                            self.process_build_job(job_id)
+                            for job_id in build['job_ids']
+                        )
+
+                    for build_job in build_jobs:
+                        yield build_job
 
             # reset current_build_data after builds are processed
             self.current_build_data = {}
 
+    def process_build_jobs_concurrently(self, job_ids, max_workers):
+        """
+        Retrieve and parse Travis CI build jobs in a thread pool.
+
+        Each job is processed by a separate TravisData instance
+        (see create_job_parser()), so the job and substage state
+        is not shared between threads.
+        Method is a generator, build jobs are returned in order of job_ids.
+
+        Parameters:
+        - job_ids : IDs of the jobs to process, of the current build
+        - max_workers : maximum number of threads
+        """
+        build_data = self.current_build_data
+
+        def process_job(job_id):
+            """Process build job with a separate TravisData instance."""
+            return self.create_job_parser(build_data).process_build_job(job_id)
+
+        pool = ThreadPool(max_workers)
+
+        try:
+            # imap returns the results in order of job_ids
+            build_jobs = pool.imap(process_job, job_ids)
+
+            for index, build_job in enumerate(build_jobs):
+                if build_job is not None:
+                    self.add_build_job(job_ids[index], build_job)
+                yield build_job
+        finally:
+            pool.terminate()
+
+    def create_job_parser(self, build_data=None):
+        """
+        Create a TravisData instance to process a build job.
+
+        The instance shares the connector with this instance.
+        It doesn't keep the build jobs it processes,
+        they are added to build_jobs of this instance (unless streaming).
+
+        Parameters:
+        - build_data : Travis CI data of the build the job belongs to
+                       (default : current build data)
+        """
+        job_parser = self.__class__(
+            self.repo, self.build_id, self.connector, streaming=True
+        )
+        job_parser.prefetched_job_data = self.prefetched_job_data
+
+        if build_data is None:
+            build_data = self.current_build_data
+        job_parser.current_build_data = build_data
+
+        # reuse the substage index if the build config didn't change,
+        # and the property intern table if the build didn't change
+        job_parser.substage_index = self.substage_index
+        job_parser.get_substage_index()
+        self.substage_index = job_parser.substage_index
+        job_parser.property_table = self.property_table
+        job_parser.get_property_table()
+        self.property_table = job_parser.property_table
+
+        return job_parser
+
     def process_build_job(self, job_id):
         """
         Retrieve Travis CI build job data.
@@ -169,23 +993,116 @@ class TravisData(object):
         # process build/job data
         self.process_job_data(job_data)
         # parse Travis CI job log file
-        self.parse_job_log(job_id)
+        self.parse_job_log(job_id, is_finished(job_data))
 
         # store build job
-        self.build_jobs[str(job_id)] = self.current_job
+        build_job = self.current_job
+        self.add_build_job(job_id, build_job)
         # create new build job instance
         self.current_job = BuildJob()
 
         # return processed build job
-        return self.build_jobs[str(job_id)]
+        return build_job
+
+    def add_build_job(self, job_id, build_job):
+        """
+        Keep a processed build job in build_jobs, unless streaming.
+
+        Parameters:
+        - job_id : ID of the processed job
+        - build_job : processed BuildJob instance
+        """
+        if not self.streaming:
+            self.build_jobs[str(job_id)] = build_job
+
+    def prefetch_job_data(self, job_ids):
+        """
+        Retrieve Travis CI job data of several jobs in bulk.
+
+        The job data is retrieved with one request per JOB_DATA_BATCH_SIZE
+        jobs, and used by get_job_data().
+        If retrieving fails, job data is retrieved per job.
+
+        Parameters:
+        - job_ids : IDs of the jobs
+        """
+        for batch, request in self.get_job_data_batches(job_ids):
+            try:
+                jobs_data = self.connector.json_request(request)
+            except (HTTPError, URLError) as msg:
+                if isinstance(msg, HTTPError) and msg.code == 429:
+                    raise
+                logger.warning("Error getting job data in bulk : %s", msg)
+                return
+
+            if not self.add_prefetched_job_data(batch, jobs_data):
+                return
+
+    def get_job_data_batches(self, job_ids):
+        """
+        Return the batches of jobs of which the job data is retrieved in bulk.
+
+        Generator yielding a tuple with the job ids of the batch
+        and the request, jobs that are already prefetched are left out.
+
+        Parameters:
+        - job_ids : IDs of the jobs
+        """
+        job_ids = [
+            str(job_id) for job_id in job_ids
+            if job_id is not None and
+            str(job_id) not in self.prefetched_job_data
+        ]
+
+        for index in range(0, len(job_ids), JOB_DATA_BATCH_SIZE):
+            batch = job_ids[index:index + JOB_DATA_BATCH_SIZE]
+            yield batch, 'jobs?' + '&'.join(
+                'ids[]={:s}'.format(job_id) for job_id in batch
+            )
+
+    def add_prefetched_job_data(self, batch, jobs_data):
+        """
+        Keep the job data retrieved in bulk, to be used by get_job_data().
+
+        Returns false if the job data is invalid.
+
+        Parameters:
+        - batch : IDs of the requested jobs
+        - jobs_data : job data of several jobs, retrieved from the API
+        """
+        if not tools.check_dict(jobs_data, key_list="jobs"):
+            return False
+
+        commits = dict(
+            (commit.get("id"), commit)
+            for commit in jobs_data.get("commits", [])
+        )
+        for job in jobs_data["jobs"]:
+            commit = commits.get(job.get("commit_id"))
+            if str(job.get("id")) in batch and commit is not None:
+                self.prefetched_job_data[str(job["id"])] = {
+                    "job": job,
+                    "commit": commit
+                }
+
+        logger.debug(
+            "Prefetched job data of %d jobs", len(self.prefetched_job_data)
+        )
+        return True
 
     def get_job_data(self, job_id):
         """
         Retrieve Travis CI job data.
 
+        Job data retrieved with prefetch_job_data() is used if available.
+
         Parameters:
         - job_id : ID of the job to process
         """
+        job_data = self.prefetched_job_data.pop(str(job_id), None)
+        if job_data is not None:
+            return job_data
+
         request = 'jobs/{:s}'.format(str(job_id))
         job_data = self.connector.json_request(request)
 
@@ -215,16 +1132,22 @@ class TravisData(object):
         Parameters:
         - job_data : dictionary with Travis CI job data
         """
+        # buildnumber is part before "." of job number
+        build = job_data['job']['number'].split(".")[0]
+        branch = job_data['commit']['branch']
+        repo = job_data['job']['repository_slug']
+
+        # values that are the same for all jobs of a build are shared
         self.current_job.add_property(
-            "build",
-            # buildnumber is part before "." of job number
-            job_data['job']['number'].split(".")[0]
+            "build", self.get_build_property(("build", build), lambda: build)
         )
         self.current_job.add_property("job", job_data['job']['number'])
-        self.current_job.add_property("branch", job_data['commit']['branch'])
         self.current_job.add_property(
-            "repo",
-            job_data['job']['repository_slug']
+            "branch",
+            self.get_build_property(("branch", branch), lambda: branch)
+        )
+        self.current_job.add_property(
+            "repo", self.get_build_property(("repo", repo), lambda: repo)
         )
         self.current_job.add_property("ci_platform", 'travis')
         self.current_job.add_property("result", job_data['job']['state'])
@@ -301,9 +1224,14 @@ class TravisData(object):
             if parameter in job_config:
                 build_matrix.add_item(name, str(job_config[parameter]))
 
+        # jobs with the same build matrix share the build_matrix property
+        matrix_key = ("build_matrix",) + \
+            tuple(sorted(build_matrix.items.items()))
         self.current_job.add_property(
             "build_matrix",
-            build_matrix.get_items_with_summary()
+            self.get_build_property(
+                matrix_key, build_matrix.get_items_with_summary
+            )
         )
 
     def process_pull_request_data(self):
@@ -333,23 +1261,42 @@ class TravisData(object):
                 pull_request_data["number"] = \
                     self.current_build_data["pull_request_number"]
 
-            self.current_job.add_property("pull_request", pull_request_data)
+            # all jobs of a build share the pull_request property
+            pull_request_key = ("pull_request",) + \
+                tuple(sorted(pull_request_data.items()))
+            self.current_job.add_property(
+                "pull_request",
+                self.get_build_property(
+                    pull_request_key, lambda: pull_request_data
+                )
+            )
 
-    def parse_job_log(self, job_id):
+    def parse_job_log(self, job_id, finished=False):
         """
         Parse Travis CI job log.
 
         Parameters:
         - job_id : ID of the job to process
+        - finished : true if the job is finished
         """
-        self.parse_job_log_stream(self.connector.download_job_log(job_id))
-
-    def parse_job_log_file(self, filename):
+        job_log = self.connector.download_job_log(job_id, finished=finished)
+        try:
+            self.parse_job_log_stream(job_log)
+            # parsing stops early if the log has no timing tags,
+            # read the rest so the log is cached and the connection reused
+            while job_log.read(LOG_READ_SIZE):
+                pass
+        finally:
+            job_log.close()
+
+    def parse_job_log_file(self, filename, use_mmap=False):
         """
         Open a Travis CI log file and parse it.
 
         Parameters :
         - filename : filename of Travis CI log
+        - use_mmap : memory map the file and only parse the lines with tags,
+                     memory usage doesn't depend on the file size
         Returns false if file doesn't exist, true if it was read successfully.
         """
         # load timestamps file
@@ -358,10 +1305,26 @@ class TravisData(object):
 
         # read timestamps, calculate stage duration
         with open(filename, 'rb') as file_stream:
-            self.parse_job_log_stream(file_stream)
+            if use_mmap:
+                self.parse_job_log_mmap(file_stream)
+            else:
+                self.parse_job_log_stream(file_stream)
 
         return True
 
+    def parse_job_log_mmap(self, file_stream):
+        """
+        Memory map a Travis CI job log file and parse it.
+
+        Only the lines containing Travis CI tags are read and parsed.
+
+        Parameters:
+        - file_stream : file object of job log file, opened in binary mode
+        """
+        self.parse_job_log_stream(
+            find_tag_lines_mmap(file_stream, [b'travis_', b'Using worker:'])
+        )
+
     def parse_job_log_stream(self, stream):
         """
         Parse Travis CI job log stream.
@@ -370,76 +1333,199 @@ class TravisData(object):
         - stream : stream of job log file
         """
         self.travis_substage = TravisSubstage()
-        check_timing_tags = self.has_timing_tags()
-
-        for line in stream:
-            # convert to str if line is bytes type
-            if isinstance(line, bytes):
-                line = line.decode('utf-8')
-            # parse Travis CI timing tags
-            if check_timing_tags and 'travis_' in line:
-                self.parse_travis_time_tag(line)
-            # parse Travis CI worker tag
-            if 'Using worker:' in line:
-                self.parse_travis_worker_tag(line)
+        self.log_phase = LOG_PHASE_HEADER
+        self.timing_tags = None
+        self.parse_job_log_lines(stream)
 
-    def parse_travis_time_tag(self, line):
+    def parse_job_log_lines(self, lines):
         """
-        Parse and process Travis CI timing tags.
+        Parse Travis CI job log lines.
+
+        Parsing continues with the current substage and log phase,
+        see parse_job_log_phases().
 
         Parameters:
-        - line : line from logfile containing Travis CI tags
+        - lines : iterable with job log lines
+        """
+        check_timing_tags = self.timing_tags
+        if check_timing_tags is None:
+            check_timing_tags = self.has_timing_tags()
+
+        self.log_phase = parse_job_log_phases(
+            lines, self.log_phase, check_timing_tags,
+            self.parse_travis_time_tag, self.parse_travis_worker_tag
+        )
+
+    def feed(self, chunk, last_chunk=False):
+        """
+        Parse a chunk of a Travis CI job log.
+
+        A job log can be fed in chunks of any size as it becomes available,
+        fe. when following the log of a running job.
+        Only complete lines are parsed, an incomplete last line is kept
+        until the next chunk is fed, or until the last chunk is fed.
+
+        Parameters:
+        - chunk : next part of the job log (bytes or string)
+        - last_chunk : true if chunk is the end of the job log
         """
         if self.travis_substage is None:
             self.travis_substage = TravisSubstage()
 
-        escaped_line = line.replace('\x0d', '*').replace('\x1b', 'ESC')
-        logger.debug('line : %s', escaped_line)
+        self.log_offset += len(chunk)
 
-        # parse Travis CI timing tags
-        for parse_string in TRAVIS_LOG_PARSE_TIMING_STRINGS:
-            result = re.search(parse_string, line)
-            if result:
-                self.travis_substage.process_parsed_tags(result.groupdict())
-
-                # when finished : log stage and create a new instance
-                if self.travis_substage.has_finished():
-                    # set substage name, if it is not set
-                    if not self.travis_substage.has_name() and \
-                            self.travis_substage.has_command():
-                        self.travis_substage.set_name(
-                            self.get_substage_name(
-                                self.travis_substage.get_command()
-                            )
-                        )
+        if self.partial_line:
+            chunk = self.partial_line + chunk
+
+        if isinstance(chunk, bytes):
+            lines = chunk.split(b'\n')
+        else:
+            lines = chunk.split('\n')
+
+        if last_chunk:
+            self.partial_line = None
+        else:
+            self.partial_line = lines.pop()
+
+        self.parse_job_log_lines(lines)
+
+    def checkpoint(self):
+        """
+        Return the state of parsing a job log fed with feed().
+
+        The state is returned as a dictionary, that can be stored
+        (fe. pickled) and passed to restore() to resume parsing.
+        It contains :
+        - log_offset : size of the job log fed so far,
+                       in bytes (or characters if the log was fed as string)
+        - partial_line : incomplete last line
+        - log_phase : phase of parsing the job log (header or body)
+        - substage : state of the current substage
+        - stages : completed stages
+        - worker : worker properties, if the worker tag was parsed
+        - started_at : started_at property of the job
+        - timing_tags : true if timing tags are parsed
+        """
+        if self.travis_substage is None:
+            substage = TravisSubstage().to_dict()
+        else:
+            substage = self.travis_substage.to_dict()
+
+        stages = self.current_job.stages
+
+        timing_tags = self.timing_tags
+        if timing_tags is None:
+            timing_tags = self.has_timing_tags()
+
+        return {
+            "log_offset": self.log_offset,
+            "partial_line": self.partial_line,
+            "log_phase": self.log_phase,
+            "substage": substage,
+            "stages": {
+                "stages": copy.deepcopy(stages.stages),
+                "started_at": copy.deepcopy(stages.started_at),
+                "finished_at": copy.deepcopy(stages.finished_at)
+            },
+            "worker": copy.deepcopy(self.current_job.get_property("worker")),
+            "started_at":
+                copy.deepcopy(self.current_job.get_property("started_at")),
+            "timing_tags": timing_tags
+        }
+
+    def restore(self, checkpoint):
+        """
+        Restore the state of parsing a job log, to resume parsing with feed().
+
+        Parameters:
+        - checkpoint : dictionary with parser state, returned by checkpoint()
+        Returns true if the state was restored.
+        """
+        key_list = ["log_offset", "partial_line", "substage", "stages"]
+        if not tools.check_dict(checkpoint, "checkpoint", key_list):
+            return False
+
+        travis_substage = TravisSubstage()
+        if not travis_substage.load_dict(checkpoint["substage"]):
+            return False
 
-                    # only log complete substages
-                    if not self.travis_substage.finished_incomplete:
-                        self.current_job.add_stage(self.travis_substage.stage)
-                    self.travis_substage = TravisSubstage()
+        stages = Stages()
+        stages.stages = copy.deepcopy(checkpoint["stages"]["stages"])
+        stages.started_at = copy.deepcopy(checkpoint["stages"]["started_at"])
+        stages.finished_at = \
+            copy.deepcopy(checkpoint["stages"]["finished_at"])
+
+        self.log_offset = checkpoint["log_offset"]
+        self.partial_line = checkpoint["partial_line"]
+        self.log_phase = checkpoint.get("log_phase", LOG_PHASE_HEADER)
+        self.travis_substage = travis_substage
+        self.current_job.add_stages(stages)
+
+        if checkpoint.get("worker") is not None:
+            self.current_job.add_property(
+                "worker", copy.deepcopy(checkpoint["worker"])
+            )
+
+        if checkpoint.get("started_at") is not None:
+            self.current_job.add_property(
+                "started_at", copy.deepcopy(checkpoint["started_at"])
+            )
+
+        self.timing_tags = checkpoint.get("timing_tags")
+
+        return True
+
+    def parse_travis_time_tag(self, line):
+        """
+        Parse and process Travis CI timing tags.
+
+        Parameters:
+        - line : line from logfile containing Travis CI tags (bytes or string)
+        """
+        if self.travis_substage is None:
+            self.travis_substage = TravisSubstage()
+
+        self.travis_substage = parse_timing_tags(
+            line, self.travis_substage, self.current_job,
+            self.get_build_config(), self.get_substage_index()
+        )
 
     def parse_travis_worker_tag(self, line):
         """
         Parse and process Travis CI worker tag.
 
+        Returns true if the worker properties of the job are set.
+
         Parameters:
-        - line : line from logfile containing Travis CI tags
+        - line : line from logfile containing Travis CI tags (bytes or string)
         """
-        logger.debug('line : %s', line)
+        worker_tags = parse_worker_tag(line)
+        if worker_tags is not None:
+            self.current_job.add_property("worker", worker_tags)
+        return self.current_job.get_property("worker") is not None
 
-        # parse Travis CI worker tags
-        result = re.search(TRAVIS_LOG_PARSE_WORKER_STRING, line)
-        if not result:
-            return
+    def process_parsed_job_log(self, parsed_log):
+        """
+        Add the result of parse_job_log_data() to the current build job.
 
-        worker_tags = result.groupdict()
+        Parameters:
+        - parsed_log : dictionary returned by parse_job_log_data()
+        Returns true if the parsed job log was added.
+        """
+        key_list = ["stages", "started_at", "finished_at", "worker"]
+        if not tools.check_dict(parsed_log, "parsed_log", key_list):
+            return False
 
-        # check if parameter worker_tags is a dictionary and
-        # if it contains all required tags
-        tag_list = list({'hostname', 'os'})
-        if tools.check_dict(worker_tags, "worker_tags", tag_list):
-            logger.debug("Worker tags : %s", worker_tags)
-            self.current_job.add_property("worker", worker_tags)
+        stages = Stages()
+        stages.stages = parsed_log["stages"]
+        stages.started_at = parsed_log["started_at"]
+        stages.finished_at = parsed_log["finished_at"]
+        self.current_job.add_stages(stages)
+
+        if parsed_log["worker"] is not None:
+            self.current_job.add_property("worker", parsed_log["worker"])
+
+        return True
 
     def has_timing_tags(self):
         """
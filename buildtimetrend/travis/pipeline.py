@@ -0,0 +1,332 @@
+# vim: set expandtab sw=4 ts=4:
+"""
+Import Travis CI build jobs in a pipeline : download, parse and store.
+
+Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+
+This file is part of buildtimetrend/python-lib
+<https://github.com/buildtimetrend/python-lib/>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+from builtins import object
+from collections import deque
+import shutil
+import tempfile
+import threading
+from buildtimetrend import logger
+from buildtimetrend import keenio
+from buildtimetrend.travis.connector import is_finished
+try:
+    # For Python 3.0 and later
+    import queue
+except ImportError:
+    # Fall back to Python 2
+    import Queue as queue
+
+# default maximum number of items waiting between two stages
+DEFAULT_QUEUE_SIZE = 2
+# size up to which a downloaded job log is kept in memory,
+# larger logs are spooled to a temporary file
+LOG_SPOOL_SIZE = 1024 * 1024
+# interval (in seconds) at which a blocked stage checks if it should stop
+STOP_CHECK_INTERVAL = 0.1
+# marks the end of the items passed to the next stage
+END_OF_QUEUE = None
+
+
+class ImportPipeline(object):
+
+    """
+    Import the build jobs of TravisData builds_data in three stages.
+
+    - download : retrieve job data and job log
+    - parse : process job data and parse the job log
+    - store : send the build job to Keen.io (or a custom function)
+
+    Each stage runs in its own thread, so the download of a job,
+    parsing the previous job and storing the one before that overlap.
+    Stages are connected by bounded queues, so at most queue_size
+    downloaded logs and parsed jobs are waiting.
+    Downloaded logs are spooled to temporary files,
+    only small logs are kept in memory.
+    Build jobs are processed in order.
+    When events are sent with a writer, a build job is only counted
+    as stored when the writer sent all its events.
+    """
+
+    def __init__(self, travis_data, store=None, detail=None,
+                 queue_size=DEFAULT_QUEUE_SIZE, writer=None,
+                 stored_jobs=None):
+        """
+        Constructor.
+
+        Parameters:
+        - travis_data : TravisData instance, with builds_data
+        - store : function called with each processed BuildJob
+                  (default : send build job to Keen.io)
+        - detail : data storage detail level, used when sending to Keen.io
+        - queue_size : maximum number of items waiting between two stages
+        - writer : keenio.EventWriter instance, used when sending to Keen.io
+                   (default : events are sent immediately),
+                   build jobs are stored when their events are sent
+        - stored_jobs : set with the ids of the jobs that are already stored
+                        (fe. by an earlier, failed import), they are skipped,
+                        the ids of the jobs stored by the pipeline are added
+        """
+        self.travis_data = travis_data
+        if store is None:
+            self.store = lambda build_job: \
+                keenio.send_build_data_service(build_job, detail, writer)
+        else:
+            self.store = store
+        self.writer = writer
+        self.queue_size = queue_size
+        self.stop_event = threading.Event()
+        self.error = None
+        self.stored = 0
+        # ids and event trackers of jobs whose events are being sent
+        self.pending_jobs = deque()
+        # number of jobs whose events failed to be sent
+        self.unsent = 0
+        if stored_jobs is None:
+            stored_jobs = set()
+        self.stored_jobs = stored_jobs
+
+    def run(self):
+        """
+        Run the pipeline, until all build jobs are stored.
+
+        Returns the number of stored build jobs.
+        If a stage fails, the pipeline stops and the error is raised.
+        Raises IOError if the writer failed to send the events of a job.
+        """
+        downloaded = queue.Queue(self.queue_size)
+        parsed = queue.Queue(self.queue_size)
+
+        threads = [
+            threading.Thread(
+                target=self.run_stage, args=(self.download, None, downloaded)
+            ),
+            threading.Thread(
+                target=self.run_stage, args=(self.parse, downloaded, parsed)
+            )
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        # store stage runs in the calling thread
+        self.run_stage(self.store_build_job, parsed, None)
+
+        for thread in threads:
+            thread.join()
+
+        # close the job logs of downloaded jobs dropped after a failure
+        while not downloaded.empty():
+            item = downloaded.get()
+            if item is not END_OF_QUEUE:
+                item[3].close()
+
+        if self.writer is not None:
+            self.writer.flush()
+            self.check_pending_jobs()
+
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+        if self.unsent > 0:
+            unsent = self.unsent
+            self.unsent = 0
+            raise IOError(
+                "Sending the events of {} build jobs failed".format(unsent)
+            )
+
+        return self.stored
+
+    def run_stage(self, stage, input_queue, output_queue):
+        """
+        Run a stage of the pipeline.
+
+        Parameters:
+        - stage : function processing an item, the download stage is
+                  a generator producing the items
+        - input_queue : queue with the items to process
+                        (None for the first stage)
+        - output_queue : queue the processed items are put in
+                         (None for the last stage)
+        """
+        try:
+            if input_queue is None:
+                items = stage()
+            else:
+                items = (
+                    stage(item) for item in self.get_items(input_queue)
+                )
+
+            for item in items:
+                if output_queue is not None:
+                    self.put_item(output_queue, item)
+                if self.stop_event.is_set():
+                    break
+        except Exception as msg:
+            logger.error(
+                "Import pipeline stage '%s' failed : %s", stage.__name__, msg
+            )
+            if self.error is None:
+                self.error = msg
+            self.stop_event.set()
+        finally:
+            if output_queue is not None:
+                self.put_item(output_queue, END_OF_QUEUE)
+
+    def get_items(self, input_queue):
+        """
+        Get items from a queue, until the end of the queue or a stop.
+
+        Parameters:
+        - input_queue : queue to get items from
+        """
+        while not self.stop_event.is_set():
+            try:
+                item = input_queue.get(timeout=STOP_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is END_OF_QUEUE:
+                return
+            yield item
+
+    def put_item(self, output_queue, item):
+        """
+        Put an item in a queue, wait while it is full, unless stopped.
+
+        Parameters:
+        - output_queue : queue to put item in
+        - item : item to put in the queue
+        """
+        while True:
+            try:
+                output_queue.put(item, timeout=STOP_CHECK_INTERVAL)
+                return
+            except queue.Full:
+                if self.stop_event.is_set():
+                    return
+
+    def download(self):
+        """
+        Download job data and job log of all build jobs.
+
+        Generator yielding a tuple with build data, job id, job data
+        and job log of each job, the job log is a temporary file
+        that is closed by the parse stage.
+        """
+        travis_data = self.travis_data
+        builds_data = travis_data.builds_data
+
+        if len(builds_data) == 0 or "builds" not in builds_data:
+            return
+
+        for build in builds_data['builds']:
+            if "job_ids" not in build:
+                continue
+
+            job_ids = [
+                job_id for job_id in build['job_ids']
+                if job_id is not None and job_id not in self.stored_jobs
+            ]
+            travis_data.prefetch_job_data(job_ids)
+
+            for job_id in job_ids:
+                job_data = travis_data.get_job_data(job_id)
+                job_log = travis_data.connector.download_job_log(
+                    job_id, finished=is_finished(job_data)
+                )
+                log_file = tempfile.SpooledTemporaryFile(LOG_SPOOL_SIZE)
+                try:
+                    shutil.copyfileobj(job_log, log_file)
+                    log_file.seek(0)
+                except Exception:
+                    log_file.close()
+                    raise
+                finally:
+                    job_log.close()
+
+                yield build, job_id, job_data, log_file
+
+    def parse(self, downloaded_job):
+        """
+        Process job data and parse the job log of a downloaded job.
+
+        Returns a tuple with the job id and the processed BuildJob.
+
+        Parameters:
+        - downloaded_job : tuple with build data, job id, job data
+                           and job log file
+        """
+        build, job_id, job_data, log_file = downloaded_job
+
+        job_parser = self.travis_data.create_job_parser(build)
+        try:
+            job_parser.process_job_data(job_data)
+            job_parser.parse_job_log_stream(log_file)
+        finally:
+            log_file.close()
+
+        build_job = job_parser.current_job
+        self.travis_data.add_build_job(job_id, build_job)
+        return job_id, build_job
+
+    def store_build_job(self, parsed_job):
+        """
+        Store a processed build job.
+
+        Parameters:
+        - parsed_job : tuple with job id and BuildJob instance
+        """
+        job_id, build_job = parsed_job
+        if self.writer is None:
+            self.store(build_job)
+            self.add_stored_job(job_id)
+            return
+
+        # the job is stored when the writer sent its events
+        with self.writer.track() as tracker:
+            self.store(build_job)
+        self.pending_jobs.append((job_id, tracker))
+        self.check_pending_jobs()
+
+    def check_pending_jobs(self):
+        """Add the jobs whose events were sent to the stored jobs."""
+        while self.pending_jobs and self.pending_jobs[0][1].is_done():
+            job_id, tracker = self.pending_jobs.popleft()
+            if tracker.is_sent():
+                self.add_stored_job(job_id)
+            else:
+                logger.error(
+                    "Error storing build job %s : sending events failed",
+                    str(job_id)
+                )
+                self.unsent += 1
+
+    def add_stored_job(self, job_id):
+        """
+        Add a job to the stored jobs.
+
+        Parameters:
+        - job_id : id of the stored job
+        """
+        self.stored_jobs.add(job_id)
+        self.stored += 1
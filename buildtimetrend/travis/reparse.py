@@ -0,0 +1,360 @@
+# vim: set expandtab sw=4 ts=4:
+"""
+Parse a directory tree of archived Travis CI job logs.
+
+Logs are parsed in a process pool, the resulting build jobs are written
+as newline delimited JSON (one build job per line).
+Logs with content that was parsed before (already in the output file)
+are skipped, so a directory can be parsed again after new logs were added.
+
+Usage :
+  python -m buildtimetrend.travis.reparse [options] <log_dir> <output_file>
+
+Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+
+This file is part of buildtimetrend/python-lib
+<https://github.com/buildtimetrend/python-lib/>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import division
+from __future__ import print_function
+from builtins import object
+import os
+import sys
+import json
+import time
+import getopt
+import fnmatch
+import hashlib
+from multiprocessing import Pool
+import yaml
+from buildtimetrend import logger
+from buildtimetrend import set_loglevel
+from buildtimetrend.buildjob import BuildJob
+from buildtimetrend.stages import Stages
+from buildtimetrend.travis.parser import create_substage_index
+from buildtimetrend.travis.parser import parse_job_log_data
+
+# default pattern of the log file names
+DEFAULT_PATTERN = "*"
+# number of logs sent to a worker process at once
+CHUNK_SIZE = 8
+# build job property with the hash of the parsed log
+HASH_PROPERTY = "log_hash"
+MEGABYTE = 1024 * 1024
+
+# state of a worker process, set by init_worker()
+_worker_state = {
+    "build_config": None,
+    "substage_index": None,
+    "parsed_hashes": frozenset()
+}
+
+
+def find_log_files(log_dir, pattern=DEFAULT_PATTERN):
+    """
+    Find log files in a directory tree.
+
+    Generator yielding the path of each log file, sorted per directory.
+
+    Parameters:
+    - log_dir : root of the directory tree
+    - pattern : shell pattern the file names should match (fe. *.log)
+    """
+    for root, dirs, files in os.walk(log_dir):
+        dirs.sort()
+        for filename in sorted(fnmatch.filter(files, pattern)):
+            yield os.path.join(root, filename)
+
+
+def load_parsed_hashes(output_file):
+    """
+    Return a set with the hashes of the logs in a NDJSON output file.
+
+    Returns an empty set if the output file doesn't exist.
+
+    Parameters:
+    - output_file : file with a build job per line
+    """
+    hashes = set()
+    if not os.path.isfile(output_file):
+        return hashes
+
+    with open(output_file) as file_stream:
+        for line in file_stream:
+            try:
+                build_job = json.loads(line)
+            except ValueError:
+                # skip incomplete line, fe. when a previous run was aborted
+                continue
+            if isinstance(build_job, dict) and HASH_PROPERTY in build_job:
+                hashes.add(build_job[HASH_PROPERTY])
+
+    return hashes
+
+
+def load_build_config(filename):
+    """
+    Load the Travis CI build config (.travis.yml), used to name substages.
+
+    Parameters:
+    - filename : path to a Travis CI config file
+    """
+    with open(filename) as file_stream:
+        return yaml.safe_load(file_stream)
+
+
+def init_worker(build_config, parsed_hashes):
+    """
+    Initialise worker process.
+
+    Parameters:
+    - build_config : Travis CI build config, to name substages
+    - parsed_hashes : hashes of the logs that were already parsed
+    """
+    _worker_state["build_config"] = build_config
+    _worker_state["substage_index"] = create_substage_index(build_config)
+    _worker_state["parsed_hashes"] = frozenset(parsed_hashes)
+
+
+def create_build_job(parsed_log, properties=None):
+    """
+    Create a BuildJob from the result of parse_job_log_data().
+
+    Parameters:
+    - parsed_log : dictionary returned by parse_job_log_data()
+    - properties : dictionary with additional build job properties
+    """
+    stages = Stages()
+    stages.stages = parsed_log["stages"]
+    stages.started_at = parsed_log["started_at"]
+    stages.finished_at = parsed_log["finished_at"]
+
+    build_job = BuildJob()
+    build_job.add_stages(stages)
+    if parsed_log["worker"] is not None:
+        build_job.add_property("worker", parsed_log["worker"])
+    for name, value in (properties or {}).items():
+        build_job.add_property(name, value)
+
+    return build_job
+
+
+def parse_log_file(filename):
+    """
+    Parse a job log file, in a worker process.
+
+    The log is only parsed if its content hash isn't in the parsed hashes
+    set by init_worker().
+    The job id is derived from the file name (without extension).
+
+    Returns a tuple with the file name, the log size in bytes,
+    the hash of the log, the build job dictionary (None if the log was
+    skipped) and an error message (None if the log was parsed).
+
+    Parameters:
+    - filename : path to the log file
+    """
+    try:
+        with open(filename, 'rb') as file_stream:
+            log = file_stream.read()
+    except (IOError, OSError) as msg:
+        return filename, 0, None, None, str(msg)
+
+    log_hash = hashlib.sha256(log).hexdigest()
+    if log_hash in _worker_state["parsed_hashes"]:
+        return filename, len(log), log_hash, None, None
+
+    try:
+        parsed_log = parse_job_log_data(
+            log, _worker_state["build_config"],
+            substage_index=_worker_state["substage_index"]
+        )
+    except Exception as msg:
+        return filename, len(log), log_hash, None, str(msg)
+
+    build_job = create_build_job(parsed_log, {
+        "job": os.path.splitext(os.path.basename(filename))[0],
+        "log_file": filename,
+        HASH_PROPERTY: log_hash
+    })
+
+    return filename, len(log), log_hash, build_job.to_dict(), None
+
+
+class LogArchiveParser(object):
+
+    """
+    Parse all logs in a directory tree, using a pool of worker processes.
+
+    The build jobs are appended to the output file, in the order the logs
+    are parsed. Logs with the same content as a log in the output file,
+    or as a log parsed earlier in the same run, are skipped.
+    """
+
+    def __init__(self, log_dir, output_file, processes=None,
+                 pattern=DEFAULT_PATTERN, build_config=None):
+        """
+        Constructor.
+
+        Parameters:
+        - log_dir : root of the directory tree with the log files
+        - output_file : NDJSON file the build jobs are appended to
+        - processes : number of worker processes (default : number of CPUs)
+        - pattern : shell pattern the log file names should match
+        - build_config : Travis CI build config, to name substages
+                         (substages are not named if it is not set)
+        """
+        if build_config is None:
+            logger.warning(
+                "Travis CI build config is not set, substages are not named"
+            )
+            build_config = {}
+
+        self.log_dir = log_dir
+        self.output_file = output_file
+        self.processes = processes
+        self.pattern = pattern
+        self.build_config = build_config
+
+    def run(self):
+        """
+        Parse the logs and write the build jobs to the output file.
+
+        Returns a dictionary with the number of parsed, skipped and failed
+        logs, the number of bytes read, the duration (in seconds)
+        and the throughput in logs/s and MB/s.
+        """
+        parsed_hashes = load_parsed_hashes(self.output_file)
+        stats = {"parsed": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        start_time = time.time()
+
+        pool = Pool(
+            self.processes, init_worker, (self.build_config, parsed_hashes)
+        )
+        try:
+            with open(self.output_file, 'a') as output:
+                # don't parse the output file, if it is in the log dir
+                output_path = os.path.abspath(self.output_file)
+                log_files = (
+                    filename for filename in
+                    find_log_files(self.log_dir, self.pattern)
+                    if os.path.abspath(filename) != output_path
+                )
+                results = pool.imap_unordered(
+                    parse_log_file, log_files, CHUNK_SIZE
+                )
+                for filename, size, log_hash, build_job, error in results:
+                    stats["bytes"] += size
+                    if error is not None:
+                        logger.warning(
+                            "Error parsing log %s : %s", filename, error
+                        )
+                        stats["failed"] += 1
+                    elif build_job is None or log_hash in parsed_hashes:
+                        logger.debug("Skipped log %s", filename)
+                        stats["skipped"] += 1
+                    else:
+                        output.write(json.dumps(build_job, sort_keys=True))
+                        output.write("\n")
+                        parsed_hashes.add(log_hash)
+                        stats["parsed"] += 1
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+        stats["duration"] = time.time() - start_time
+        self.add_throughput(stats)
+
+        logger.info(
+            "Parsed %d logs in %.1fs (%.1f logs/s, %.1f MB/s),"
+            " %d skipped, %d failed",
+            stats["parsed"], stats["duration"], stats["logs_per_second"],
+            stats["mb_per_second"], stats["skipped"], stats["failed"]
+        )
+        return stats
+
+    @staticmethod
+    def add_throughput(stats):
+        """
+        Add the throughput in logs/s and MB/s to the statistics.
+
+        Parameters:
+        - stats : dictionary with the number of parsed, skipped and failed
+                  logs, the number of bytes read and the duration
+        """
+        logs = stats["parsed"] + stats["skipped"] + stats["failed"]
+        if stats["duration"] > 0:
+            stats["logs_per_second"] = logs / stats["duration"]
+            stats["mb_per_second"] = \
+                stats["bytes"] / MEGABYTE / stats["duration"]
+        else:
+            stats["logs_per_second"] = 0.0
+            stats["mb_per_second"] = 0.0
+
+
+def main(argv):
+    """
+    Parse a directory tree of logs, with command line arguments.
+
+    Returns exit code.
+
+    Parameters:
+    - argv : command line arguments
+    """
+    usage_string = '{0!s} -h --log=<log_level> --processes=<number>' \
+        ' --pattern=<file_pattern> --config=<travis_yml>' \
+        ' <log_dir> <output_file>'.format(argv[0])
+
+    try:
+        opts, args = getopt.getopt(
+            argv[1:], "h",
+            ["log=", "processes=", "pattern=", "config=", "help"]
+        )
+    except getopt.GetoptError:
+        print(usage_string)
+        return 2
+
+    options = {"pattern": DEFAULT_PATTERN}
+    for opt, arg in opts:
+        if opt in ('-h', "--help"):
+            print(usage_string)
+            return 0
+        elif opt == "--log":
+            set_loglevel(arg)
+        elif opt == "--processes":
+            options["processes"] = int(arg)
+        elif opt == "--pattern":
+            options["pattern"] = arg
+        elif opt == "--config":
+            options["build_config"] = load_build_config(arg)
+
+    if len(args) != 2 or not os.path.isdir(args[0]):
+        print(usage_string)
+        return 2
+
+    stats = LogArchiveParser(args[0], args[1], **options).run()
+
+    print(
+        "Parsed {parsed:d} logs, skipped {skipped:d}, failed {failed:d}"
+        " in {duration:.1f}s : {logs_per_second:.1f} logs/s,"
+        " {mb_per_second:.1f} MB/s".format(**stats)
+    )
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
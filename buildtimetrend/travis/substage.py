@@ -20,6 +20,7 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
+import copy
 from buildtimetrend import logger
 from buildtimetrend.stages import Stage
 from buildtimetrend.tools import check_dict
@@ -40,6 +41,36 @@ class TravisSubstage(object):
         self.finished_incomplete = False
         self.finished = False
 
+    def to_dict(self):
+        """Return substage state as a dictionary."""
+        return {
+            "stage": copy.deepcopy(self.stage.data),
+            "timing_hash": self.timing_hash,
+            "finished_incomplete": self.finished_incomplete,
+            "finished": self.finished
+        }
+
+    def load_dict(self, substage_dict):
+        """
+        Load substage state from a dictionary.
+
+        Parameters:
+        - substage_dict : dictionary with substage state,
+                          as returned by to_dict()
+        Returns true if the state was loaded.
+        """
+        tag_list = ["stage", "timing_hash", "finished_incomplete", "finished"]
+        if not check_dict(substage_dict, "substage_dict", tag_list):
+            return False
+
+        self.stage = Stage()
+        self.stage.data = copy.deepcopy(substage_dict["stage"])
+        self.timing_hash = substage_dict["timing_hash"]
+        self.finished_incomplete = substage_dict["finished_incomplete"]
+        self.finished = substage_dict["finished"]
+
+        return True
+
     def process_parsed_tags(self, tags_dict):
         """
         Process parsed tags and calls the corresponding handler method.
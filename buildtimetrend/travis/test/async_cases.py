@@ -0,0 +1,223 @@
+# vim: set expandtab sw=4 ts=4:
+#
+# Unit tests for asynchronous Travis CI connector and parser
+#
+# Uses syntax of Python 3.6+, the tests are imported by async_test.py
+# on Python 3.6+ only, this module isn't collected by the test runner.
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+from buildtimetrend.travis.parser import TravisData
+from buildtimetrend.travis.test.travis_test import LocalTravisConnector
+from buildtimetrend.travis.test.travis_test import JOB_DATA_PYTHON
+from buildtimetrend.travis.test.travis_test import TRAVIS_LOG_FILE
+from buildtimetrend.travis.test.travis_test import TEST_REPO
+import unittest
+
+try:
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from buildtimetrend.travis.async_connector import AsyncTravisConnector
+    from buildtimetrend.travis.async_parser import AsyncTravisData
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+BUILDS_DATA = {"builds": [
+    {"number": "536", "job_ids": [1, 2, 3], "event_type": "push"}
+]}
+# send job log in small chunks, to test parsing the log as it arrives
+LOG_CHUNK_SIZE = 1000
+
+
+def create_app(delays=None, requests=None):
+    """
+    Create web application serving Travis CI API responses.
+
+    Parameters:
+    - delays : dictionary with delay (in seconds) per job id
+    - requests : list the paths of the job data requests are added to
+    """
+    delays = delays or {}
+    if requests is None:
+        requests = []
+
+    async def builds(request):
+        """Return build data, the listing has one page."""
+        if "after_number" in request.query:
+            return web.json_response({"builds": [], "commits": []})
+        return web.json_response(BUILDS_DATA)
+
+    def get_job_data(job_id):
+        """Return job data, job number is derived from job id."""
+        job_data = json.loads(JOB_DATA_PYTHON)
+        job_data['job']['id'] = int(job_id)
+        job_data['job']['number'] = "536.{}".format(job_id)
+        return job_data
+
+    async def job(request):
+        """Return job data."""
+        requests.append(request.path_qs)
+        job_id = request.match_info['job_id']
+        await asyncio.sleep(delays.get(job_id, 0))
+        return web.json_response(get_job_data(job_id))
+
+    async def jobs(request):
+        """Return job data of several jobs."""
+        requests.append(request.path_qs)
+        jobs_data = [
+            get_job_data(job_id) for job_id in request.query.getall('ids[]')
+        ]
+        return web.json_response({
+            "jobs": [job_data["job"] for job_data in jobs_data],
+            "commits": [jobs_data[0]["commit"]]
+        })
+
+    async def job_log(request):
+        """Return sample job log, in chunks."""
+        with open(TRAVIS_LOG_FILE, 'rb') as log_file:
+            log = log_file.read()
+
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for position in range(0, len(log), LOG_CHUNK_SIZE):
+            await response.write(log[position:position + LOG_CHUNK_SIZE])
+            await asyncio.sleep(0)
+        await response.write_eof()
+        return response
+
+    async def not_found(request):
+        """Return HTTP error."""
+        raise web.HTTPNotFound()
+
+    app = web.Application()
+    app.router.add_get('/repos/{owner}/{name}/builds', builds)
+    app.router.add_get('/jobs', jobs)
+    app.router.add_get('/jobs/{job_id}', job)
+    app.router.add_get('/jobs/{job_id}/log', job_log)
+    app.router.add_get('/error/{job_id}', not_found)
+    return app
+
+
+@unittest.skipUnless(AIOHTTP_AVAILABLE, "aiohttp is not installed")
+class TestAsyncTravisData(unittest.TestCase):
+
+    """Unit tests for AsyncTravisData class"""
+
+    def setUp(self):
+        """Initialise test environment before each test."""
+        self.loop = asyncio.new_event_loop()
+        self.requests = []
+        self.server = TestServer(
+            create_app({"1": 0.2, "2": 0.1}, self.requests)
+        )
+        self.run_coroutine(self.server.start_server())
+
+        self.connector = AsyncTravisConnector()
+        self.connector.api_url = str(self.server.make_url('/'))
+
+    def tearDown(self):
+        """Clean up test environment after each test."""
+        self.run_coroutine(self.connector.close())
+        self.run_coroutine(self.server.close())
+        self.loop.close()
+
+    def run_coroutine(self, coroutine):
+        """Run coroutine in the test event loop."""
+        return self.loop.run_until_complete(coroutine)
+
+    def test_novalue(self):
+        """Test freshly initialised object."""
+        travis_data = AsyncTravisData(TEST_REPO, 536)
+        self.assertEqual(TEST_REPO, travis_data.repo)
+        self.assertEqual("536", travis_data.build_id)
+        self.assertEqual(
+            "https://api.travis-ci.org/", travis_data.connector.api_url
+        )
+
+        travis_data = AsyncTravisData(TEST_REPO, 536, self.connector)
+        self.assertEqual(self.connector, travis_data.connector)
+
+    def test_get_build_data(self):
+        """Test AsyncTravisData.get_build_data()"""
+        travis_data = AsyncTravisData(TEST_REPO, 536, self.connector)
+        self.assertTrue(self.run_coroutine(travis_data.get_build_data()))
+        self.assertDictEqual(BUILDS_DATA, travis_data.builds_data)
+
+        # HTTP error
+        self.connector.api_url = str(self.server.make_url('/error/'))
+        self.assertFalse(self.run_coroutine(travis_data.get_build_data()))
+
+    def test_process_build_jobs(self):
+        """Test AsyncTravisData.process_build_jobs()"""
+        # reference : process build jobs with synchronous parser
+        travis_data = TravisData(TEST_REPO, 536, LocalTravisConnector())
+        travis_data.builds_data = BUILDS_DATA
+        expected = [
+            build_job.to_dict()
+            for build_job in travis_data.process_build_jobs()
+        ]
+
+        async def process_build_jobs(travis_data, max_workers):
+            """Collect processed build jobs."""
+            return [
+                build_job.to_dict()
+                async for build_job in
+                travis_data.process_build_jobs(max_workers)
+            ]
+
+        for max_workers in [1, 3]:
+            travis_data = AsyncTravisData(TEST_REPO, 536, self.connector)
+            self.assertTrue(self.run_coroutine(travis_data.get_build_data()))
+            build_jobs = self.run_coroutine(
+                process_build_jobs(travis_data, max_workers)
+            )
+
+            # build jobs are returned in order of job_ids
+            self.assertListEqual(
+                ["536.1", "536.2", "536.3"],
+                [build_job["job"] for build_job in build_jobs]
+            )
+            self.assertListEqual(expected, build_jobs)
+            self.assertEqual(18, len(build_jobs[0]["stages"]))
+            self.assertEqual(3, len(travis_data.build_jobs))
+            self.assertDictEqual({}, travis_data.current_build_data)
+
+    def test_process_builds(self):
+        """Test AsyncTravisData.process_builds()"""
+        async def process_builds(travis_data):
+            """Collect processed build jobs."""
+            return [
+                build_job.get_property("job")
+                async for build_job in travis_data.process_builds(
+                    max_workers=2
+                )
+            ]
+
+        travis_data = AsyncTravisData(TEST_REPO, 536, self.connector)
+        self.assertListEqual(
+            ["536.1", "536.2", "536.3"],
+            self.run_coroutine(process_builds(travis_data))
+        )
+        # job data was retrieved in bulk
+        self.assertListEqual(
+            ["/jobs?ids%5B%5D=1&ids%5B%5D=2&ids%5B%5D=3"], self.requests
+        )
@@ -0,0 +1,30 @@
+# vim: set expandtab sw=4 ts=4:
+#
+# Unit tests for asynchronous Travis CI connector and parser
+#
+# The asynchronous connector and parser require Python 3.6+,
+# the tests (in async_cases.py) are only imported on Python 3.6+,
+# they are a syntax error on older versions.
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+
+if sys.version_info >= (3, 6):
+    from buildtimetrend.travis.test.async_cases import TestAsyncTravisData
@@ -0,0 +1,153 @@
+# vim: set expandtab sw=4 ts=4:
+#
+# Unit tests for Travis CI API response cache
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import hashlib
+import shutil
+import tempfile
+from buildtimetrend.travis.cache import ResponseCache
+from buildtimetrend.travis.cache import CachingResponse
+import unittest
+
+
+class TestResponseCache(unittest.TestCase):
+
+    """Unit tests for ResponseCache class"""
+
+    def setUp(self):
+        """Initialise test environment before each test."""
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = ResponseCache(self.cache_dir, 100)
+
+    def tearDown(self):
+        """Clean up test environment after each test."""
+        shutil.rmtree(self.cache_dir)
+
+    def store(self, request, body, finished=False):
+        """Store body of request in the cache."""
+        writer = self.cache.writer(request, '"etag"', None, finished)
+        writer.write(body)
+        writer.commit()
+
+    def read(self, request):
+        """Read cached body of request."""
+        with self.cache.open(self.cache.get(request)) as body_file:
+            return body_file.read()
+
+    def test_novalue(self):
+        """Test empty cache"""
+        self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, 'meta')))
+        self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, 'blobs')))
+        self.assertEqual(0, self.cache.size)
+        self.assertIsNone(self.cache.get("jobs/1"))
+        self.assertFalse(self.cache.is_finished("jobs/1"))
+
+    def test_store(self):
+        """Test storing and retrieving a response"""
+        self.store("jobs/1", b"job 1")
+        self.assertDictEqual(
+            {
+                "request": "jobs/1",
+                "etag": '"etag"',
+                "last_modified": None,
+                "finished": False,
+                "blob": hashlib.sha256(b"job 1").hexdigest(),
+                "size": 5
+            },
+            self.cache.get("jobs/1")
+        )
+        self.assertEqual(b"job 1", self.read("jobs/1"))
+
+        self.cache.set_finished("jobs/1")
+        self.assertTrue(self.cache.is_finished("jobs/1"))
+
+        # replace response
+        self.store("jobs/1", b"job 1 updated")
+        self.assertEqual(b"job 1 updated", self.read("jobs/1"))
+        self.assertEqual(13, self.cache.size)
+        self.assertEqual(1, len(os.listdir(self.cache.blob_dir)))
+
+    def test_content_addressed(self):
+        """Test identical responses are stored once"""
+        self.store("jobs/1", b"same body")
+        self.store("jobs/2", b"same body")
+        self.assertEqual(9, self.cache.size)
+        self.assertEqual(1, len(os.listdir(self.cache.blob_dir)))
+
+        # storing the same body again keeps the body
+        self.store("jobs/1", b"same body")
+        self.assertEqual(b"same body", self.read("jobs/1"))
+        self.assertEqual(b"same body", self.read("jobs/2"))
+
+    def test_evict(self):
+        """Test least recently used responses are evicted"""
+        self.store("jobs/1", b"1" * 40)
+        self.store("jobs/2", b"2" * 40)
+        # use jobs/1
+        self.cache.get("jobs/1")
+        self.store("jobs/3", b"3" * 40)
+
+        self.assertIsNotNone(self.cache.get("jobs/1"))
+        self.assertIsNone(self.cache.get("jobs/2"))
+        self.assertIsNotNone(self.cache.get("jobs/3"))
+        self.assertEqual(80, self.cache.size)
+        self.assertEqual(2, len(os.listdir(self.cache.blob_dir)))
+        self.assertEqual(2, len(os.listdir(self.cache.meta_dir)))
+
+    def test_persistent(self):
+        """Test reopening the cache"""
+        self.store("jobs/1", b"job 1", True)
+        self.store("jobs/2", b"job 2")
+        # last use is kept as modification time of the metadata file
+        os.utime(self.cache.get_meta_path("jobs/1"), (1000, 1000))
+        os.utime(self.cache.get_meta_path("jobs/2"), (2000, 2000))
+
+        cache = ResponseCache(self.cache_dir, 100)
+        self.assertEqual(10, cache.size)
+        self.assertTrue(cache.is_finished("jobs/1"))
+        self.assertFalse(cache.is_finished("jobs/2"))
+        self.assertListEqual(["jobs/1", "jobs/2"], list(cache.entries))
+
+    def test_caching_response(self):
+        """Test storing a response while it is read"""
+        body = b"line 1\nline 2\n"
+        response = CachingResponse(
+            io.BytesIO(body), self.cache.writer("jobs/1/log")
+        )
+        self.assertListEqual([b"line 1\n", b"line 2\n"], list(response))
+        self.assertEqual(body, self.read("jobs/1/log"))
+
+        response = CachingResponse(
+            io.BytesIO(body), self.cache.writer("jobs/2/log")
+        )
+        self.assertEqual(body, response.read())
+        self.assertEqual(body, self.read("jobs/2/log"))
+
+        # response that isn't read completely is discarded
+        response = CachingResponse(
+            io.BytesIO(body), self.cache.writer("jobs/3/log")
+        )
+        self.assertEqual(b"line 1\n", response.readline())
+        response.close()
+        self.assertIsNone(self.cache.get("jobs/3/log"))
+        self.assertEqual(1, len(os.listdir(self.cache.blob_dir)))
@@ -0,0 +1,569 @@
+# vim: set expandtab sw=4 ts=4:
+#
+# Unit tests for Travis CI API connector
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import gzip
+import json
+import zlib
+import shutil
+import hashlib
+import tempfile
+import threading
+from buildtimetrend.travis.connector import TravisConnector
+from buildtimetrend.travis.connector import TravisOrgConnector
+from buildtimetrend.travis.connector import HTTPConnectionPool
+from buildtimetrend.travis.connector import is_finished
+from buildtimetrend.travis.connector import DecompressingResponse
+from buildtimetrend.buildjob import BuildJob
+from buildtimetrend.travis.cache import ResponseCache
+from buildtimetrend.travis.parser import TravisData
+from buildtimetrend.travis.pipeline import ImportPipeline
+from buildtimetrend.travis.test.travis_test import JOB_DATA_PYTHON
+from buildtimetrend.travis.test.travis_test import TRAVIS_LOG_FILE
+import unittest
+try:
+    # For Python 3.0 and later
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.error import HTTPError
+except ImportError:
+    # Fall back to Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import HTTPError
+
+
+def gzip_compress(data):
+    """Return gzip compressed data."""
+    compressed = io.BytesIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb') as gzip_file:
+        gzip_file.write(data)
+    return compressed.getvalue()
+
+
+class LocalTravisServer(ThreadingMixIn, HTTPServer):
+
+    """Local HTTP server serving Travis CI API responses."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        """Start server on a free local port."""
+        HTTPServer.__init__(self, ('127.0.0.1', 0), LocalTravisHandler)
+        self.connections = 0
+        self.requests = []
+        self.bytes_sent = 0
+        # number of finished builds in the build listing
+        self.builds = 5
+        self.lock = threading.Lock()
+        with open(TRAVIS_LOG_FILE, 'rb') as log_file:
+            self.job_log = log_file.read()
+
+        self.thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.01}
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def get_url(self):
+        """Return url of the server."""
+        return "http://127.0.0.1:{}/".format(self.server_address[1])
+
+    def handle_error(self, request, client_address):
+        """Ignore clients closing the connection before the response."""
+        pass
+
+    def stop(self):
+        """Stop server."""
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+
+class LocalTravisHandler(BaseHTTPRequestHandler):
+
+    """Handle requests to local Travis CI API server."""
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately,
+    # don't delay the body on a persistent connection
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        """Count connections."""
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def send_body(self, body, compress=False):
+        """
+        Send response body, or 304 if the client has the same ETag.
+
+        The body is gzip compressed if compress is true
+        and the client accepts it.
+        """
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        if compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip_compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.bytes_sent += len(body)
+
+    def send_builds_page(self):
+        """Send page of the build listing, with 3 finished builds."""
+        after_number = self.server.builds + 1
+        if 'after_number=' in self.path:
+            after_number = int(self.path.split('after_number=')[1])
+
+        numbers = range(after_number - 1, max(0, after_number - 4), -1)
+        self.send_body(json.dumps({
+            "builds": [
+                {"number": str(number), "job_ids": [number * 10],
+                 "finished_at": "2015-03-13T18:51:22Z"}
+                for number in numbers
+            ],
+            "commits": []
+        }).encode('utf-8'))
+
+    def do_GET(self):
+        """Return job data or job log."""
+        # close connection after the response, without notifying the client
+        if self.path.startswith('/close/'):
+            self.close_connection = True
+
+        with self.server.lock:
+            self.server.requests.append(self.path)
+
+        if self.path.startswith('/redirect/'):
+            # redirect to the url (or path) following the prefix
+            self.send_response(307)
+            self.send_header('Location', self.path[len('/redirect/'):])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.path.endswith('/log'):
+            self.send_body(self.server.job_log, compress=True)
+        elif self.path.startswith('/repos/'):
+            self.send_builds_page()
+        elif self.path.endswith('/jobs/running'):
+            job_data = json.loads(JOB_DATA_PYTHON)
+            job_data["job"]["finished_at"] = None
+            self.send_body(json.dumps(job_data).encode('utf-8'))
+        elif '/jobs/' in self.path:
+            self.send_body(JOB_DATA_PYTHON.encode('utf-8'))
+        elif self.path.startswith('/jobs?'):
+            # job data in bulk, the sample job data for each requested job
+            jobs_data = {"jobs": [], "commits": []}
+            for job_id in self.path.split('?', 1)[1].split('&'):
+                job_data = json.loads(JOB_DATA_PYTHON)
+                job_data["job"]["id"] = int(job_id.split('=', 1)[1])
+                jobs_data["jobs"].append(job_data["job"])
+                jobs_data["commits"].append(job_data["commit"])
+            self.send_body(json.dumps(jobs_data).encode('utf-8'))
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        """Don't log requests."""
+        pass
+
+
+class TestTravisConnector(unittest.TestCase):
+
+    """Unit tests for Travis CI connector with connection pooling"""
+
+    def setUp(self):
+        """Initialise test environment before each test."""
+        self.server = LocalTravisServer()
+        self.connector = TravisConnector(pool_size=2)
+        self.connector.api_url = self.server.get_url()
+
+    def tearDown(self):
+        """Clean up test environment after each test."""
+        self.connector.close()
+        self.server.stop()
+
+    def test_novalue(self):
+        """Test freshly initialised object."""
+        self.assertIsNone(TravisConnector().pool)
+        self.assertIsNone(TravisOrgConnector().pool)
+        self.assertEqual(5, TravisOrgConnector(5).pool.pool_size)
+
+    def test_json_request(self):
+        """Test reusing connection for json requests"""
+        for i in range(5):
+            self.assertDictEqual(
+                json.loads(JOB_DATA_PYTHON),
+                self.connector.json_request("jobs/{}".format(i))
+            )
+
+        self.assertEqual(1, self.server.connections)
+
+    def test_download_job_log(self):
+        """Test reusing connection for job log downloads"""
+        for i in range(3):
+            response = self.connector.download_job_log(i)
+            self.assertEqual(self.server.job_log, b"".join(response))
+
+        # partially read response, connection can't be reused
+        response = self.connector.download_job_log(4)
+        self.assertEqual(b"Using", response.read(5))
+        response.close()
+        self.connector.download_job_log(5).read()
+
+        self.assertEqual(2, self.server.connections)
+
+    def test_compressed_job_log(self):
+        """Test downloading compressed job log"""
+        response = self.connector.download_job_log(1)
+        self.assertIsInstance(response, DecompressingResponse)
+        self.assertEqual(self.server.job_log, b"".join(response))
+        self.assertLess(self.server.bytes_sent, len(self.server.job_log) / 10)
+
+        # connection is reused after reading the compressed response
+        self.connector.download_job_log(2).read()
+        self.assertEqual(1, self.server.connections)
+
+    def test_parse_job_log(self):
+        """Test reusing connection after parsing job log"""
+        travis_data = TravisData(
+            'buildtimetrend/python-lib', 158, self.connector
+        )
+        for i in range(3):
+            # no timing tags are parsed, the header is parsed only
+            travis_data.current_job = BuildJob()
+            travis_data.parse_job_log(i)
+            self.assertEqual(
+                "worker-linux-12-1.bb.travis-ci.org",
+                travis_data.current_job.get_property("worker")["hostname"]
+            )
+
+        self.assertEqual(1, self.server.connections)
+
+    def test_http_error(self):
+        """Test HTTP error status"""
+        self.assertRaises(HTTPError, self.connector.json_request, "error")
+
+        # connection of a failed request is not reused
+        self.connector.json_request("jobs/1")
+        self.assertEqual(2, self.server.connections)
+
+    def test_redirect(self):
+        """Test following redirects"""
+        # redirect to a path on the same host, reusing the connection
+        self.assertDictEqual(
+            json.loads(JOB_DATA_PYTHON),
+            self.connector.json_request("redirect//jobs/1")
+        )
+        self.assertListEqual(
+            ["/redirect//jobs/1", "/jobs/1"], self.server.requests
+        )
+        self.assertEqual(1, self.server.connections)
+
+        # redirect to another host
+        other_server = LocalTravisServer()
+        try:
+            self.assertDictEqual(
+                json.loads(JOB_DATA_PYTHON),
+                self.connector.json_request(
+                    "redirect/{}jobs/1".format(other_server.get_url())
+                )
+            )
+            self.assertListEqual(["/jobs/1"], other_server.requests)
+        finally:
+            other_server.stop()
+
+        # too many redirects
+        del self.server.requests[:]
+        self.assertRaises(
+            HTTPError, self.connector.json_request,
+            "redirect/{}".format(self.server.get_url()) * 12 + "jobs/1"
+        )
+        self.assertEqual(11, len(self.server.requests))
+
+    def test_threads(self):
+        """Test sharing connection pool between threads"""
+        results = []
+
+        def request_jobs():
+            """Request job data and log."""
+            for i in range(5):
+                results.append(self.connector.json_request("jobs/1"))
+                self.connector.download_job_log(i).read()
+
+        threads = [threading.Thread(target=request_jobs) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(20, len(results))
+        # at most pool_size idle connections are kept,
+        # connections of the other threads are closed after use
+        self.assertLessEqual(len(self.connector.pool.idle_connections[
+            ("http", "127.0.0.1:{}".format(self.server.server_address[1]))
+        ]), 2)
+        self.assertLess(self.server.connections, 40)
+
+        # pool large enough for all threads : one connection per thread
+        self.connector.close()
+        self.connector = TravisConnector(pool_size=4)
+        self.connector.api_url = self.server.get_url()
+        self.server.connections = 0
+        threads = [threading.Thread(target=request_jobs) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(40, len(results))
+        self.assertLessEqual(self.server.connections, 4)
+
+    def test_closed_connection(self):
+        """Test retry if idle connection was closed by server"""
+        pool = HTTPConnectionPool()
+        # server closes the connection after the response
+        pool.request(self.server.get_url() + "close/jobs/1").read()
+        self.assertEqual(
+            json.loads(JOB_DATA_PYTHON),
+            json.loads(pool.request(self.server.get_url() + "jobs/1").read())
+        )
+        self.assertEqual(2, self.server.connections)
+
+        pool.close()
+        self.assertDictEqual({}, pool.idle_connections)
+
+
+class TestTravisConnectorCache(unittest.TestCase):
+
+    """Unit tests for Travis CI connector with response cache"""
+
+    def setUp(self):
+        """Initialise test environment before each test."""
+        self.server = LocalTravisServer()
+        self.cache_dir = tempfile.mkdtemp()
+        self.connector = TravisConnector(cache=ResponseCache(self.cache_dir))
+        self.connector.api_url = self.server.get_url()
+
+    def tearDown(self):
+        """Clean up test environment after each test."""
+        self.server.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_is_finished(self):
+        """Test is_finished()"""
+        self.assertFalse(is_finished(None))
+        self.assertFalse(is_finished({}))
+        self.assertFalse(is_finished({"job": {"finished_at": None}}))
+        self.assertTrue(is_finished(json.loads(JOB_DATA_PYTHON)))
+        self.assertFalse(is_finished({"builds": []}))
+        self.assertFalse(is_finished({"builds": [
+            {"finished_at": "2015-03-13T18:51:22Z"}, {"finished_at": None}
+        ]}))
+        self.assertTrue(is_finished({"builds": [
+            {"finished_at": "2015-03-13T18:51:22Z"}
+        ]}))
+        self.assertFalse(is_finished({"jobs": []}))
+        self.assertFalse(is_finished({"jobs": [
+            {"finished_at": "2015-03-13T18:51:22Z"}, {"finished_at": None}
+        ]}))
+        self.assertTrue(is_finished({"jobs": [
+            {"finished_at": "2015-03-13T18:51:22Z"}
+        ]}))
+
+    def test_finished_job(self):
+        """Test serving finished job data and log from cache"""
+        for i in range(3):
+            self.assertDictEqual(
+                json.loads(JOB_DATA_PYTHON),
+                self.connector.json_request("jobs/1")
+            )
+            response = self.connector.download_job_log(1)
+            self.assertEqual(self.server.job_log, b"".join(response))
+            response.close()
+
+        self.assertListEqual(["/jobs/1", "/jobs/1/log"], self.server.requests)
+
+        # cache is persistent
+        connector = TravisConnector(cache=ResponseCache(self.cache_dir))
+        connector.api_url = self.server.get_url()
+        self.assertDictEqual(
+            json.loads(JOB_DATA_PYTHON), connector.json_request("jobs/1")
+        )
+        self.assertEqual(2, len(self.server.requests))
+
+    def test_reimport_finished_jobs(self):
+        """Test importing finished build jobs again is served from cache"""
+        def import_jobs(pipeline=False):
+            """Import build jobs with a new connector, using the cache."""
+            connector = TravisConnector(cache=ResponseCache(self.cache_dir))
+            connector.api_url = self.server.get_url()
+            travis_data = TravisData(
+                'buildtimetrend/python-lib', 158, connector
+            )
+            travis_data.builds_data = {"builds": [
+                {"job_ids": [1, 2], "event_type": "push"}
+            ]}
+            if pipeline:
+                stored = []
+                ImportPipeline(travis_data, stored.append).run()
+                return stored
+            return list(travis_data.process_build_jobs())
+
+        self.assertEqual(2, len(import_jobs()))
+        self.assertListEqual(
+            ["/jobs/1/log", "/jobs/2/log", "/jobs?ids[]=1&ids[]=2"],
+            sorted(self.server.requests)
+        )
+
+        del self.server.requests[:]
+        self.assertEqual(2, len(import_jobs()))
+        self.assertEqual(2, len(import_jobs(pipeline=True)))
+        self.assertListEqual([], self.server.requests)
+
+    def test_build_listing(self):
+        """Test only pages of the build listing before a build are final"""
+        def get_builds(first_build=None, last_build=None):
+            """Return numbers of the builds in the listing, using the cache."""
+            connector = TravisConnector(cache=ResponseCache(self.cache_dir))
+            connector.api_url = self.server.get_url()
+            travis_data = TravisData('buildtimetrend/python-lib', 1, connector)
+            return [
+                build["number"]
+                for builds_data in travis_data.get_builds_data_pages(
+                    first_build, last_build
+                )
+                for build in builds_data["builds"]
+            ]
+
+        self.assertListEqual(["5", "4"], get_builds(4))
+        self.assertListEqual(["2", "1"], get_builds(last_build=2))
+        self.assertEqual(2, len(self.server.requests))
+
+        # the first page is revalidated, a new build is listed
+        self.server.builds = 6
+        self.assertListEqual(["6", "5", "4"], get_builds(4))
+        self.assertEqual(3, len(self.server.requests))
+
+        # a page of builds before a build is final
+        self.assertListEqual(["2", "1"], get_builds(last_build=2))
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_unfinished_job(self):
+        """Test revalidating data of a running job"""
+        for i in range(2):
+            self.assertIsNone(
+                self.connector.json_request("jobs/running")["job"]
+                ["finished_at"]
+            )
+            response = self.connector.download_job_log("running")
+            self.assertEqual(self.server.job_log, b"".join(response))
+            response.close()
+
+        self.assertEqual(4, len(self.server.requests))
+        self.assertEqual(
+            '"{}"'.format(hashlib.md5(self.server.job_log).hexdigest()),
+            self.connector.cache.get("jobs/running/log")["etag"]
+        )
+
+    def test_parse_job_log(self):
+        """Test caching job log of which only the header is parsed"""
+        travis_data = TravisData(
+            'buildtimetrend/python-lib', 158, self.connector
+        )
+        travis_data.current_job = BuildJob()
+        travis_data.parse_job_log(1, finished=True)
+
+        self.assertTrue(self.connector.cache.is_finished("jobs/1/log"))
+        # only the stored body is left, no temporary files
+        self.assertEqual(
+            1, len(os.listdir(self.connector.cache.blob_dir))
+        )
+
+        travis_data.current_job = BuildJob()
+        travis_data.parse_job_log(1)
+        self.assertListEqual(["/jobs/1/log"], self.server.requests)
+
+    def test_partial_read(self):
+        """Test that a partially read response isn't cached"""
+        response = self.connector.download_job_log(1)
+        response.read(10)
+        response.close()
+        self.assertIsNone(self.connector.cache.get("jobs/1/log"))
+
+
+class TestDecompressingResponse(unittest.TestCase):
+
+    """Unit tests for DecompressingResponse class"""
+
+    def setUp(self):
+        """Initialise test environment before each test."""
+        with open(TRAVIS_LOG_FILE, 'rb') as log_file:
+            self.job_log = log_file.read()
+
+    def get_compressed(self):
+        """Return job log compressed with gzip, deflate and raw deflate."""
+        raw_deflate = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return [
+            gzip_compress(self.job_log),
+            zlib.compress(self.job_log),
+            raw_deflate.compress(self.job_log) + raw_deflate.flush()
+        ]
+
+    def test_iterate(self):
+        """Test iterating lines"""
+        expected = io.BytesIO(self.job_log).readlines()
+        for data in self.get_compressed():
+            response = DecompressingResponse(io.BytesIO(data))
+            self.assertListEqual(expected, list(response))
+
+    def test_read(self):
+        """Test reading all data and reading chunks"""
+        for data in self.get_compressed():
+            response = DecompressingResponse(io.BytesIO(data))
+            self.assertEqual(self.job_log, response.read())
+            self.assertEqual(b"", response.read())
+
+            response = DecompressingResponse(io.BytesIO(data))
+            self.assertEqual(self.job_log[:10], response.read(10))
+            self.assertEqual(self.job_log[10:20], response.readline(10))
+            self.assertEqual(
+                self.job_log[20:self.job_log.index(b"\n") + 1],
+                response.readline()
+            )
+            chunks = [response.read(100000) for i in range(10)]
+            self.assertEqual(
+                self.job_log[self.job_log.index(b"\n") + 1:],
+                b"".join(chunks)
+            )
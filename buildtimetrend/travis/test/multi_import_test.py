@@ -0,0 +1,229 @@
+# vim: set expandtab sw=4 ts=4:
+#
+# Unit tests for importing a range of Travis CI builds
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division
+import time
+import threading
+from email.utils import formatdate
+from buildtimetrend.settings import Settings
+from buildtimetrend.travis.multi_import import MultiImport
+from buildtimetrend.travis.multi_import import TokenBucket
+from buildtimetrend.travis.multi_import import get_retry_after
+import unittest
+try:
+    # For Python 3.0 and later
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    # Fall back to Python 2's urllib2
+    from urllib2 import HTTPError, URLError
+
+
+def rate_limit_error(retry_after=None):
+    """Return HTTPError with status 429."""
+    headers = {}
+    if retry_after is not None:
+        headers['Retry-After'] = retry_after
+    return HTTPError("http://test/", 429, "Too Many Requests", headers, None)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    """Unit tests for TokenBucket class"""
+
+    def test_unlimited(self):
+        """Test bucket without rate limit"""
+        bucket = TokenBucket()
+        start = time.time()
+        for i in range(100):
+            bucket.acquire()
+        self.assertLess(time.time() - start, 0.1)
+
+    def test_rate(self):
+        """Test rate limit and burst"""
+        bucket = TokenBucket(20, 5)
+        start = time.time()
+        # burst
+        for i in range(5):
+            bucket.acquire()
+        self.assertLess(time.time() - start, 0.04)
+        # limited by rate
+        for i in range(4):
+            bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.19)
+
+    def test_pause(self):
+        """Test pausing the bucket"""
+        bucket = TokenBucket(None, 5)
+        bucket.pause(0.1)
+        start = time.time()
+        bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.09)
+
+
+class TestMultiImport(unittest.TestCase):
+
+    """Unit tests for MultiImport class"""
+
+    def setUp(self):
+        """Initialise test environment before each test."""
+        self.settings = Settings()
+        self.settings.set_defaults()
+        self.imported = []
+        self.lock = threading.Lock()
+
+    def import_build(self, repo, build, stored_jobs):
+        """Record imported build, return number of jobs."""
+        with self.lock:
+            self.imported.append(build)
+        return build * 2
+
+    def test_get_retry_after(self):
+        """Test get_retry_after()"""
+        self.assertIsNone(get_retry_after(URLError("error")))
+        self.assertIsNone(get_retry_after(rate_limit_error()))
+        self.assertIsNone(get_retry_after(rate_limit_error("invalid")))
+        self.assertEqual(5, get_retry_after(rate_limit_error("5")))
+        self.assertAlmostEqual(
+            10,
+            get_retry_after(rate_limit_error(formatdate(time.time() + 10))),
+            delta=1
+        )
+
+    def test_settings(self):
+        """Test default values from multi_import settings"""
+        multi_import = MultiImport("test/repo")
+        self.assertEqual(100, multi_import.max_builds)
+        self.assertAlmostEqual(1 / 3, multi_import.max_rate)
+
+        self.settings.add_setting(
+            "multi_import", {"max_builds": 10, "delay": 0}
+        )
+        multi_import = MultiImport("test/repo")
+        self.assertEqual(10, multi_import.max_builds)
+        self.assertIsNone(multi_import.max_rate)
+
+    def test_import_builds(self):
+        """Test importing a range of builds"""
+        progress = []
+        multi_import = MultiImport(
+            "test/repo", self.import_build, max_workers=3, delay=0,
+            max_builds=5, progress=lambda *args: progress.append(args)
+        )
+
+        results = multi_import.import_builds(10, 20)
+        self.assertDictEqual(
+            {
+                "imported": {10: 20, 11: 22, 12: 24, 13: 26, 14: 28},
+                "failed": {}
+            },
+            results
+        )
+        self.assertListEqual([10, 11, 12, 13, 14], sorted(self.imported))
+        self.assertListEqual(
+            [1, 2, 3, 4, 5], [progress_args[2] for progress_args in progress]
+        )
+        self.assertTrue(all(
+            progress_args[3] == 5 for progress_args in progress
+        ))
+
+    def test_rate_limit(self):
+        """Test pausing and retrying after exceeding the API rate limit"""
+        errors = [rate_limit_error("0"), rate_limit_error("0")]
+
+        def import_build(repo, build, stored_jobs):
+            """Fail the first imports."""
+            with self.lock:
+                if build == 2 and errors:
+                    raise errors.pop(0)
+            return self.import_build(repo, build, stored_jobs)
+
+        multi_import = MultiImport(
+            "test/repo", import_build, max_workers=2, delay=0.01
+        )
+        results = multi_import.import_builds(1, 4)
+        self.assertListEqual([1, 2, 3, 4], sorted(results["imported"]))
+        # rate was halved twice, then increased after each import
+        self.assertLess(multi_import.bucket.rate, multi_import.max_rate)
+
+    def test_failed_builds(self):
+        """Test builds failing after retries, and client errors"""
+        def import_build(repo, build, stored_jobs):
+            """Fail all imports."""
+            with self.lock:
+                self.imported.append(build)
+            if build == 1:
+                raise URLError("network error")
+            raise HTTPError("http://test/", 404, "Not Found", {}, None)
+
+        multi_import = MultiImport(
+            "test/repo", import_build, delay=0, max_retries=1
+        )
+        # don't wait between retries in the test
+        multi_import.bucket.pause = lambda seconds: None
+
+        results = multi_import.import_builds(1, 2)
+        self.assertDictEqual({}, results["imported"])
+        self.assertListEqual([1, 2], sorted(results["failed"]))
+        # a client error isn't retried
+        self.assertListEqual([1, 1, 2], sorted(self.imported))
+
+    def test_retry_stored_jobs(self):
+        """Test retrying a build import skips the jobs already stored"""
+        stored = []
+        errors = [URLError("network error"), IOError("sending failed")]
+
+        def import_build(repo, build, stored_jobs):
+            """Store jobs, fail twice after storing the first job."""
+            for job_id in (1, 2, 3):
+                if job_id in stored_jobs:
+                    continue
+                if job_id == 2 and errors:
+                    raise errors.pop(0)
+                stored.append(job_id)
+                stored_jobs.add(job_id)
+            return len(stored_jobs)
+
+        multi_import = MultiImport("test/repo", import_build, delay=0)
+        multi_import.bucket.pause = lambda seconds: None
+
+        results = multi_import.import_builds(1, 1)
+        self.assertDictEqual({1: 3}, results["imported"])
+        # each job is stored once
+        self.assertListEqual([1, 2, 3], stored)
+
+    def test_other_errors(self):
+        """Test other errors are recorded as failed builds"""
+        def import_build(repo, build, stored_jobs):
+            """Fail storing build 1."""
+            with self.lock:
+                self.imported.append(build)
+            if build == 1:
+                raise ValueError("storing failed")
+            return build
+
+        multi_import = MultiImport("test/repo", import_build, delay=0)
+
+        results = multi_import.import_builds(1, 3)
+        self.assertDictEqual({2: 2, 3: 3}, results["imported"])
+        self.assertDictEqual({1: "storing failed"}, results["failed"])
+        # the failed build isn't retried
+        self.assertListEqual([1, 2, 3], sorted(self.imported))
@@ -0,0 +1,179 @@
+# vim: set expandtab sw=4 ts=4:
+#
+# Unit tests for Travis CI import pipeline
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from buildtimetrend import keenio
+from buildtimetrend.travis.parser import TravisData
+from buildtimetrend.travis.pipeline import ImportPipeline
+from buildtimetrend.travis.test.travis_test import LocalTravisConnector
+from buildtimetrend.travis.test.travis_test import TEST_REPO
+from buildtimetrend.travis.test.travis_test import TRAVIS_LOG_FILE
+import unittest
+
+JOB_IDS = [1, 2, 3, 4, 5, 6]
+# delay (in seconds) of downloading a job log and storing a build job
+STAGE_DELAY = 0.05
+
+
+class TestImportPipeline(unittest.TestCase):
+
+    """Unit tests for ImportPipeline class"""
+
+    def setUp(self):
+        """Initialise test environment before each test."""
+        self.connector = LocalTravisConnector(
+            dict((str(job_id), STAGE_DELAY) for job_id in JOB_IDS)
+        )
+        self.travis_data = self.create_travis_data()
+        self.stored = []
+
+    def create_travis_data(self):
+        """Create TravisData instance with build data."""
+        travis_data = TravisData(TEST_REPO, 536, self.connector)
+        travis_data.builds_data = {
+            "builds": [
+                {"job_ids": JOB_IDS[:4], "event_type": "push"},
+                {"job_ids": JOB_IDS[4:], "event_type": "push"}
+            ]
+        }
+        return travis_data
+
+    def store(self, build_job):
+        """Store build job, slowly."""
+        time.sleep(STAGE_DELAY)
+        self.stored.append(build_job.to_dict())
+
+    def test_run(self):
+        """Test importing build jobs"""
+        # reference : process build jobs one after another
+        expected = []
+        for build_job in self.create_travis_data().process_build_jobs():
+            self.store(build_job)
+        expected, self.stored = self.stored, []
+
+        start = time.time()
+        pipeline = ImportPipeline(self.travis_data, self.store)
+        self.assertEqual(6, pipeline.run())
+        duration = time.time() - start
+
+        self.assertListEqual(expected, self.stored)
+        self.assertEqual(6, len(self.travis_data.build_jobs))
+        self.assertEqual(
+            "536.5", self.travis_data.build_jobs["5"].get_property("job")
+        )
+        # download and store overlap : sequential import takes at least
+        # 2 * 6 * STAGE_DELAY
+        self.assertLess(duration, 9 * STAGE_DELAY)
+
+    def test_run_streaming(self):
+        """Test importing build jobs, without keeping them"""
+        self.travis_data.streaming = True
+        pipeline = ImportPipeline(self.travis_data, self.store)
+        self.assertEqual(6, pipeline.run())
+        self.assertEqual(6, len(self.stored))
+        self.assertDictEqual({}, self.travis_data.build_jobs)
+
+    def test_download(self):
+        """Test downloading job logs to temporary files"""
+        with open(TRAVIS_LOG_FILE, 'rb') as log_file:
+            job_log = log_file.read()
+
+        pipeline = ImportPipeline(self.travis_data, self.store)
+        for build, job_id, job_data, log_file in pipeline.download():
+            self.assertNotIsInstance(log_file, bytes)
+            self.assertEqual(job_log, log_file.read())
+            log_file.close()
+
+    def test_stored_jobs(self):
+        """Test skipping build jobs that are already stored"""
+        stored_jobs = set([1, 5])
+        pipeline = ImportPipeline(
+            self.travis_data, self.store, stored_jobs=stored_jobs
+        )
+        self.assertEqual(4, pipeline.run())
+        self.assertListEqual(
+            ["536.2", "536.3", "536.4", "536.6"],
+            [build_job["job"] for build_job in self.stored]
+        )
+        self.assertSetEqual(set(JOB_IDS), stored_jobs)
+
+    def test_store_error(self):
+        """Test pipeline stops when a stage fails"""
+        def store(build_job):
+            """Fail storing the second build job."""
+            if len(self.stored) == 1:
+                raise ValueError("store failed")
+            self.stored.append(build_job)
+
+        pipeline = ImportPipeline(self.travis_data, store, queue_size=1)
+        self.assertRaises(ValueError, pipeline.run)
+        self.assertEqual(1, len(self.stored))
+        # downloading stops too
+        self.assertLess(len(self.travis_data.build_jobs), 6)
+
+    def test_download_error(self):
+        """Test pipeline stops when downloading fails"""
+        def download_job_log(job_id, finished=False):
+            """Fail downloading third job log."""
+            if job_id == 3:
+                raise IOError("download failed")
+            return LocalTravisConnector.download_job_log(
+                self.connector, job_id, finished
+            )
+        self.connector.download_job_log = download_job_log
+
+        pipeline = ImportPipeline(self.travis_data, self.store)
+        self.assertRaises(IOError, pipeline.run)
+        # all stages stop, jobs that were still in the pipeline are dropped
+        self.assertLessEqual(len(self.stored), 2)
+
+    def test_send_error(self):
+        """Test jobs are only stored when the writer sent their events"""
+        def send_events(batch):
+            """Fail sending the events of job 3."""
+            if batch["build_jobs"][0]["job"] == "536.3":
+                raise IOError("Keen.io is down")
+
+        writer = keenio.EventWriter(batch_events=1, send_events=send_events)
+        self.addCleanup(writer.close)
+
+        def store(build_job):
+            """Add build job to the writer."""
+            writer.add_event("build_jobs", build_job.to_dict())
+
+        stored_jobs = set()
+        pipeline = ImportPipeline(
+            self.travis_data, store, writer=writer, stored_jobs=stored_jobs
+        )
+        self.assertRaises(IOError, pipeline.run)
+        self.assertSetEqual(set([1, 2, 4, 5, 6]), stored_jobs)
+
+        # retry only sends the failed job
+        sent = []
+        writer.send_events = lambda batch: sent.extend(batch["build_jobs"])
+        pipeline = ImportPipeline(
+            self.create_travis_data(), store, writer=writer,
+            stored_jobs=stored_jobs
+        )
+        self.assertEqual(1, pipeline.run())
+        self.assertListEqual(["536.3"], [event["job"] for event in sent])
+        self.assertSetEqual(set(JOB_IDS), stored_jobs)
@@ -0,0 +1,165 @@
+# vim: set expandtab sw=4 ts=4:
+#
+# Unit tests for parsing a directory tree of Travis CI logs
+#
+# Copyright (C) 2014-2016 Dieter Adriaenssens <ruleant@users.sourceforge.net>
+#
+# This file is part of buildtimetrend/python-lib
+# <https://github.com/buildtimetrend/python-lib/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import shutil
+import tempfile
+from buildtimetrend.travis.parser import parse_job_log_data
+from buildtimetrend.travis import reparse
+from buildtimetrend.travis.reparse import LogArchiveParser
+from buildtimetrend.travis.reparse import find_log_files
+from buildtimetrend.travis.reparse import load_parsed_hashes
+from buildtimetrend.travis.test.travis_test import JOB_DATA_PYTHON
+from buildtimetrend.travis.test.travis_test import TRAVIS_LOG_FILE
+import unittest
+
+
+class TestLogArchiveParser(unittest.TestCase):
+
+    """Unit tests for parsing a directory tree of Travis CI logs"""
+
+    def setUp(self):
+        """Initialise test environment before each test."""
+        self.log_dir = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.log_dir, "build_jobs.json")
+        self.build_config = json.loads(JOB_DATA_PYTHON)["job"]["config"]
+
+        with open(TRAVIS_LOG_FILE, 'rb') as log_file:
+            self.log = log_file.read()
+
+        os.makedirs(os.path.join(self.log_dir, "536"))
+        os.makedirs(os.path.join(self.log_dir, "537"))
+        self.write_log("536/1001.log", self.log)
+        self.write_log("536/1002.log", b"Using worker: host:os\n")
+        # same content as 536/1001.log
+        self.write_log("537/1003.log", self.log)
+
+    def tearDown(self):
+        """Clean up after tests"""
+        shutil.rmtree(self.log_dir)
+
+    def write_log(self, filename, data):
+        """Write log file in log dir."""
+        with open(os.path.join(self.log_dir, filename), 'wb') as log_file:
+            log_file.write(data)
+
+    def read_output(self):
+        """Return list of build jobs in output file."""
+        with open(self.output_file) as output:
+            return [json.loads(line) for line in output]
+
+    def test_find_log_files(self):
+        """Test find_log_files()"""
+        self.assertListEqual([], list(find_log_files(self.output_file)))
+
+        self.assertListEqual(
+            [
+                os.path.join(self.log_dir, "536", "1001.log"),
+                os.path.join(self.log_dir, "536", "1002.log"),
+                os.path.join(self.log_dir, "537", "1003.log")
+            ],
+            list(find_log_files(self.log_dir, "*.log"))
+        )
+
+        self.assertListEqual(
+            [os.path.join(self.log_dir, "536", "1002.log")],
+            list(find_log_files(self.log_dir, "1002.*"))
+        )
+
+    def test_load_parsed_hashes(self):
+        """Test load_parsed_hashes()"""
+        self.assertSetEqual(set(), load_parsed_hashes(self.output_file))
+
+        with open(self.output_file, 'w') as output:
+            output.write('{"log_hash": "abc", "job": "1"}\n')
+            output.write('{"job": "2"}\n')
+            output.write('{"log_hash": "def", "job": "3"}\n')
+            # incomplete line
+            output.write('{"log_hash": "gh')
+
+        self.assertSetEqual(
+            {"abc", "def"}, load_parsed_hashes(self.output_file)
+        )
+
+    def test_run(self):
+        """Test LogArchiveParser.run()"""
+        archive_parser = LogArchiveParser(
+            self.log_dir, self.output_file, 2, "*.log", self.build_config
+        )
+        stats = archive_parser.run()
+
+        self.assertEqual(2, stats["parsed"])
+        self.assertEqual(1, stats["skipped"])
+        self.assertEqual(0, stats["failed"])
+        self.assertEqual(2 * len(self.log) + 22, stats["bytes"])
+        self.assertGreater(stats["logs_per_second"], 0)
+        self.assertGreater(stats["mb_per_second"], 0)
+
+        build_jobs = self.read_output()
+        self.assertEqual(2, len(build_jobs))
+        build_jobs = dict((job["job"], job) for job in build_jobs)
+        # of the logs with the same content, only one is parsed
+        self.assertEqual(1, len({"1001", "1003"} & set(build_jobs)))
+
+        build_job = build_jobs.get("1001", build_jobs.get("1003"))
+        parsed_log = parse_job_log_data(self.log, self.build_config)
+        self.assertListEqual(parsed_log["stages"], build_job["stages"])
+        self.assertDictEqual(parsed_log["worker"], build_job["worker"])
+        self.assertDictEqual(parsed_log["started_at"], build_job["started_at"])
+        # substages are named using the build config
+        self.assertIn(
+            "script.1", [stage["name"] for stage in build_job["stages"]]
+        )
+
+        self.assertDictEqual(
+            {"hostname": "host", "os": "os"}, build_jobs["1002"]["worker"]
+        )
+        self.assertEqual(
+            os.path.join(self.log_dir, "536", "1002.log"),
+            build_jobs["1002"]["log_file"]
+        )
+
+        # parse again after adding a log, only the new log is parsed
+        self.write_log("537/1004.log", b"new log\n")
+        stats = archive_parser.run()
+        self.assertEqual(1, stats["parsed"])
+        self.assertEqual(3, stats["skipped"])
+
+        build_jobs = self.read_output()
+        self.assertEqual(3, len(build_jobs))
+        self.assertEqual("1004", build_jobs[2]["job"])
+        self.assertListEqual([], build_jobs[2]["stages"])
+
+    def test_main(self):
+        """Test main()"""
+        self.assertEqual(2, reparse.main(["reparse"]))
+        self.assertEqual(2, reparse.main(["reparse", "--unknown"]))
+        self.assertEqual(
+            2, reparse.main(["reparse", self.output_file, self.output_file])
+        )
+        self.assertFalse(os.path.exists(self.output_file))
+
+        self.assertEqual(0, reparse.main([
+            "reparse", "--processes=2", self.log_dir, self.output_file
+        ]))
+        self.assertEqual(2, len(self.read_output()))
@@ -59,6 +59,41 @@ class TestTravisSubstage(unittest.TestCase):
             self.substage.stage.to_dict())
         self.assertEqual("", self.substage.timing_hash)
 
+    def test_to_dict(self):
+        """Test to_dict() and load_dict()"""
+        self.assertDictEqual(
+            {
+                "stage": {"name": "", "duration": 0},
+                "timing_hash": "",
+                "finished_incomplete": False,
+                "finished": False
+            },
+            self.substage.to_dict()
+        )
+
+        self.substage.process_start_stage(
+            {'start_stage': 'stage', 'start_substage': '1'}
+        )
+        self.substage.process_start_time({'start_hash': VALID_HASH1})
+        substage_dict = self.substage.to_dict()
+
+        # load state in a new substage
+        substage = TravisSubstage()
+        self.assertTrue(substage.load_dict(substage_dict))
+        self.assertEqual("stage.1", substage.get_name())
+        self.assertEqual(VALID_HASH1, substage.timing_hash)
+        self.assertTrue(substage.has_started())
+        self.assertFalse(substage.has_finished())
+
+        # state is copied
+        substage.set_name("stage.2")
+        self.assertEqual("stage.1", self.substage.get_name())
+
+        # invalid state
+        self.assertRaises(TypeError, substage.load_dict, None)
+        self.assertFalse(substage.load_dict({"stage": {}}))
+        self.assertEqual("stage.2", substage.get_name())
+
     def test_param_is_not_dict(self):
         """Test parameter input types"""
         # error is thrown when called without parameters
@@ -20,8 +20,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import io
 import os
 import json
+import mmap
+import time
+import pickle
+import tempfile
+from multiprocessing import Pool
 import buildtimetrend
 from builtins import str
 from buildtimetrend.settings import Settings
@@ -30,12 +36,26 @@ from buildtimetrend.tools import check_dict
 from buildtimetrend.travis import connector
 from buildtimetrend.buildjob import BuildJob
 from buildtimetrend.travis.parser import TravisData
+from buildtimetrend.travis.parser import scan_timing_tags
+from buildtimetrend.travis.parser import parse_job_log_data
+from buildtimetrend.travis.parser import parse_job_log_phases
+from buildtimetrend.travis.parser import create_substage_index
+from buildtimetrend.travis.parser import get_tagged_body_lines
+from buildtimetrend.travis.parser import LOG_PHASE_HEADER
+from buildtimetrend.travis.parser import LOG_PHASE_BODY
+from buildtimetrend.travis.parser import find_tag_lines
+from buildtimetrend.travis.parser import find_tag_lines_mmap
 from buildtimetrend.travis.connector import TravisConnector
 from buildtimetrend.travis.tools import convert_build_result
 from buildtimetrend.travis.tools import check_authorization
 from buildtimetrend.travis.tools import process_notification_payload
 from buildtimetrend.test import constants
 import unittest
+try:
+    # Python 3.4 and later
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 TRAVIS_TIMING_TAGS_FILE = "buildtimetrend/test/test_sample_travis_time_tags"
 TRAVIS_INCORRECT_TIMING_TAGS_FILE = \
@@ -313,6 +333,95 @@ JOB_DATA_JAVA = '{"job":{"id":35665484,"repository_id":1390431,"repository_slug"
 JOB_DATA_ANDROID = '{"job":{"id":62985775,"repository_id":1390431,"repository_slug":"ruleant/getback_gps","build_id":62985773,"commit_id":17998453,"log_id":43745930,"number":"577.1","config":{"language":"android","android":{"components":["android-20","build-tools-21.1.2"]},"before_install":["cd $HOME","if [[ -d buildtime-trend/.git ]]; then cd buildtime-trend; git pull; cd ..; else git clone --recursive https://github.com/buildtimetrend/python-client.git buildtime-trend; fi","source buildtime-trend/init.sh","mvn -v","timestamp.sh install_libs","sudo apt-get update -qq","sudo apt-get install -qq python-pip","timestamp.sh install_python_libs","sudo CFLAGS=-O0 pip install -r ${BUILD_TREND_HOME}/requirements.txt","timestamp.sh deploy_android_sdk","$TRAVIS_BUILD_DIR/.utility/deploy-sdk-to-m2-repo.sh","cd $TRAVIS_BUILD_DIR"],"script":["timestamp.sh test","./gradlew clean check"],"after_success":["timestamp.sh coverage","mvn clean test cobertura:cobertura coveralls:cobertura -B","timestamp.sh update_javadoc","mvn clean install javadoc:javadoc -DskipTests=true",".utility/copy-javadoc-to-gh-pages.sh"],"after_script":["timestamp.sh end","sync-buildtime-trend-with-gh-pages.sh"],"addons":{},"notifications":{"webhooks":["https://buildtimetrend.herokuapp.com/travis","https://buildtimetrend-dev.herokuapp.com/travis"]},".result":"configured","global_env":"GH_TOKEN=[secure] COVERITY_SCAN_TOKEN=[secure] KEEN_PROJECT_ID=[secure] KEEN_WRITE_KEY=[secure] KEEN_MASTER_KEY=[secure]","os":"linux"},"state":"passed","started_at":"2015-05-18T08:56:53Z","finished_at":"2015-05-18T09:00:18Z","queue":"builds.linux","allow_failure":false,"tags":null,"annotation_ids":[]},"commit":{"id":17998453,"sha":"0f6f6f4af0b9c5013c9ebd1022780915e79a0701","branch":"master","message":"update bttaas url","committed_at":"2015-05-18T08:55:38Z","author_name":"Dieter Adriaenssens","author_email":"ruleant@users.sourceforge.net","committer_name":"Dieter Adriaenssens","committer_email":"ruleant@users.sourceforge.net","compare_url":"https://github.com/ruleant/getback_gps/compare/6de49007276c...0f6f6f4af0b9"},"annotations":[]}'
 
 
+class LocalTravisConnector(TravisConnector):
+
+    """Travis CI connector returning local job data and job logs."""
+
+    def __init__(self, delays=None):
+        """
+        Constructor.
+
+        Parameters:
+        - delays : dictionary with delay (in seconds) per job id
+        """
+        super(LocalTravisConnector, self).__init__()
+        self.delays = delays or {}
+        self.requests = []
+
+    def json_request(self, json_request, final=True):
+        """Return job data, job number is derived from job id."""
+        self.requests.append(json_request)
+
+        # job data of several jobs
+        if json_request.startswith("jobs?"):
+            job_ids = [
+                parameter.split("=")[1]
+                for parameter in json_request[5:].split("&")
+            ]
+            jobs = [self.get_job_data(job_id) for job_id in job_ids]
+            return {
+                "jobs": [job_data["job"] for job_data in jobs],
+                "commits": [jobs[0]["commit"]]
+            }
+
+        job_id = json_request.split('/')[-1]
+        time.sleep(self.delays.get(job_id, 0))
+        return self.get_job_data(job_id)
+
+    def get_job_data(self, job_id):
+        """Return job data, job number is derived from job id."""
+        job_data = json.loads(JOB_DATA_PYTHON)
+        job_data['job']['id'] = int(job_id)
+        job_data['job']['number'] = "536.{}".format(job_id)
+        return job_data
+
+    def download_job_log(self, job_id, finished=False):
+        """Return sample job log."""
+        time.sleep(self.delays.get(str(job_id), 0))
+        with open(TRAVIS_LOG_FILE, 'rb') as log_file:
+            return io.BytesIO(log_file.read())
+
+
+class PagedTravisConnector(LocalTravisConnector):
+
+    """Travis CI connector returning a paginated build listing."""
+
+    def __init__(self, builds=10, page_size=3):
+        """
+        Constructor.
+
+        Parameters:
+        - builds : number of builds of the repo
+        - page_size : number of builds per page
+        """
+        super(PagedTravisConnector, self).__init__()
+        self.builds = builds
+        self.page_size = page_size
+        self.requests = []
+
+    def json_request(self, json_request, final=True):
+        """Return a page of builds, or job data."""
+        if not json_request.startswith("repos/"):
+            return super(PagedTravisConnector, self).json_request(json_request)
+
+        self.requests.append(json_request)
+        after_number = self.builds + 1
+        if "after_number=" in json_request:
+            after_number = int(json_request.split("after_number=")[1])
+
+        numbers = range(
+            after_number - 1, max(0, after_number - 1 - self.page_size), -1
+        )
+        return {
+            "builds": [
+                {"number": str(number), "job_ids": [number * 10],
+                 "commit_id": number, "event_type": "push"}
+                for number in numbers
+            ],
+            "commits": [{"id": number} for number in numbers]
+        }
+
+
 class TestTravis(unittest.TestCase):
 
     """Unit tests for Travis CI related functions and classes"""
@@ -428,6 +537,239 @@ class TestTravis(unittest.TestCase):
             "61db633141cd24b4c9cbccb2a2c2c6a99988c3e346b951e4666e50474518cb82"
         ))
 
+    def test_scan_timing_tags(self):
+        """Test scan_timing_tags()"""
+        self.assertListEqual([], list(scan_timing_tags("")))
+        self.assertListEqual([], list(scan_timing_tags("no tags\r\n")))
+
+        # all tags are returned, in order of appearance
+        self.assertListEqual(
+            [
+                {
+                    'end_hash': '11ad00c5',
+                    'start_timestamp': '1408282896480781630',
+                    'finish_timestamp': '1408282901258723972',
+                    'duration': '4777942342'
+                },
+                {'end_stage': 'after_script', 'end_substage': '2'},
+                {'start_stage': 'after_script', 'start_substage': '3'},
+                {'command': 'echo $TRAVIS_TEST_RESULT'}
+            ],
+            list(scan_timing_tags(
+                "travis_time:end:11ad00c5:start=1408282896480781630,"
+                "finish=1408282901258723972,duration=4777942342\r\x1b[0K"
+                "travis_fold:end:after_script.2\r\x1b[0K"
+                "travis_fold:start:after_script.3\r\x1b[0K"
+                "$ echo $TRAVIS_TEST_RESULT\r\n"
+            ))
+        )
+
+        self.assertListEqual(
+            [
+                {'end_stage': 'after_script', 'end_substage': '3'},
+                {'start_hash': '1db5972c'},
+                {'command': 'timestamp.sh Done'}
+            ],
+            list(scan_timing_tags(
+                "travis_fold:end:after_script.3\r\x1b[0K"
+                "travis_time:start:1db5972c\r\x1b[0K"
+                "$ timestamp.sh Done\r\n"
+            ))
+        )
+
+    def test_scan_timing_tags_long_line(self):
+        """Test scan_timing_tags() with long lines (progress bars)"""
+        # incomplete tags, without terminating carriage return
+        self.assertListEqual(
+            [],
+            list(scan_timing_tags(
+                "$ " * 100000 + "travis_time:start:" * 100000 + "\n"
+            ))
+        )
+        self.assertListEqual(
+            [],
+            list(scan_timing_tags("travis_time:end:\r\x1b" * 100000))
+        )
+
+        # tags between progress bar updates
+        self.assertListEqual(
+            [
+                {'end_stage': 'install', 'end_substage': '1'},
+                {'start_hash': '1db5972c'},
+                {'command': 'timestamp.sh Done'}
+            ],
+            list(scan_timing_tags(
+                "Downloading 50%\r" * 100000 +
+                "travis_fold:end:install.1\r\x1b[0K" +
+                "Downloading 50%\r" * 100000 +
+                "travis_time:start:1db5972c\r\x1b[0K"
+                "$ timestamp.sh Done\r\n"
+            ))
+        )
+
+        # command or hash ends at the first carriage return
+        self.assertListEqual(
+            [{'command': 'echo 1'}],
+            list(scan_timing_tags("$ echo 1\r2\r\n"))
+        )
+        self.assertListEqual(
+            [],
+            list(scan_timing_tags("travis_time:start:1db5972c\r2\r\x1b[0K"))
+        )
+
+    def test_scan_timing_tags_bytes(self):
+        """Test scan_timing_tags() with bytes"""
+        self.assertListEqual([], list(scan_timing_tags(b"\xff\xfe\r\n")))
+
+        # parsed values are decoded to strings
+        self.assertListEqual(
+            [
+                {'start_stage': 'install', 'start_substage': '4'},
+                {'start_hash': '126e6851'},
+                {'command': 'echo \u00e9'}
+            ],
+            list(scan_timing_tags(
+                b"travis_fold:start:install.4\r\x1b[0K"
+                b"travis_time:start:126e6851\r\x1b[0K"
+                b"$ echo \xc3\xa9\r\n"
+            ))
+        )
+
+        # invalid UTF-8 is replaced
+        self.assertListEqual(
+            [{'command': 'echo \ufffd'}],
+            list(scan_timing_tags(b"$ echo \xff\r\n"))
+        )
+
+    def test_find_tag_lines(self):
+        """Test find_tag_lines()"""
+        markers = [b'travis_', b'Using worker:']
+        self.assertListEqual([], list(find_tag_lines(b"", markers)))
+        self.assertListEqual([], list(find_tag_lines(b"no tags\n", markers)))
+
+        self.assertListEqual(
+            [
+                b"Using worker: host:os\n",
+                b"line 3 travis_ travis_\r\n",
+                b"line 5 Using worker: travis_"
+            ],
+            list(find_tag_lines(
+                b"line 1\nUsing worker: host:os\nline 3 travis_ travis_\r\n"
+                b"line 4\nline 5 Using worker: travis_",
+                markers
+            ))
+        )
+
+    def test_find_tag_lines_mmap(self):
+        """Test find_tag_lines_mmap()"""
+        markers = [b'travis_', b'Using worker:']
+
+        with open(TRAVIS_LOG_FILE, 'rb') as f:
+            expected = [
+                line for line in f
+                if b'travis_' in line or b'Using worker:' in line
+            ]
+
+            # use a small window, so lines span several windows
+            self.assertListEqual(
+                expected, list(find_tag_lines_mmap(f, markers, 4096))
+            )
+            self.assertListEqual(
+                expected, list(find_tag_lines_mmap(f, markers))
+            )
+
+    def test_parse_job_log_phases(self):
+        """Test parse_job_log_phases()"""
+        with open(TRAVIS_TIMING_TAGS_FILE, 'rb') as f:
+            lines = f.readlines()
+        worker_line = TRAVIS_LOG_WORKER.encode('utf-8') + b"\n"
+        log = [b"header line\n", worker_line] + lines + [worker_line]
+
+        timing_lines = []
+        worker_lines = []
+
+        def parse_worker(line):
+            """Record worker tag line, the worker is known."""
+            worker_lines.append(line)
+            return True
+
+        # header ends at the worker tag, worker tag in the body is ignored
+        self.assertEqual(LOG_PHASE_BODY, parse_job_log_phases(
+            log, LOG_PHASE_HEADER, True, timing_lines.append, parse_worker
+        ))
+        self.assertListEqual([worker_line], worker_lines)
+        self.assertListEqual(
+            [line for line in lines if b'travis_time:' in line], timing_lines
+        )
+
+        # continue in the body, without parsing timing tags
+        timing_lines = []
+        self.assertEqual(LOG_PHASE_BODY, parse_job_log_phases(
+            log, LOG_PHASE_BODY, False, timing_lines.append, parse_worker
+        ))
+        self.assertListEqual([], timing_lines)
+        self.assertListEqual([worker_line], worker_lines)
+
+        # header continues while the worker is unknown
+        self.assertEqual(LOG_PHASE_HEADER, parse_job_log_phases(
+            [b"header line\n", worker_line], LOG_PHASE_HEADER, True,
+            timing_lines.append, lambda line: False
+        ))
+
+    def test_find_tag_lines_mmap_long_lines(self):
+        """Test find_tag_lines_mmap() with lines spanning several windows"""
+        markers = [b'travis_', b'Using worker:']
+        window = mmap.ALLOCATIONGRANULARITY
+        progress = b"\r".join([b"Downloading 10%"] * (window // 4))
+        lines = [
+            # long line without marker
+            progress + b"\n",
+            # marker in the middle of a long line
+            progress + b"travis_fold:start:install\r" + progress + b"\n",
+            # marker spanning a window boundary
+            b"x" * (2 * window - 4) + b"travis_time:end\n",
+            b"Using worker: worker-linux\n",
+            # last line, without line ending
+            progress + b"travis_time:end"
+        ]
+        expected = [line for line in lines if b'travis_' in line or
+                    b'Using worker:' in line]
+
+        log_file = tempfile.TemporaryFile()
+        try:
+            log_file.write(b"".join(lines))
+            log_file.flush()
+            self.assertListEqual(
+                expected, list(find_tag_lines_mmap(log_file, markers, window))
+            )
+        finally:
+            log_file.close()
+
+    @unittest.skipUnless(tracemalloc, "tracemalloc is not available")
+    def test_find_tag_lines_mmap_memory(self):
+        """Test find_tag_lines_mmap() doesn't keep a long line in memory"""
+        markers = [b'travis_', b'Using worker:']
+        log_file = tempfile.TemporaryFile()
+        try:
+            # 8 MB line without marker
+            log_file.write(b"\r".join([b"Downloading 10%"] * 500000))
+            log_file.write(b"\ntravis_time:end\n")
+            log_file.flush()
+
+            tracemalloc.start()
+            try:
+                lines = list(find_tag_lines_mmap(
+                    log_file, markers, 16 * mmap.ALLOCATIONGRANULARITY
+                ))
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        finally:
+            log_file.close()
+
+        self.assertListEqual([b"travis_time:end\n"], lines)
+        self.assertLess(peak, 1024 * 1024)
+
 
 class TestTravisData(unittest.TestCase):
 
@@ -588,6 +930,64 @@ class TestTravisData(unittest.TestCase):
             "before_install.4", self.travis_data.get_substage_name("mvn -v")
         )
 
+    def test_create_substage_index(self):
+        """Test create_substage_index()"""
+        self.assertEqual(None, create_substage_index(None))
+        self.assertDictEqual({}, create_substage_index({}))
+
+        self.assertDictEqual(
+            {
+                "install.sh": "install.1",
+                "test.sh": "script.1",
+                "coverage.sh": "script.3"
+            },
+            create_substage_index({
+                "language": "python",
+                "install": ["install.sh"],
+                "script": ["test.sh", "test.sh", "coverage.sh", 123]
+            })
+        )
+
+        substage_index = create_substage_index(
+            json.loads(JOB_DATA_ANDROID)["job"]["config"]
+        )
+        self.assertEqual("before_install.4", substage_index["mvn -v"])
+        self.assertEqual("script.2", substage_index["./gradlew clean check"])
+        # first occurrence of a command
+        self.assertEqual("before_install.1", substage_index["cd $HOME"])
+
+    def test_get_substage_index(self):
+        """Test TravisData.get_substage_index()"""
+        self.assertEqual(None, self.travis_data.get_substage_index())
+
+        build_data = {"config": json.loads(JOB_DATA_ANDROID)["job"]["config"]}
+        self.travis_data.current_build_data = build_data
+        substage_index = self.travis_data.get_substage_index()
+        self.assertEqual("before_install.4", substage_index["mvn -v"])
+
+        # index is created once per build config
+        self.assertIs(substage_index, self.travis_data.get_substage_index())
+
+        # and is shared with the job parsers of the build
+        self.assertIs(
+            substage_index,
+            self.travis_data.create_job_parser().get_substage_index()
+        )
+        self.assertIs(
+            substage_index,
+            self.travis_data.create_job_parser(
+                {"config": build_data["config"], "number": "2"}
+            ).get_substage_index()
+        )
+
+        # index is updated when the build config changes
+        self.travis_data.current_build_data = {"config": {"script": ["a"]}}
+        self.assertDictEqual(
+            {"a": "script.1"}, self.travis_data.get_substage_index()
+        )
+        self.assertEqual("script.1", self.travis_data.get_substage_name("a"))
+        self.assertEqual("", self.travis_data.get_substage_name("mvn -v"))
+
     def test_process_no_build_job(self):
         """Test TravisData.process_build_job() with invalid parameters"""
         self.assertRaises(TypeError, self.travis_data.process_build_job)
@@ -671,6 +1071,173 @@ class TestTravisData(unittest.TestCase):
             self.travis_data.build_jobs["50398739"].properties.get_items()
         )
 
+    def test_prefetch_job_data(self):
+        """Test TravisData.prefetch_job_data()"""
+        connector = LocalTravisConnector()
+        self.travis_data = TravisData(TEST_REPO, 536, connector)
+        self.travis_data.prefetch_job_data([1, 2, None, 3])
+
+        self.assertListEqual(["jobs?ids[]=1&ids[]=2&ids[]=3"],
+                             connector.requests)
+        self.assertListEqual(
+            ["1", "2", "3"], sorted(self.travis_data.prefetched_job_data)
+        )
+        job_data = self.travis_data.get_job_data(2)
+        self.assertEqual("536.2", job_data["job"]["number"])
+        self.assertEqual("master", job_data["commit"]["branch"])
+        self.assertEqual(1, len(connector.requests))
+
+        # job data that isn't prefetched is retrieved separately
+        self.assertEqual(
+            "536.2", self.travis_data.get_job_data(2)["job"]["number"]
+        )
+        self.assertEqual("jobs/2", connector.requests[-1])
+
+    def test_process_build_jobs_prefetch(self):
+        """Test TravisData.process_build_jobs() prefetching job data"""
+        connector = LocalTravisConnector()
+        builds_data = {
+            "builds": [{"job_ids": [1, 2, 3], "event_type": "push"}]
+        }
+        for max_workers in [1, 2]:
+            connector.requests = []
+            self.travis_data = TravisData(TEST_REPO, 536, connector)
+            self.travis_data.builds_data = builds_data
+
+            build_jobs = [
+                build_job.get_property("job")
+                for build_job in self.travis_data.process_build_jobs(
+                    max_workers
+                )
+            ]
+            self.assertListEqual(["536.1", "536.2", "536.3"], build_jobs)
+            # only one request for the job data of all jobs
+            self.assertListEqual(
+                ["jobs?ids[]=1&ids[]=2&ids[]=3"], connector.requests
+            )
+            self.assertDictEqual({}, self.travis_data.prefetched_job_data)
+
+    def test_get_builds_data_pages(self):
+        """Test TravisData.get_builds_data_pages()"""
+        connector = PagedTravisConnector()
+        self.travis_data = TravisData(TEST_REPO, None, connector)
+
+        pages = [
+            [build["number"] for build in builds_data["builds"]]
+            for builds_data in self.travis_data.get_builds_data_pages()
+        ]
+        self.assertListEqual(
+            [["10", "9", "8"], ["7", "6", "5"], ["4", "3", "2"], ["1"]],
+            pages
+        )
+        self.assertListEqual(
+            [
+                "repos/{}/builds".format(TEST_REPO),
+                "repos/{}/builds?after_number=8".format(TEST_REPO),
+                "repos/{}/builds?after_number=5".format(TEST_REPO),
+                "repos/{}/builds?after_number=2".format(TEST_REPO)
+            ],
+            connector.requests
+        )
+
+        # range of builds
+        connector.requests = []
+        pages = [
+            [build["number"] for build in builds_data["builds"]]
+            for builds_data in self.travis_data.get_builds_data_pages(4, 8)
+        ]
+        self.assertListEqual([["8", "7", "6"], ["5", "4"]], pages)
+        self.assertEqual(2, len(connector.requests))
+        self.assertListEqual(
+            [{"id": 5}, {"id": 4}], self.travis_data.builds_data["commits"]
+        )
+
+    def test_process_builds(self):
+        """Test TravisData.process_builds()"""
+        self.travis_data = TravisData(
+            TEST_REPO, None, PagedTravisConnector()
+        )
+        build_jobs = [
+            build_job.get_property("job")
+            for build_job in self.travis_data.process_builds(3, 6, 2)
+        ]
+        self.assertListEqual(["536.60", "536.50", "536.40", "536.30"],
+                             build_jobs)
+        self.assertEqual(4, len(self.travis_data.build_jobs))
+
+    def test_process_build_jobs_concurrently(self):
+        """Test TravisData.process_build_jobs() with max_workers"""
+        builds_data = {
+            "builds": [{"job_ids": [1, 2, 3], "event_type": "push"}]
+        }
+        # first jobs take longest to retrieve
+        connector = LocalTravisConnector({"1": 0.2, "2": 0.1})
+
+        self.travis_data = TravisData(TEST_REPO, 536, connector)
+        self.travis_data.builds_data = builds_data
+        expected = [
+            build_job.to_dict()
+            for build_job in self.travis_data.process_build_jobs()
+        ]
+
+        self.travis_data = TravisData(TEST_REPO, 536, connector)
+        self.travis_data.builds_data = builds_data
+        build_jobs = [
+            build_job.to_dict()
+            for build_job in self.travis_data.process_build_jobs(3)
+        ]
+
+        # build jobs are returned in order of job_ids
+        self.assertListEqual(
+            ["536.1", "536.2", "536.3"],
+            [build_job["job"] for build_job in build_jobs]
+        )
+        self.assertListEqual(expected, build_jobs)
+        self.assertEqual(18, len(build_jobs[0]["stages"]))
+        self.assertEqual(3, len(self.travis_data.build_jobs))
+        self.assertEqual(
+            "536.2", self.travis_data.build_jobs["2"].get_property("job")
+        )
+        self.assertEqual(0, len(self.travis_data.current_job.stages.stages))
+
+    def test_process_build_jobs_streaming(self):
+        """Test TravisData.process_build_jobs() in streaming mode"""
+        builds_data = {
+            "builds": [
+                {"job_ids": [1, 2], "event_type": "push"},
+                {"job_ids": [3], "event_type": "push"}
+            ]
+        }
+        connector = LocalTravisConnector()
+
+        self.travis_data = TravisData(TEST_REPO, 536, connector)
+        self.travis_data.builds_data = builds_data
+        expected = [
+            build_job.to_dict()
+            for build_job in self.travis_data.process_build_jobs()
+        ]
+        self.assertEqual(3, len(self.travis_data.build_jobs))
+
+        for max_workers in (1, 2):
+            self.travis_data = TravisData(
+                TEST_REPO, 536, connector, streaming=True
+            )
+            self.travis_data.builds_data = builds_data
+            build_jobs = [
+                build_job.to_dict() for build_job in
+                self.travis_data.process_build_jobs(max_workers)
+            ]
+
+            # build jobs are returned, but not kept
+            self.assertListEqual(expected, build_jobs)
+            self.assertDictEqual({}, self.travis_data.build_jobs)
+
+        # single build job
+        build_job = self.travis_data.process_build_job("4")
+        self.assertEqual("536.4", build_job.get_property("job"))
+        self.assertDictEqual({}, self.travis_data.build_jobs)
+        self.assertIsNot(build_job, self.travis_data.current_job)
+
     def test_no_pull_request_data(self):
         """Test TravisData.process_pull_request_data() with no data"""
         self.travis_data.current_build_data = {"test_value": "empty"}
@@ -788,6 +1355,78 @@ class TestTravisData(unittest.TestCase):
             },
             self.travis_data.current_job.properties.get_items())
 
+    def test_shared_build_properties(self):
+        """Test sharing identical properties of the jobs of a build"""
+        self.travis_data.current_build_data = {
+            "event_type": "pull_request",
+            "pull_request": True,
+            "pull_request_title": "Test message",
+            "pull_request_number": 345
+        }
+
+        build_jobs = []
+        for job_data in (JOB_DATA_PYTHON, JOB_DATA_PYTHON, JOB_DATA_C):
+            self.travis_data.process_job_data(json.loads(job_data))
+            build_jobs.append(self.travis_data.current_job)
+            self.travis_data.current_job = BuildJob()
+        # job parser of the same build
+        job_parser = self.travis_data.create_job_parser()
+        job_parser.process_job_data(json.loads(JOB_DATA_PYTHON))
+        build_jobs.append(job_parser.current_job)
+
+        properties = [
+            build_job.properties.items for build_job in build_jobs
+        ]
+        # jobs with the same build matrix share the property value
+        self.assertIs(
+            properties[0]["build_matrix"], properties[1]["build_matrix"]
+        )
+        self.assertIs(
+            properties[0]["build_matrix"], properties[3]["build_matrix"]
+        )
+        self.assertIsNot(
+            properties[0]["build_matrix"], properties[2]["build_matrix"]
+        )
+        self.assertEqual(
+            'clang c osx TOXENV=py26',
+            properties[2]["build_matrix"]["summary"]
+        )
+        self.assertIs(properties[0]["branch"], properties[1]["branch"])
+        self.assertIs(properties[0]["repo"], properties[1]["repo"])
+
+        # all jobs share the pull request data
+        for job_properties in properties:
+            self.assertIs(
+                properties[0]["pull_request"], job_properties["pull_request"]
+            )
+        self.assertDictEqual(
+            {'is_pull_request': True, 'title': "Test message", 'number': 345},
+            properties[0]["pull_request"]
+        )
+
+        # changing a shared property of a job doesn't change the other jobs
+        build_jobs[1].add_property("pull_request", {"number": 346})
+        build_jobs[1].add_property("build_matrix", {"os": "osx"})
+        self.assertEqual(346, properties[1]["pull_request"]["number"])
+        self.assertEqual(345, properties[0]["pull_request"]["number"])
+        self.assertEqual("osx", properties[1]["build_matrix"]["os"])
+        self.assertEqual("linux", properties[0]["build_matrix"]["os"])
+        self.assertEqual("linux", properties[3]["build_matrix"]["os"])
+
+        # properties are not shared with jobs of another build
+        self.travis_data.current_build_data = {"pull_request": False}
+        self.travis_data.process_job_data(json.loads(JOB_DATA_PYTHON))
+        job_properties = self.travis_data.current_job.properties.items
+        self.assertIsNot(
+            properties[0]["build_matrix"], job_properties["build_matrix"]
+        )
+        self.assertDictEqual(
+            properties[0]["build_matrix"], job_properties["build_matrix"]
+        )
+        self.assertDictEqual(
+            {'is_pull_request': False}, job_properties["pull_request"]
+        )
+
     def test_no_logfile(self):
         """
         Test TravisData.parse_job_log_file() with an invalid or empty file
@@ -869,6 +1508,32 @@ class TestTravisData(unittest.TestCase):
                 .finished_at["timestamp_seconds"]
         )
 
+    def test_parse_job_log_stream_invalid_utf8(self):
+        """Test TravisData.parse_job_log_stream() with invalid UTF-8"""
+        self.travis_data.current_job.set_started_at("2014-08-17T13:40:14Z")
+
+        with open(TRAVIS_TIMING_TAGS_FILE, 'rb') as f:
+            lines = f.readlines()
+
+        # add invalid UTF-8 in unrelated log lines, in header and body
+        lines.insert(0, b"\xff\xfe invalid \xc3\x28\r\n")
+        lines.insert(1, TRAVIS_LOG_WORKER.encode('utf-8'))
+        lines.insert(4, b"progress \xe2\x82\r\n")
+
+        self.travis_data.parse_job_log_stream(lines)
+        self.assertEqual(4, len(self.travis_data.current_job.stages.stages))
+        self.assertEqual(
+            'after_script.2',
+            self.travis_data.current_job.stages.stages[1]["name"]
+        )
+        self.assertDictEqual(
+            {
+                'hostname': 'worker-linux-12-1.bb.travis-ci.org',
+                'os': 'travis-linux-11'
+            },
+            self.travis_data.current_job.get_property("worker")
+        )
+
     def test_parse_valid_job_log_travis_sample(self):
         """Test TravisData.parse_job_log_file() with a local logfile"""
         self.travis_data.current_job.set_started_at("2014-08-17T13:40:14Z")
@@ -876,6 +1541,224 @@ class TestTravisData(unittest.TestCase):
         self.assertTrue(self.travis_data.parse_job_log_file(TRAVIS_LOG_FILE))
         self._check_travis_log()
 
+    def test_parse_valid_job_log_travis_sample_mmap(self):
+        """Test TravisData.parse_job_log_file() with a memory mapped file"""
+        self.travis_data.current_job.set_started_at("2014-08-17T13:40:14Z")
+        # add a sample Travis CI logfile
+        self.assertTrue(
+            self.travis_data.parse_job_log_file(TRAVIS_LOG_FILE, True)
+        )
+        self._check_travis_log()
+
+    def test_parse_job_log_data(self):
+        """Test parse_job_log_data()"""
+        build_config = json.loads(JOB_DATA_PYTHON)["job"]["config"]
+        self.travis_data.current_build_data = {"config": build_config}
+        self.travis_data.current_job.set_started_at("2014-08-17T13:40:14Z")
+        self.assertTrue(self.travis_data.parse_job_log_file(TRAVIS_LOG_FILE))
+        expected = self.travis_data.current_job.stages
+
+        with open(TRAVIS_LOG_FILE, 'rb') as log_file:
+            log = log_file.read()
+
+        parsed_log = parse_job_log_data(log, build_config)
+        self.assertListEqual(expected.stages, parsed_log["stages"])
+        self.assertDictEqual(expected.started_at, parsed_log["started_at"])
+        self.assertDictEqual(expected.finished_at, parsed_log["finished_at"])
+        self.assertDictEqual(
+            self.travis_data.current_job.get_property("worker"),
+            parsed_log["worker"]
+        )
+        # result is picklable
+        self.assertDictEqual(
+            parsed_log, pickle.loads(pickle.dumps(parsed_log))
+        )
+
+        # string log
+        self.assertDictEqual(
+            parsed_log, parse_job_log_data(log.decode('utf-8'), build_config)
+        )
+
+        # no timing tags
+        parsed_log = parse_job_log_data(
+            [TRAVIS_LOG_WORKER + "\n"], check_timing_tags=False
+        )
+        self.assertListEqual([], parsed_log["stages"])
+        self.assertDictEqual(
+            {
+                "hostname": "worker-linux-12-1.bb.travis-ci.org",
+                "os": "travis-linux-11"
+            },
+            parsed_log["worker"]
+        )
+
+    def test_parse_job_log_data_process_pool(self):
+        """Test parse_job_log_data() in a process pool"""
+        with open(TRAVIS_LOG_FILE, 'rb') as log_file:
+            log = log_file.read()
+
+        pool = Pool(2)
+        try:
+            parsed_logs = pool.map(parse_job_log_data, [log] * 3)
+        finally:
+            pool.terminate()
+
+        self.assertListEqual([parse_job_log_data(log)] * 3, parsed_logs)
+
+    def test_process_parsed_job_log(self):
+        """Test TravisData.process_parsed_job_log()"""
+        self.assertRaises(
+            TypeError, self.travis_data.process_parsed_job_log, None
+        )
+        self.assertFalse(self.travis_data.process_parsed_job_log({}))
+
+        self.travis_data.current_build_data = {"config": {}}
+        with open(TRAVIS_LOG_FILE, 'rb') as log_file:
+            parsed_log = parse_job_log_data(log_file.read(), {})
+
+        self.assertTrue(self.travis_data.process_parsed_job_log(parsed_log))
+        self._check_travis_log()
+
+    def test_feed(self):
+        """Test TravisData.feed()"""
+        self.travis_data.current_job.set_started_at("2014-08-17T13:40:14Z")
+
+        with open(TRAVIS_LOG_FILE, 'rb') as f:
+            log = f.read()
+
+        # feed log in chunks, lines span several chunks
+        for position in range(0, len(log), 1000):
+            self.travis_data.feed(log[position:position + 1000])
+        self.travis_data.feed(b'', True)
+
+        self.assertEqual(len(log), self.travis_data.log_offset)
+        self.assertEqual(None, self.travis_data.partial_line)
+        self._check_travis_log()
+
+    def test_feed_string(self):
+        """Test TravisData.feed() with strings"""
+        self.travis_data.current_job.set_started_at("2014-08-17T13:40:14Z")
+
+        with open(TRAVIS_TIMING_TAGS_FILE, 'rb') as f:
+            log = f.read().decode('utf-8')
+
+        # last line is incomplete, it isn't parsed
+        self.travis_data.feed(log[:-10])
+        self.assertEqual(3, len(self.travis_data.current_job.stages.stages))
+        self.assertTrue(self.travis_data.travis_substage.has_started())
+
+        self.travis_data.feed(log[-10:])
+        self.assertEqual(4, len(self.travis_data.current_job.stages.stages))
+        self.assertEqual(len(log), self.travis_data.log_offset)
+
+    def test_checkpoint_restore(self):
+        """Test TravisData.checkpoint() and TravisData.restore()"""
+        self.travis_data.current_job.set_started_at("2014-08-17T13:40:14Z")
+
+        self.assertRaises(TypeError, self.travis_data.restore, None)
+        self.assertFalse(self.travis_data.restore({}))
+
+        with open(TRAVIS_LOG_FILE, 'rb') as f:
+            log = f.read()
+
+        middle = len(log) // 2
+        self.travis_data.feed(log[:middle])
+        checkpoint = self.travis_data.checkpoint()
+
+        self.assertEqual(middle, checkpoint["log_offset"])
+        self.assertTrue(log[:middle].endswith(checkpoint["partial_line"]))
+        self.assertEqual(LOG_PHASE_BODY, checkpoint["log_phase"])
+        self.assertEqual(
+            len(self.travis_data.current_job.stages.stages),
+            len(checkpoint["stages"]["stages"])
+        )
+
+        self.assertTrue(checkpoint["timing_tags"])
+        self.assertEqual(
+            self.travis_data.current_job.get_property("started_at"),
+            checkpoint["started_at"]
+        )
+
+        # resume parsing with a new TravisData instance,
+        # started_at and parsing timing tags are restored
+        self.travis_data = TravisData(TEST_REPO, TEST_BUILD)
+        self.assertTrue(self.travis_data.restore(checkpoint))
+        self.travis_data.feed(log[middle:], True)
+
+        self.assertEqual(len(log), self.travis_data.log_offset)
+        self._check_travis_log()
+        self.assertEqual(
+            'worker-linux-12-1.bb.travis-ci.org',
+            self.travis_data.current_job.get_property("worker")["hostname"]
+        )
+
+    def test_log_phase(self):
+        """Test parsing the worker tag in the log header only"""
+        self.travis_data.current_job.set_started_at("2014-08-17T13:40:14Z")
+        self.assertEqual(LOG_PHASE_HEADER, self.travis_data.log_phase)
+
+        with open(TRAVIS_TIMING_TAGS_FILE, 'rb') as f:
+            lines = f.readlines()
+
+        # header ends at the worker tag
+        worker_line = TRAVIS_LOG_WORKER.encode('utf-8') + b"\n"
+        self.travis_data.feed(b"header line\n" + worker_line)
+        self.assertEqual(LOG_PHASE_BODY, self.travis_data.log_phase)
+
+        # worker tag after the header is ignored
+        self.travis_data.feed(b"".join(lines[:2]))
+        self.travis_data.feed(b"Using worker: other-worker:other-os\n")
+        self.travis_data.feed(b"".join(lines[2:]), True)
+        self.assertEqual(4, len(self.travis_data.current_job.stages.stages))
+        self.assertEqual(
+            'worker-linux-12-1.bb.travis-ci.org',
+            self.travis_data.current_job.get_property("worker")["hostname"]
+        )
+
+        # header ends when the first timed command starts
+        self.travis_data = TravisData(TEST_REPO, TEST_BUILD)
+        self.travis_data.current_job.set_started_at("2014-08-17T13:40:14Z")
+        self.travis_data.parse_job_log_stream(lines[:1])
+        self.assertEqual(LOG_PHASE_BODY, self.travis_data.log_phase)
+        self.travis_data.parse_job_log_stream(
+            lines[:2] + [worker_line] + lines[2:]
+        )
+        self.assertEqual(4, len(self.travis_data.current_job.stages.stages))
+        self.assertEqual(
+            None, self.travis_data.current_job.get_property("worker")
+        )
+
+        # without a worker tag or timed commands, all lines are header
+        self.travis_data = TravisData(TEST_REPO, TEST_BUILD)
+        self.travis_data.parse_job_log_stream([b"line\n", b"travis_fold\n"])
+        self.assertEqual(LOG_PHASE_HEADER, self.travis_data.log_phase)
+
+        # parse_job_log_data() only parses the worker tag in the header
+        parsed_log = parse_job_log_data(lines[:2] + [worker_line] + lines[2:])
+        self.assertEqual(4, len(parsed_log["stages"]))
+        self.assertEqual(None, parsed_log["worker"])
+        parsed_log = parse_job_log_data([worker_line] + lines)
+        self.assertEqual(4, len(parsed_log["stages"]))
+        self.assertEqual(
+            'worker-linux-12-1.bb.travis-ci.org',
+            parsed_log["worker"]["hostname"]
+        )
+
+    def test_get_tagged_body_lines(self):
+        """Test get_tagged_body_lines()"""
+        self.assertListEqual([], list(get_tagged_body_lines(iter([]))))
+        self.assertListEqual(
+            [b"travis_fold:end", b"a travis_time:start"],
+            list(get_tagged_body_lines(iter([
+                b"travis_fold:end", b"Using worker: a:b",
+                b"a travis_time:start", b"line"
+            ])))
+        )
+        self.assertListEqual(
+            [u"travis_fold:end"],
+            list(get_tagged_body_lines(iter([u"line", u"travis_fold:end"])))
+        )
+
     def test_parse_travis_log(self):
         """Test TravisData.parse_job_log() : download and parse"""
         self.travis_data.current_job.set_started_at("2014-08-17T13:40:14Z")
@@ -26,7 +26,8 @@ setup(
     install_requires=get_requirements('requirements.txt'),
     tests_require=get_requirements('requirements_test.txt'),
     extras_require={
-        'native': get_requirements('requirements_native.txt')
+        'native': get_requirements('requirements_native.txt'),
+        'async': get_requirements('requirements_async.txt')
     },
 
     # metadata